@@ -0,0 +1,114 @@
+"""
+Benchmark: serializace velkého seznamu objektů - původní cesta vs. orjson vs. streamování.
+
+Spuštění (bez DB, syntetická data ve tvaru objektů s technologiemi, bateriemi a kontakty):
+    python bench_json_lists.py --count 20000
+
+Každý režim běží v samostatném procesu, aby šla čistě změřit špičková paměť (max RSS):
+  legacy - list přes fix_mongo_id + jsonable_encoder + json.dumps (dřívější cesta FastAPI)
+  orjson - list bez _id (projekce) + FastJSONResponse v jednom kuse
+  stream - json_array_chunks nad asynchronním zdrojem (jako Motor kurzor), bloky se zahazují
+"""
+import argparse
+import asyncio
+import json
+import resource
+import subprocess
+import sys
+import time
+import uuid
+
+from bson import ObjectId
+
+MODES = ("legacy", "orjson", "stream")
+
+
+def make_object(i: int, with_id: bool) -> dict:
+    doc = {
+        "id": uuid.uuid4().hex, "name": f"Objekt {i} - Plzeň", "address": f"Náměstí Republiky {i}, Plzeň",
+        "description": "Pobočka banky, EZS + EPS", "groupId": f"g{i % 20}", "lat": 49.7 + i * 1e-5, "lng": 13.3,
+        "rev": i, "updatedAt": "2024-05-01T10:00:00",
+        "technologies": [{
+            "id": uuid.uuid4().hex, "name": f"Ústředna {t}", "type": "EZS", "deviceType": "Ústředna", "location": "Suterén",
+            "batteries": [{
+                "id": uuid.uuid4().hex, "capacityAh": 17.0, "voltageV": 12.0, "installDate": "2022-01-10",
+                "lastCheckDate": "2024-01-10", "nextReplacementDate": "2025-01-10", "status": "HEALTHY",
+                "serialNumber": f"SN-{i}-{t}-{b}", "typeId": "yuasa-npl17",
+            } for b in range(2)],
+        } for t in range(3)],
+        "contacts": [{"id": uuid.uuid4().hex, "name": "Jan Novák", "role": "Správce", "phone": "+420 777 123 456", "email": "novak@example.cz"}],
+        "tasks": [], "logEntries": [], "scheduledEvents": [], "files": [], "pendingIssues": [],
+    }
+    if with_id: doc["_id"] = ObjectId()
+    return doc
+
+
+async def cursor(count: int, with_id: bool):
+    """Napodobí Motor kurzor - dokumenty vznikají (dekódují se) až při iteraci."""
+    for i in range(count):
+        yield make_object(i, with_id)
+        if i % 100 == 0: await asyncio.sleep(0)
+
+
+def fix_mongo_id(document: dict):
+    if "_id" in document:
+        if "id" not in document: document["id"] = str(document["_id"])
+        del document["_id"]
+    return document
+
+
+async def run_legacy(count: int) -> int:
+    from fastapi.encoders import jsonable_encoder
+    docs = [fix_mongo_id(d) async for d in cursor(count, with_id=True)]
+    content = jsonable_encoder(docs)
+    return len(json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8"))
+
+
+async def run_orjson(count: int) -> int:
+    from jsonstream import FastJSONResponse
+    docs = [d async for d in cursor(count, with_id=False)]
+    return len(FastJSONResponse(docs).body)
+
+
+async def run_stream(count: int) -> int:
+    from jsonstream import json_array_chunks
+    size = 0
+    async for chunk in json_array_chunks(cursor(count, with_id=False)): size += len(chunk)
+    return size
+
+
+def run_mode(mode: str, count: int):
+    runner = {"legacy": run_legacy, "orjson": run_orjson, "stream": run_stream}[mode]
+    # Importy a zahřátí mimo měření
+    asyncio.run(runner(10))
+    base_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    size = asyncio.run(runner(count))
+    elapsed = time.perf_counter() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps({"mode": mode, "seconds": elapsed, "bytes": size, "peakRssMb": peak_rss / 1024,
+                      "extraRssMb": (peak_rss - base_rss) / 1024}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--count", type=int, default=20000)
+    parser.add_argument("--mode", choices=MODES)
+    args = parser.parse_args()
+
+    if args.mode:
+        run_mode(args.mode, args.count)
+        return
+
+    print(f"{args.count} objektů")
+    print(f"{'režim':<8} {'čas [s]':>9} {'obj/s':>10} {'MB/s':>8} {'velikost [MB]':>14} {'max RSS [MB]':>13} {'navíc [MB]':>11}")
+    for mode in MODES:
+        out = subprocess.run([sys.executable, __file__, "--mode", mode, "--count", str(args.count)],
+                             capture_output=True, text=True, check=True).stdout
+        r = json.loads(out.strip().splitlines()[-1])
+        print(f"{mode:<8} {r['seconds']:>9.2f} {args.count / r['seconds']:>10.0f} {r['bytes'] / r['seconds'] / 1e6:>8.1f} "
+              f"{r['bytes'] / 1e6:>14.1f} {r['peakRssMb']:>13.1f} {r['extraRssMb']:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
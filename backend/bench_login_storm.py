@@ -0,0 +1,74 @@
+"""
+Benchmark: latence nesouvisejícího endpointu během "bouře" přihlášení.
+
+Spuštění proti běžícímu backendu:
+    python bench_login_storm.py --url http://localhost:8000 --email admin@appartus.cz --password admin123
+
+Paralelně posílá --logins přihlášení (--concurrency vláken) a mezitím měří latenci
+GET /openapi.json (nevyžaduje DB ani bcrypt - měří jen dostupnost event loopu).
+Bez poolu pro bcrypt vychází p99 ve stovkách ms, s poolem zůstává v jednotkách ms.
+"""
+import argparse
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(values, pct):
+    if not values: return 0.0
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--email", default="admin@appartus.cz")
+    parser.add_argument("--password", default="admin123")
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=32)
+    args = parser.parse_args()
+
+    login_codes = {}
+    codes_lock = threading.Lock()
+    probe_latencies = []
+    done = threading.Event()
+
+    def login(_):
+        r = requests.post(f"{args.url}/auth/login", json={"email": args.email, "password": args.password})
+        with codes_lock:
+            login_codes[r.status_code] = login_codes.get(r.status_code, 0) + 1
+
+    def probe():
+        session = requests.Session()
+        while not done.is_set():
+            start = time.perf_counter()
+            session.get(f"{args.url}/openapi.json")
+            probe_latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.01)
+
+    # Zahřátí (první /openapi.json se generuje)
+    requests.get(f"{args.url}/openapi.json")
+
+    probe_thread = threading.Thread(target=probe)
+    probe_thread.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(login, range(args.logins)))
+    elapsed = time.perf_counter() - start
+    done.set()
+    probe_thread.join()
+
+    print(f"Přihlášení: {args.logins} za {elapsed:.2f} s, stavové kódy: {login_codes}")
+    print(f"Nesouvisející endpoint ({len(probe_latencies)} požadavků):")
+    print(f"  p50 = {statistics.median(probe_latencies):.1f} ms")
+    print(f"  p99 = {percentile(probe_latencies, 99):.1f} ms")
+    print(f"  max = {max(probe_latencies):.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+In-process publisher změn pro push kanál (SSE).
+
+Každé připojení má vlastní omezenou frontu. Publikování nikdy neblokuje: když klient
+nestíhá a fronta je plná, dostane místo dalších událostí signál k resynchronizaci.
+"""
+import asyncio
+from typing import Optional, Set
+
+SUBSCRIBER_QUEUE_SIZE = 256
+RESYNC = {"entity": "resync", "global": True}
+
+class Subscription:
+    def __init__(self, group_id: Optional[str], internal: bool = False):
+        self.group_id = group_id
+        self.internal = internal  # odběr uvnitř API (index hledání, mapa) - nepotřebuje groupId/rev
+        self.queue: "asyncio.Queue[dict]" = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+
+    def wants(self, event: dict) -> bool:
+        """Bez filtru vše; s filtrem skupiny jen události té skupiny a globální (skupiny, typy baterií)."""
+        if self.group_id is None or event.get("global"): return True
+        return event.get("groupId") == self.group_id
+
+class ChangeBroker:
+    def __init__(self):
+        self._subscribers: Set[Subscription] = set()
+        self.published = 0
+        self.dropped = 0
+
+    def subscribe(self, group_id: Optional[str] = None, internal: bool = False) -> Subscription:
+        sub = Subscription(group_id, internal)
+        self._subscribers.add(sub)
+        return sub
+
+    @property
+    def clients(self) -> int:
+        """Počet připojených klientů (bez interních odběrů)."""
+        return sum(1 for sub in self._subscribers if not sub.internal)
+
+    def unsubscribe(self, sub: Subscription):
+        self._subscribers.discard(sub)
+
+    def publish(self, event: dict):
+        self.published += 1
+        for sub in list(self._subscribers):
+            if sub.overflowed or not sub.wants(event): continue
+            try:
+                sub.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Klient nestíhá - vyprázdníme frontu a pošleme jen pokyn k resynchronizaci
+                sub.overflowed = True
+                self.dropped += 1
+                while not sub.queue.empty(): sub.queue.get_nowait()
+                sub.queue.put_nowait(RESYNC)
+
+    def stats(self) -> dict:
+        return {"subscribers": len(self._subscribers), "clients": self.clients, "published": self.published, "dropped": self.dropped}
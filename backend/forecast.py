@@ -0,0 +1,119 @@
+"""
+Životní cyklus baterií: termíny výměny, stavy a výhled výměn po měsících.
+
+Celá flotila se převede do sloupcových NumPy polí a termíny i stavy se spočítají jedním
+vektorovým průchodem. Termín výměny = datum instalace (jinak výroby) + životnost z katalogu
+typu, jinak výchozí životnost skupiny. WARNING začíná `notificationLeadTimeWeeks` před termínem,
+CRITICAL v den termínu. Baterie bez data instalace i výroby si ponechají ručně zadaný termín.
+"""
+import re
+from typing import Dict, List, Optional
+
+import numpy as np
+
+DEFAULT_BATTERY_LIFE_MONTHS = 24
+DEFAULT_LEAD_TIME_WEEKS = 4
+STATUS_NAMES = np.array(["HEALTHY", "WARNING", "CRITICAL"])
+HEALTHY, WARNING, CRITICAL = 0, 1, 2
+STATUS_CODES = {name: code for code, name in enumerate(STATUS_NAMES.tolist())}
+UNKNOWN_TYPE = "?"
+_DATE = re.compile(r"\d{4}-\d{2}-\d{2}")
+
+def parse_dates(values: List[Optional[str]]) -> np.ndarray:
+    """ISO data (i s časem) na datetime64[D]; chybějící nebo neplatné = NaT."""
+    return np.array([v[:10] if isinstance(v, str) and _DATE.match(v) else "NaT" for v in values], dtype="datetime64[D]")
+
+def format_dates(dates: np.ndarray) -> np.ndarray:
+    return np.where(np.isnat(dates), "", np.datetime_as_string(dates, unit="D"))
+
+def add_months(dates: np.ndarray, months: np.ndarray) -> np.ndarray:
+    """Přičte měsíce; den se omezí na konec cílového měsíce (31. 1. + 1 = 28./29. 2.)."""
+    valid = ~np.isnat(dates)
+    safe = np.where(valid, dates, np.datetime64("1970-01-01"))
+    month = safe.astype("datetime64[M]")
+    day = (safe - month.astype("datetime64[D]")).astype(np.int64)
+    target = month + months.astype("timedelta64[M]")
+    days_in_month = ((target + 1).astype("datetime64[D]") - target.astype("datetime64[D]")).astype(np.int64)
+    result = target.astype("datetime64[D]") + np.minimum(day, days_in_month - 1).astype("timedelta64[D]")
+    return np.where(valid, result, np.datetime64("NaT"))
+
+def _parameter_key(row: dict) -> str:
+    """Skupina baterie bez typu z katalogu podle parametrů ("12 V / 17 Ah"); hodnoty mohou být i řetězce."""
+    try:
+        voltage, capacity = float(row.get("voltageV") or 0), float(row.get("capacityAh") or 0)
+    except (TypeError, ValueError):
+        return UNKNOWN_TYPE
+    return f"{voltage:g} V / {capacity:g} Ah" if voltage and capacity else UNKNOWN_TYPE
+
+class Fleet:
+    """Sloupcová data baterií (index i = jedna baterie)."""
+    def __init__(self, rows: List[dict], group_of_object: Dict[str, Optional[str]],
+                 groups: Dict[str, dict], types: Dict[str, dict]):
+        n = len(rows)
+        self.size = n
+        self.group_of_object = group_of_object
+        self.keys = [(r.get("objectId"), r.get("technologyId"), r.get("id")) for r in rows]
+        self.install = parse_dates([r.get("installDate") for r in rows])
+        self.manufacture = parse_dates([r.get("manufactureDate") for r in rows])
+        self.current_due = parse_dates([r.get("nextReplacementDate") for r in rows])
+        self.current_status = np.array([r.get("status") or "" for r in rows], dtype=object)
+        self.current_code = np.array([STATUS_CODES.get(r.get("status"), -1) for r in rows], dtype=np.int64)
+        # Hodnoty tak, jak byly načtené - podmínka zápisu (optimistický zámek proti souběžné úpravě)
+        self.read_values = [(r.get("nextReplacementDate"), r.get("status")) for r in rows]
+
+        life = np.full(n, DEFAULT_BATTERY_LIFE_MONTHS, dtype=np.int64)
+        lead_weeks = np.full(n, DEFAULT_LEAD_TIME_WEEKS, dtype=np.int64)
+        type_keys = []
+        for i, r in enumerate(rows):
+            group = groups.get(group_of_object.get(r.get("objectId"))) or {}
+            bt = types.get(r.get("typeId")) or {}
+            life[i] = bt.get("lifeMonths") or group.get("defaultBatteryLifeMonths") or DEFAULT_BATTERY_LIFE_MONTHS
+            lead_weeks[i] = group.get("notificationLeadTimeWeeks") or DEFAULT_LEAD_TIME_WEEKS
+            # Bez typu z katalogu seskupíme podle parametrů (pro nákup stačí "12 V / 17 Ah")
+            type_keys.append(r.get("typeId") if bt else _parameter_key(r))
+        self.life_months = life
+        self.lead_days = lead_weeks * 7
+        self.type_keys = np.array(type_keys, dtype=object)
+
+def compute_lifecycle(fleet: Fleet, today: np.datetime64):
+    """Vrátí (termín výměny, kód stavu) pro všechny baterie najednou."""
+    base = np.where(np.isnat(fleet.install), fleet.manufacture, fleet.install)
+    due = np.where(np.isnat(base), fleet.current_due, add_months(base, fleet.life_months))
+    has_due = ~np.isnat(due)
+    safe_due = np.where(has_due, due, today)
+    status = np.where(safe_due <= today, CRITICAL,
+                      np.where(safe_due - fleet.lead_days.astype("timedelta64[D]") <= today, WARNING, HEALTHY))
+    # Bez jakéhokoli termínu se stav nepočítá - zůstává současný
+    status = np.where(has_due, status, -1)
+    return due, status
+
+def escalate(fleet: Fleet, status: np.ndarray) -> np.ndarray:
+    """Stav se přepočtem jen zhoršuje - snížit ho (např. po ručním nastavení CRITICAL) smí jen člověk."""
+    return np.where(status >= 0, np.maximum(status, fleet.current_code), status)
+
+def changed_mask(fleet: Fleet, due: np.ndarray, status: np.ndarray) -> np.ndarray:
+    new_status = np.where(status >= 0, STATUS_NAMES[np.clip(status, 0, 2)], fleet.current_status).astype(object)
+    same_due = (due == fleet.current_due) | (np.isnat(due) & np.isnat(fleet.current_due))
+    return (new_status != fleet.current_status) | ~same_due
+
+def monthly_forecast(fleet: Fleet, due: np.ndarray, start: np.datetime64, months: int) -> dict:
+    """Počty výměn po měsících a typech od měsíce `start`; dřívější termíny = `overdue`."""
+    start_month = start.astype("datetime64[M]")
+    has_due = ~np.isnat(due)
+    offset = np.where(has_due, (np.where(has_due, due, start).astype("datetime64[M]") - start_month).astype(np.int64), -1)
+    overdue = has_due & (offset < 0)
+    in_window = has_due & (offset >= 0) & (offset < months)
+
+    keys, inverse = np.unique(fleet.type_keys.astype(str), return_inverse=True)
+    counts = np.zeros((len(keys), months), dtype=np.int64)
+    np.add.at(counts, (inverse[in_window], offset[in_window]), 1)
+    overdue_counts = np.bincount(inverse[overdue], minlength=len(keys))
+
+    labels = [str(start_month + i) for i in range(months)]
+    per_type = [
+        {"type": str(key), "counts": counts[i].tolist(), "overdue": int(overdue_counts[i]),
+         "total": int(counts[i].sum() + overdue_counts[i])}
+        for i, key in enumerate(keys) if counts[i].any() or overdue_counts[i]
+    ]
+    per_type.sort(key=lambda t: -t["total"])
+    return {"months": labels, "totals": counts.sum(axis=0).tolist(), "overdue": int(overdue.sum()), "types": per_type}
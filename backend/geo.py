@@ -0,0 +1,88 @@
+"""
+Dlaždice a shlukování bodů pro mapu.
+
+Dlaždice jsou stejné jako u Leaflet/OSM (Web Mercator, z/x/y). Shluky se počítají v mřížce
+zarovnané na dlaždici, takže výsledek jedné dlaždice nezávisí na výřezu klienta a dá se cachovat.
+"""
+import math
+from typing import Dict, Iterable, List, Optional, Tuple
+
+MAX_LAT = 85.05112878
+CLUSTER_GRID = 4            # buněk na stranu dlaždice (256 px / 4 = shluk na 64 px)
+POLYGON_STEP_DEG = 1.0      # hustota vrcholů na vodorovných hranách dotazového polygonu
+POLYGON_PAD_DEG = 0.01
+# Pořadí závažnosti stavů baterie pro "nejhorší stav" shluku
+STATUS_RANK = {"REPLACED": 0, "HEALTHY": 1, "WARNING": 2, "CRITICAL": 3}
+
+Bounds = Tuple[float, float, float, float]  # minLng, minLat, maxLng, maxLat
+
+def tile_coords(lng: float, lat: float, zoom: int) -> Tuple[float, float]:
+    """Spojité souřadnice dlaždice (celá část = x/y dlaždice)."""
+    n = 2 ** zoom
+    lat = max(-MAX_LAT, min(MAX_LAT, lat))
+    x = (lng + 180.0) / 360.0 * n
+    y = (1.0 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2.0 * n
+    return min(max(x, 0.0), n - 1e-9), min(max(y, 0.0), n - 1e-9)
+
+def tile_bounds(zoom: int, x: int, y: int) -> Bounds:
+    n = 2 ** zoom
+    def lat(ty: int) -> float: return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * ty / n))))
+    return x / n * 360.0 - 180.0, lat(y + 1), (x + 1) / n * 360.0 - 180.0, lat(y)
+
+def tile_range(bbox: Bounds, zoom: int) -> Tuple[int, int, int, int]:
+    """Rozsah dlaždic výřezu (x0, y0, x1, y1), obě meze včetně."""
+    min_lng, min_lat, max_lng, max_lat = bbox
+    x0, y0 = tile_coords(min_lng, max_lat, zoom)
+    x1, y1 = tile_coords(max_lng, min_lat, zoom)
+    return int(x0), int(y0), int(x1), int(y1)
+
+def tiles_in_bbox(bbox: Bounds, zoom: int, limit: Optional[int] = None) -> List[Tuple[int, int]]:
+    """Dlaždice výřezu. S `limit` se počet ověří před výčtem (velký výřez na vysokém zoomu) - ValueError."""
+    x0, y0, x1, y1 = tile_range(bbox, zoom)
+    if limit is not None and (x1 - x0 + 1) * (y1 - y0 + 1) > limit: raise ValueError("Too many tiles")
+    return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+def bbox_polygon(bbox: Bounds) -> Optional[dict]:
+    """
+    GeoJSON polygon pro $geoWithin, který obsahuje celý obdélník v lat/lng.
+    Hrany 2dsphere polygonu jsou ortodromy, proto vodorovné hrany zahustíme a trochu rozšíříme.
+    Přes půl zeměkoule polygon nejde - vrací None (filtr se pak nepoužije).
+    """
+    min_lng, min_lat, max_lng, max_lat = bbox
+    if max_lng - min_lng >= 180.0: return None
+    min_lat, max_lat = max(-90.0, min_lat - POLYGON_PAD_DEG), min(90.0, max_lat + POLYGON_PAD_DEG)
+    steps = max(1, math.ceil((max_lng - min_lng) / POLYGON_STEP_DEG))
+    lngs = [min_lng + (max_lng - min_lng) * i / steps for i in range(steps + 1)]
+    ring = [[lng, min_lat] for lng in lngs] + [[lng, max_lat] for lng in reversed(lngs)]
+    ring.append(ring[0])
+    return {"type": "Polygon", "coordinates": [ring]}
+
+def worst_status(statuses: Iterable[Optional[str]]) -> Optional[str]:
+    known = [s for s in statuses if s in STATUS_RANK]
+    return max(known, key=STATUS_RANK.get) if known else None
+
+def cluster_tile(points: List[dict], zoom: int, x: int, y: int, grid: Optional[int] = CLUSTER_GRID) -> List[dict]:
+    """
+    Body jedné dlaždice (dicty s lat, lng, worstStatus) jako značky a shluky.
+    Buňka s jediným bodem je značka; grid=None vrací jen značky.
+    """
+    if grid is None: return [{"type": "marker", **p} for p in points]
+    cells: Dict[Tuple[int, int], List[dict]] = {}
+    for p in points:
+        fx, fy = tile_coords(p["lng"], p["lat"], zoom)
+        key = (min(grid - 1, int((fx - x) * grid)), min(grid - 1, int((fy - y) * grid)))
+        cells.setdefault(key, []).append(p)
+
+    features = []
+    for members in cells.values():
+        if len(members) == 1:
+            features.append({"type": "marker", **members[0]})
+            continue
+        lngs, lats = [m["lng"] for m in members], [m["lat"] for m in members]
+        features.append({
+            "type": "cluster", "count": len(members),
+            "lat": sum(lats) / len(lats), "lng": sum(lngs) / len(lngs),
+            "bbox": [min(lngs), min(lats), max(lngs), max(lats)],
+            "worstStatus": worst_status(m.get("worstStatus") for m in members),
+        })
+    return features
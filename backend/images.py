@@ -0,0 +1,109 @@
+"""
+Náhledy fotek pro /uploads/<soubor>?w=<šířka>.
+
+WebP odvozeniny (náhled a střední velikost) se generují v process poolu - při nahrání
+na pozadí, případně líně při prvním požadavku - a cachují na disku v uploads/.derivatives/
+podle hashe zdroje a šířky.
+"""
+import os
+import re
+import asyncio
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional
+from urllib.parse import parse_qs
+
+import anyio
+from fastapi.staticfiles import StaticFiles
+from starlette.responses import FileResponse
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".tif", ".tiff"}
+DERIVATIVE_WIDTHS = (320, 1280)  # náhled, střední náhled
+DERIVATIVE_DIR = ".derivatives"
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+WEBP_QUALITY = 80
+
+_executor: Optional[ProcessPoolExecutor] = None
+_in_flight: Dict[str, asyncio.Future] = {}
+_background_tasks: set = set()
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None: _executor = ProcessPoolExecutor(max_workers=IMAGE_WORKERS)
+    return _executor
+
+def render_derivative(src: str, dst: str, width: int) -> str:
+    """Běží v pracovním procesu: zmenší obrázek na `width` px šířky a uloží jako WebP."""
+    from PIL import Image, ImageOps
+
+    with Image.open(src) as img:
+        img = ImageOps.exif_transpose(img)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+        img.thumbnail((width, width * 10))
+        tmp = f"{dst}.{os.getpid()}.tmp"
+        img.save(tmp, "WEBP", quality=WEBP_QUALITY, method=4)
+    os.replace(tmp, dst)
+    return dst
+
+def is_image(path: str) -> bool:
+    return os.path.splitext(path)[1].lower() in IMAGE_EXTENSIONS
+
+def snap_width(width: int) -> int:
+    """Požadovanou šířku zaokrouhlí na nejbližší vyšší podporovanou (omezí počet variant v cache)."""
+    for w in DERIVATIVE_WIDTHS:
+        if width <= w: return w
+    return DERIVATIVE_WIDTHS[-1]
+
+def derivative_path(upload_dir: str, src: str, width: int) -> str:
+    stem = os.path.splitext(os.path.basename(src))[0]
+    if re.fullmatch(r"[0-9a-f]{64}", stem):
+        key = stem  # obsahově adresovaný soubor - jméno už je SHA-256
+    else:
+        st = os.stat(src)
+        key = hashlib.sha256(f"{src}:{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()
+    return os.path.join(upload_dir, DERIVATIVE_DIR, key[:2], f"{key}_{width}.webp")
+
+async def ensure_derivative(upload_dir: str, src: str, width: int) -> str:
+    """Vrátí cestu k odvozenině, případně ji vygeneruje (souběžné požadavky čekají na stejný job)."""
+    dst = derivative_path(upload_dir, src, width)
+    if os.path.exists(dst): return dst
+    if dst in _in_flight: return await _in_flight[dst]
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    future = asyncio.get_running_loop().run_in_executor(_get_executor(), render_derivative, src, dst, width)
+    _in_flight[dst] = future
+    try:
+        return await future
+    finally:
+        _in_flight.pop(dst, None)
+
+def schedule_derivatives(upload_dir: str, src: str):
+    """Po nahrání fotky spustí generování všech velikostí na pozadí (chyby se ignorují - zkusí se znovu líně)."""
+    async def _run(width: int):
+        try: await ensure_derivative(upload_dir, src, width)
+        except Exception: pass
+    for width in DERIVATIVE_WIDTHS:
+        task = asyncio.create_task(_run(width))
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
+
+def remove_derivatives(upload_dir: str, src: str):
+    for width in DERIVATIVE_WIDTHS:
+        try: os.remove(derivative_path(upload_dir, src, width))
+        except (FileNotFoundError, OSError): pass
+
+class UploadFiles(StaticFiles):
+    """StaticFiles pro /uploads - s parametrem ?w= vrací WebP náhled místo originálu."""
+    async def get_response(self, path: str, scope):
+        width = parse_qs(scope.get("query_string", b"").decode()).get("w", [""])[0]
+        if not width.isdigit() or int(width) <= 0 or not is_image(path):
+            return await super().get_response(path, scope)
+        full_path, stat_result = await anyio.to_thread.run_sync(self.lookup_path, path)
+        if stat_result is None or not os.path.isfile(full_path):
+            return await super().get_response(path, scope)
+        try:
+            dst = await ensure_derivative(str(self.directory), full_path, snap_width(int(width)))
+        except Exception:
+            # Nečitelný/nepodporovaný obrázek - pošleme originál
+            return await super().get_response(path, scope)
+        return FileResponse(dst, media_type="image/webp", headers={"Cache-Control": "public, max-age=31536000, immutable"})
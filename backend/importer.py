@@ -0,0 +1,205 @@
+"""
+Hromadný import objektů, technologií a baterií z CSV / XLSX.
+
+Jeden řádek = jedna baterie (s objektem a technologií, do kterých patří); řádek bez údajů
+o baterii jen založí objekt nebo technologii. Soubor se čte po řádcích (XLSX v režimu read_only),
+takže paměť nezávisí na jeho délce. Chybějící id objektu a technologie se odvodí deterministicky
+z názvů (uuid5), baterie z výrobního čísla - opakovaný import stejného souboru proto nic nezdvojí.
+Baterie bez batteryId i serialNumber se odmítne (dvě stejné baterie v technologii nejde rozlišit).
+Objekt nebo technologie odkázané jen id (bez názvu) musí existovat - to ověřuje volající proti DB.
+
+Sloupce (hlavička, na velikosti písmen nezáleží):
+  objekt:     objectId, objectName, address, description, internalNotes, groupId (id nebo název), lat, lng
+  technologie: technologyId, technologyName, technologyType, deviceType, location
+  baterie:    batteryId, typeId (id nebo název z katalogu), capacityAh, voltageV, serialNumber, installDate,
+              lastCheckDate, nextReplacementDate, manufactureDate, status, notes
+"""
+import csv
+import os
+import re
+import uuid
+from datetime import date, datetime
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from openpyxl import load_workbook
+from pydantic import ValidationError
+
+from forecast import DEFAULT_BATTERY_LIFE_MONTHS
+from models import Battery, BuildingObject, Technology
+from scheduler import add_months
+from search import fold
+
+OBJECT_COLUMNS = {"objectId": "id", "objectName": "name", "address": "address", "description": "description",
+                  "internalNotes": "internalNotes", "groupId": "groupId", "lat": "lat", "lng": "lng"}
+TECHNOLOGY_COLUMNS = {"technologyId": "id", "technologyName": "name", "technologyType": "type",
+                      "deviceType": "deviceType", "location": "location"}
+BATTERY_COLUMNS = {"batteryId": "id", "typeId": "typeId", "capacityAh": "capacityAh", "voltageV": "voltageV",
+                   "serialNumber": "serialNumber", "installDate": "installDate", "lastCheckDate": "lastCheckDate",
+                   "nextReplacementDate": "nextReplacementDate", "manufactureDate": "manufactureDate",
+                   "status": "status", "notes": "notes"}
+NUMBER_FIELDS = {"lat", "lng", "capacityAh", "voltageV"}
+DATE_FIELDS = {"installDate", "lastCheckDate", "nextReplacementDate", "manufactureDate"}
+STATUSES = {"HEALTHY", "WARNING", "CRITICAL", "REPLACED"}
+SUPPORTED_EXTENSIONS = (".csv", ".xlsx")
+# Hodnoty, které dostane nově založený objekt / technologie, když je soubor neobsahuje
+OBJECT_DEFAULTS = {"name": "", "address": "", "description": ""}
+TECHNOLOGY_DEFAULTS = {"name": "", "type": "", "deviceType": "Zařízení", "location": ""}
+_CANONICAL = {c.lower(): c for c in [*OBJECT_COLUMNS, *TECHNOLOGY_COLUMNS, *BATTERY_COLUMNS]}
+_CZECH_DATE = re.compile(r"^(\d{1,2})\.\s*(\d{1,2})\.\s*(\d{4})$")
+_ID_NAMESPACE = uuid.UUID("5b0f3a52-8f4e-4a8e-9a53-0c6d2f1e7b11")
+
+Row = Dict[str, str]
+
+class RowError(ValueError):
+    def __init__(self, messages: List[str]):
+        super().__init__("; ".join(messages))
+        self.messages = messages
+
+def _cell(value: Any) -> str:
+    if value is None: return ""
+    if isinstance(value, datetime): return value.date().isoformat()
+    if isinstance(value, date): return value.isoformat()
+    # Excel ukládá čísla jako float - výrobní číslo 12345 nesmí skončit jako "12345.0"
+    if isinstance(value, float) and value.is_integer(): return str(int(value))
+    return str(value).strip()
+
+def _header(values: List[Any]) -> List[Optional[str]]:
+    return [_CANONICAL.get(_cell(v).lower()) for v in values]
+
+def iter_csv_rows(path: str) -> Iterator[Tuple[int, Row]]:
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        delimiter = max(";,\t", key=f.readline().count)  # český Excel ukládá CSV se středníky
+        f.seek(0)
+        reader = csv.reader(f, delimiter=delimiter)
+        header = _header(next(reader, []))
+        for number, values in enumerate(reader, start=2):
+            row = {key: _cell(v) for key, v in zip(header, values) if key}
+            if any(row.values()): yield number, row
+
+def iter_xlsx_rows(path: str) -> Iterator[Tuple[int, Row]]:
+    """První list sešitu."""
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = _header(list(next(rows, [])))
+        for number, values in enumerate(rows, start=2):
+            row = {key: _cell(v) for key, v in zip(header, values) if key}
+            if any(row.values()): yield number, row
+    finally:
+        workbook.close()
+
+def iter_rows(path: str, filename: str) -> Iterator[Tuple[int, Row]]:
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext == ".xlsx": return iter_xlsx_rows(path)
+    if ext == ".csv": return iter_csv_rows(path)
+    raise ValueError(f"Unsupported file type {ext or '?'} (expected {', '.join(SUPPORTED_EXTENSIONS)})")
+
+def derived_id(*parts: str) -> str:
+    return uuid.uuid5(_ID_NAMESPACE, "|".join(fold(p) for p in parts)).hex
+
+def _pick(row: Row, columns: Dict[str, str]) -> Dict[str, str]:
+    return {field: row[column] for column, field in columns.items() if row.get(column)}
+
+def _parse_date(value: str) -> str:
+    m = _CZECH_DATE.match(value)
+    if m: return date(int(m.group(3)), int(m.group(2)), int(m.group(1))).isoformat()
+    return date.fromisoformat(value[:10]).isoformat()
+
+def _convert(values: Dict[str, str], errors: List[str], prefix: str) -> Dict[str, Any]:
+    out: Dict[str, Any] = {}
+    for field, value in values.items():
+        try:
+            if field in NUMBER_FIELDS: out[field] = float(value.replace(" ", "").replace(",", "."))
+            elif field in DATE_FIELDS: out[field] = _parse_date(value)
+            else: out[field] = value
+        except ValueError:
+            errors.append(f"{prefix}{field}: invalid value '{value}'")
+    return out
+
+def _validation_messages(e: ValidationError, prefix: str) -> List[str]:
+    return [f"{prefix}{'.'.join(str(p) for p in err['loc'])}: {err['msg']}" for err in e.errors()]
+
+class RowParser:
+    """Řádek -> (objekt, technologie, baterie) ověřené modely. Katalog typů a skupiny drží v paměti."""
+    def __init__(self, battery_types: List[dict], groups: List[dict]):
+        self.types: Dict[str, dict] = {}
+        for bt in battery_types:
+            self.types[bt["id"]] = bt
+            if bt.get("name"): self.types.setdefault(fold(bt["name"]).strip(), bt)
+        self.groups: Dict[str, dict] = {}
+        for g in groups:
+            self.groups[g["id"]] = g
+            if g.get("name"): self.groups.setdefault(fold(g["name"]).strip(), g)
+
+    def parse(self, number: int, row: Row) -> Tuple[dict, Optional[dict], Optional[dict]]:
+        """
+        Vrací jen pole uvedená v souboru (plus id), aby import nepřepsal existující data výchozími
+        hodnotami. Objekt a technologie stačí odkázat id; bez id je povinný název. Chyby -> RowError.
+        """
+        errors: List[str] = []
+        obj = _convert(_pick(row, OBJECT_COLUMNS), errors, "")
+        tech = _convert(_pick(row, TECHNOLOGY_COLUMNS), errors, "technology.")
+        battery = _convert(_pick(row, BATTERY_COLUMNS), errors, "battery.")
+
+        group = None
+        if obj.get("groupId"):
+            group = self.groups.get(obj["groupId"]) or self.groups.get(fold(obj["groupId"]).strip())
+            if group: obj["groupId"] = group["id"]
+            else: errors.append(f"groupId: unknown group '{obj['groupId']}'")
+        if "id" not in obj:
+            if not obj.get("name"): errors.append("objectId or objectName is required")
+            else: obj["id"] = derived_id("object", obj["name"], obj.get("address", ""))
+        if errors: raise RowError(errors)
+        try:
+            BuildingObject(**{**OBJECT_DEFAULTS, **obj})
+        except ValidationError as e:
+            errors += _validation_messages(e, "")
+
+        if battery and not tech: errors.append("battery row needs technologyName or technologyId")
+        if tech:
+            if "id" not in tech and not tech.get("name"): errors.append("technology.technologyName or technologyId is required")
+            elif "id" not in tech: tech["id"] = derived_id("technology", obj["id"], tech.get("name", ""), tech.get("location", ""))
+            try:
+                Technology(**{**TECHNOLOGY_DEFAULTS, **tech})
+            except ValidationError as e:
+                errors += _validation_messages(e, "technology.")
+
+        if battery and tech.get("id"):
+            battery = self._complete_battery(battery, group, errors)
+            if "id" not in battery:
+                if battery.get("serialNumber"): battery["id"] = derived_id("battery", obj["id"], tech["id"], battery["serialNumber"])
+                else: errors.append("battery.batteryId or battery.serialNumber is required")
+            try:
+                Battery(**{"id": "", **battery})  # chybějící id už je hlášené výše
+            except ValidationError as e:
+                errors += _validation_messages(e, "battery.")
+        if errors: raise RowError(errors)
+        return obj, tech or None, battery or None
+
+    def _complete_battery(self, battery: dict, group: Optional[dict], errors: List[str]) -> dict:
+        """Doplní parametry z katalogu a výchozí termíny (kontrola = instalace, výměna = instalace + životnost)."""
+        bt = None
+        if battery.get("typeId"):
+            bt = self.types.get(battery["typeId"]) or self.types.get(fold(battery["typeId"]).strip())
+            if not bt: errors.append(f"battery.typeId: unknown battery type '{battery['typeId']}'")
+            else: battery["typeId"] = bt["id"]
+        for field in ("capacityAh", "voltageV"):
+            if field not in battery and bt and bt.get(field) is not None: battery[field] = bt[field]
+        status = battery.get("status", "HEALTHY").upper()
+        if status not in STATUSES: errors.append(f"battery.status: must be one of {', '.join(sorted(STATUSES))}")
+        battery["status"] = status
+        if battery.get("installDate"):
+            battery.setdefault("lastCheckDate", battery["installDate"])
+            if "nextReplacementDate" not in battery:
+                life = (bt or {}).get("lifeMonths") or (group or {}).get("defaultBatteryLifeMonths") or DEFAULT_BATTERY_LIFE_MONTHS
+                battery["nextReplacementDate"] = add_months(date.fromisoformat(battery["installDate"]), life).isoformat()
+        return battery
+
+def unresolved_references(obj: dict, tech: Optional[dict], known_objects: set, known_technologies: set) -> List[str]:
+    """Chyby pro objekt / technologii odkázané jen id, které nejsou v DB ani dříve v souboru."""
+    errors = []
+    if "name" not in obj and obj["id"] not in known_objects:
+        errors.append(f"objectId: unknown object '{obj['id']}' (add objectName to create it)")
+    elif tech and "name" not in tech and (obj["id"], tech["id"]) not in known_technologies:
+        errors.append(f"technologyId: unknown technology '{tech['id']}' (add technologyName to create it)")
+    return errors
@@ -0,0 +1,46 @@
+"""
+Rychlá JSON odpověď (orjson) a streamované JSON pole pro velké seznamy.
+
+stream_json_array kóduje dokumenty průběžně, jak je vrací Motor kurzor, a posílá je po blocích
+~64 kB - celý seznam se v paměti nedrží ani jako list dictů, ani jako jeden velký řetězec.
+"""
+from typing import Any, AsyncIterable, AsyncIterator
+
+import orjson
+from bson import ObjectId
+from fastapi.responses import JSONResponse, StreamingResponse
+
+STREAM_CHUNK_BYTES = 64 * 1024
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+def _default(o: Any):
+    if isinstance(o, ObjectId): return str(o)
+    raise TypeError(f"Type is not JSON serializable: {type(o).__name__}")
+
+def dumps(content: Any) -> bytes:
+    return orjson.dumps(content, default=_default, option=ORJSON_OPTIONS)
+
+class FastJSONResponse(JSONResponse):
+    """Výchozí odpověď API - orjson (datetime nativně, ObjectId jako řetězec)."""
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+async def json_array_chunks(docs: AsyncIterable[dict]) -> AsyncIterator[bytes]:
+    buffer = bytearray(b"[")
+    first = True
+    async for doc in docs:
+        if not first: buffer += b","
+        first = False
+        buffer += dumps(doc)
+        if len(buffer) >= STREAM_CHUNK_BYTES:
+            yield bytes(buffer)
+            buffer.clear()
+    buffer += b"]"
+    yield bytes(buffer)
+
+def stream_json_array(docs: AsyncIterable[dict]) -> StreamingResponse:
+    """
+    JSON pole z asynchronního zdroje (kurzor, generátor). Dokumenty musí být bez `_id`
+    (projekce {"_id": 0}). Chyba uprostřed proudu už nezmění stavový kód - odpověď se utne.
+    """
+    return StreamingResponse(json_array_chunks(docs), media_type="application/json")
@@ -3,21 +3,31 @@ import shutil
 import uuid
 import json
 import io
-from typing import List, Optional, Dict, Any
+import zipfile
+import tempfile
+import hashlib
+import time
+import re
+import math
+import asyncio
+import logging
+from typing import List, Optional, Dict, Any, AsyncIterator, Tuple
+from collections import OrderedDict
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime, timedelta
 
-from fastapi import FastAPI, HTTPException, Depends, status, Header, Body, UploadFile, File
+from fastapi import FastAPI, HTTPException, Depends, status, Header, Body, UploadFile, File, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import StreamingResponse
+from fastapi.responses import StreamingResponse, Response, FileResponse
+from urllib.parse import quote
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne, InsertOne, DeleteOne, DeleteMany, ReturnDocument, ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure, DuplicateKeyError, BulkWriteError
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from bson import ObjectId
-
-import qrcode
-from qrcode.image.styledpil import StyledPilImage
-from qrcode.image.styles.moduledrawers import RoundedModuleDrawer
+import numpy as np
 
 # --- IMPORT MODELŮ ---
 # Předpokládáme, že soubor models.py je ve stejné složce jako main.py
@@ -26,6 +36,16 @@ from models import (
     ReportMeasurement, BillingInfo, Address, UserDB, Technology,
     Battery, BatteryTypeModel
 )
+from images import UploadFiles, is_image, schedule_derivatives, remove_derivatives
+from qr import get_qr_png, build_qr_sheet_pdf
+from report_template import render_report_html, render_report_pdf
+from events import ChangeBroker, RESYNC
+from search import SearchIndex
+from jsonstream import FastJSONResponse, stream_json_array
+from forecast import DEFAULT_LEAD_TIME_WEEKS, Fleet, STATUS_NAMES, compute_lifecycle, escalate, changed_mask, format_dates, monthly_forecast
+from importer import OBJECT_DEFAULTS, TECHNOLOGY_DEFAULTS, RowError, RowParser, iter_rows, unresolved_references
+from scheduler import Scheduler, INTERVAL_MONTHS, advance_date
+from geo import CLUSTER_GRID, tile_coords, tile_bounds, tiles_in_bbox, bbox_polygon, worst_status, cluster_tile
 
 # --- KONFIGURACE ---
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://mongo:27017")
@@ -36,12 +56,35 @@ ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD", "admin123")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24 * 7 
 PUBLIC_URL = os.getenv("PUBLIC_URL", "http://battery.appartus.cz") 
-app = FastAPI(title="BatteryGuard API")
+STATS_CACHE_TTL_SECONDS = int(os.getenv("STATS_CACHE_TTL_SECONDS", "30"))
+USER_CACHE_TTL_SECONDS = int(os.getenv("USER_CACHE_TTL_SECONDS", "60"))
+USER_CACHE_MAX_SIZE = int(os.getenv("USER_CACHE_MAX_SIZE", "1024"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "16"))
+UPLOAD_MAX_BYTES = int(os.getenv("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+REPORT_RENDER_CACHE_TTL_SECONDS = int(os.getenv("REPORT_RENDER_CACHE_TTL_SECONDS", "3600"))
+PDF_DIR = os.getenv("PDF_DIR", os.path.join("cache", "pdf"))
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", "2"))
+SYNC_SETTLE_SECONDS = int(os.getenv("SYNC_SETTLE_SECONDS", "5"))
+CHANGE_FEED_MODE = os.getenv("CHANGE_FEED_MODE", "local")  # local = publikuje API proces, mongo = change streamy (replica set)
+CHANGE_STREAM_MAX_RETRY_SECONDS = int(os.getenv("CHANGE_STREAM_MAX_RETRY_SECONDS", "60"))
+SSE_HEARTBEAT_SECONDS = int(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+SEARCH_REBUILD_SECONDS = int(os.getenv("SEARCH_REBUILD_SECONDS", "900"))
+MAP_TILE_CACHE_TTL_SECONDS = int(os.getenv("MAP_TILE_CACHE_TTL_SECONDS", "600"))
+MAP_MAX_TILES = 100
+MAP_MARKER_ZOOM = 16  # od tohoto zoomu už jen jednotlivé značky
+LIFECYCLE_WRITE_BATCH = 1000
+FORECAST_MAX_MONTHS = 60
+SCHEDULER_ENABLED = os.getenv("SCHEDULER_ENABLED", "1") == "1"
+SCHEDULER_INTERVAL_SECONDS = int(os.getenv("SCHEDULER_INTERVAL_SECONDS", "3600"))
+app = FastAPI(title="BatteryGuard API", default_response_class=FastJSONResponse)
+logger = logging.getLogger("batteryguard")
 
 # --- STATIC FILES ---
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
+app.mount("/uploads", UploadFiles(directory=UPLOAD_DIR), name="uploads")
 
 # --- CORS ---
 app.add_middleware(
@@ -50,6 +93,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Sync-Epoch", "X-Sync-Cursor"],
 )
 
 # --- DB & AUTH INIT ---
@@ -75,8 +119,293 @@ def fix_mongo_id(document: dict):
         del document["_id"]
     return document
 
-def verify_password(plain, hashed): return pwd_context.verify(plain, hashed)
-def get_password_hash(pwd): return pwd_context.hash(pwd)
+# --- CACHE ---
+class TTLCache:
+    """In-process LRU cache s expirací položek a počítadly zásahů (hit/miss)."""
+    def __init__(self, ttl_seconds: float, max_size: int = 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None: del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def set(self, key: str, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size: self._data.popitem(last=False)
+
+    def invalidate(self, key: Optional[str] = None):
+        if key is None: self._data.clear()
+        else: self._data.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxSize": self.max_size, "ttlSeconds": self.ttl_seconds,
+                "hits": self.hits, "misses": self.misses}
+
+# Agregace pro dashboard, klíč = groupId (nebo "*" pro celou síť).
+# Mutace baterií a úkolů ji mažou, TTL je jen pojistka proti přímým zásahům do DB.
+stats_cache = TTLCache(STATS_CACHE_TTL_SECONDS, max_size=256)
+
+def invalidate_stats_cache():
+    stats_cache.invalidate()
+
+# Přihlášení uživatelé podle `sub` z tokenu (email) - ušetří dotaz do users u každého requestu
+user_cache = TTLCache(USER_CACHE_TTL_SECONDS, max_size=USER_CACHE_MAX_SIZE)
+
+# --- BATERIE (SAMOSTATNÁ KOLEKCE) ---
+# Baterie jsou uložené v kolekci `batteries` (pole modelu Battery + objectId, technologyId).
+# API je dál vrací vnořené v technologies[].batteries - skládají se až při čtení.
+BATTERY_PROTECTED_FIELDS = ["_id", "id", "objectId", "technologyId"]
+
+def battery_to_doc(obj_id: str, tech_id: str, battery: dict) -> dict:
+    doc = {k: v for k, v in battery.items() if k != "_id"}
+    if "id" not in doc: doc["id"] = uuid.uuid4().hex
+    doc["objectId"] = obj_id
+    doc["technologyId"] = tech_id
+    return doc
+
+def split_batteries(obj_id: str, technologies: List[dict]) -> List[dict]:
+    """Vyjme vnořené baterie z technologií (in-place) a vrátí je jako dokumenty kolekce."""
+    docs = []
+    for tech in technologies or []:
+        for bat in tech.get("batteries") or []:
+            docs.append(battery_to_doc(obj_id, tech.get("id"), bat))
+        tech["batteries"] = []
+    return docs
+
+async def attach_batteries(objects: List[dict]) -> List[dict]:
+    """Doplní baterie z kolekce zpět do technologies[].batteries (tvar API jako dřív)."""
+    if not objects: return objects
+    query = {"objectId": {"$in": [o.get("id") for o in objects]}}
+    by_tech: Dict[tuple, List[dict]] = {}
+    async for bat in db.batteries.find(query, {"_id": 0}).sort("_id", 1):
+        key = (bat.pop("objectId"), bat.pop("technologyId"))
+        by_tech.setdefault(key, []).append(bat)
+    for obj in objects:
+        for tech in obj.get("technologies") or []:
+            stored = by_tech.get((obj.get("id"), tech.get("id")), [])
+            # Dokud neproběhne migrace, může objekt mít ještě vnořené baterie - kolekce má přednost
+            stored_ids = {b.get("id") for b in stored}
+            embedded = [b for b in tech.get("batteries") or [] if b.get("id") not in stored_ids]
+            tech["batteries"] = embedded + stored
+    return objects
+
+OBJECT_STREAM_BATCH = 200
+
+async def iter_with_batteries(cursor) -> AsyncIterator[dict]:
+    """Objekty z kurzoru s doplněnými bateriemi, po dávkách (pro streamované odpovědi)."""
+    batch: List[dict] = []
+    async for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= OBJECT_STREAM_BATCH:
+            for obj in await attach_batteries(batch): yield obj
+            batch = []
+    for obj in await attach_batteries(batch): yield obj
+
+# --- REVIZE OBJEKTŮ (INKREMENTÁLNÍ SYNC) ---
+# Každá změna objektu dostane monotónní `rev` z čítače objects_rev a `updatedAt`.
+# Smazané objekty zanechají tombstone v `object_tombstones`. `epoch` se mění při obnově ze zálohy,
+# klient pak musí načíst vše znovu.
+OBJECT_REV_COUNTER = "objects_rev"
+
+async def reserve_object_revisions(count: int) -> int:
+    """Rezervuje `count` po sobě jdoucích revizí jedním $inc a vrátí první z nich."""
+    doc = await db.counters.find_one_and_update(
+        {"id": OBJECT_REV_COUNTER},
+        {"$inc": {"seq": count}, "$setOnInsert": {"epoch": uuid.uuid4().hex}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return doc["seq"] - count + 1
+
+async def next_object_revision() -> int:
+    return await reserve_object_revisions(1)
+
+async def revision_stamp() -> dict:
+    return {"rev": await next_object_revision(), "updatedAt": datetime.utcnow().isoformat()}
+
+async def stamped(update: dict) -> dict:
+    """Doplní do update dokumentu objektu novou revizi (rev + updatedAt)."""
+    update.setdefault("$set", {}).update(await revision_stamp())
+    return update
+
+async def touch_object(obj_id: str):
+    """Nová revize objektu při změně dat mimo jeho dokument (baterie)."""
+    await db.objects.update_one({"id": obj_id}, {"$set": await revision_stamp()})
+
+async def sync_position() -> Tuple[str, int]:
+    """
+    (epoch, cursor) pro plné načtení /objects. Kurzor je poslední revize zapsaná před
+    SYNC_SETTLE_SECONDS - pozdější (i rozepsané) změny klient dostane z /objects/changes.
+    """
+    counter = await db.counters.find_one_and_update(
+        {"id": OBJECT_REV_COUNTER},
+        {"$setOnInsert": {"seq": 0, "epoch": uuid.uuid4().hex}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    cutoff = (datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)).isoformat()
+    cursor = 0
+    for coll, ts_field in ((db.objects, "updatedAt"), (db.object_tombstones, "deletedAt")):
+        last = await coll.find_one({"rev": {"$gt": cursor}, ts_field: {"$lte": cutoff}}, {"_id": 0, "rev": 1}, sort=[("rev", -1)])
+        if last: cursor = max(cursor, last["rev"])
+    return counter["epoch"], min(cursor, counter["seq"])
+
+async def migrate_object_revisions():
+    """Jednorázově přidělí revizi objektům, které ji nemají (vzniklé před zavedením rev) - jinak je sync nevidí."""
+    if await db.migrations.find_one({"id": "objects_rev_v1"}): return
+    migrated = 0
+    while True:
+        ids = [d["id"] async for d in db.objects.find({"rev": {"$exists": False}}, {"_id": 0, "id": 1}).limit(1000)]
+        if not ids: break
+        first = await reserve_object_revisions(len(ids))
+        now = datetime.utcnow().isoformat()
+        await db.objects.bulk_write([
+            UpdateOne({"id": obj_id, "rev": {"$exists": False}}, {"$set": {"rev": first + i, "updatedAt": now}})
+            for i, obj_id in enumerate(ids)
+        ], ordered=False)
+        migrated += len(ids)
+    await db.migrations.update_one(
+        {"id": "objects_rev_v1"},
+        {"$set": {"completedAt": datetime.utcnow().isoformat(), "migrated": migrated}},
+        upsert=True
+    )
+
+# --- ŽIVÉ ZMĚNY (PUSH) ---
+# Kompaktní události pro GET /events: {entity, op, id, groupId, rev, data}. V režimu "mongo"
+# je místo endpointů publikuje watcher nad change streamy (vyžaduje replica set).
+broker = ChangeBroker()
+
+async def notify_object(obj_id: str, op: str, data: Any = None, group_id: Optional[str] = None):
+    if CHANGE_FEED_MODE != "local": return
+    # groupId/rev potřebují jen připojení klienti; interním odběrům stačí id - bez klientů žádný dotaz
+    doc = (await db.objects.find_one({"id": obj_id}, {"_id": 0, "rev": 1, "groupId": 1}) or {}) if broker.clients else {}
+    broker.publish({"entity": "object", "op": op, "id": obj_id,
+                    "groupId": doc.get("groupId", group_id), "rev": doc.get("rev"), "data": data})
+
+async def notify_report(report_id: str, op: str, object_id: Optional[str], data: Any = None):
+    if CHANGE_FEED_MODE != "local": return
+    obj = await db.objects.find_one({"id": object_id}, {"_id": 0, "groupId": 1}) if object_id else None
+    broker.publish({"entity": "report", "op": op, "id": report_id, "objectId": object_id,
+                    "groupId": (obj or {}).get("groupId"), "data": data})
+
+def notify_global(entity: str, op: str, item_id: Optional[str] = None, data: Any = None):
+    if CHANGE_FEED_MODE != "local": return
+    broker.publish({"entity": entity, "op": op, "id": item_id, "global": True, "data": data})
+
+# Dokončené online migrace. Do jejich dokončení čtení (plán, dashboard, deník) slučuje i data
+# dosud vnořená v objektech; po dokončení se stav drží v paměti a další dotaz se nedělá.
+migrations_done: Dict[str, bool] = {}
+
+async def migration_completed(name: str) -> bool:
+    if not migrations_done.get(name):
+        migrations_done[name] = await db.migrations.find_one({"id": name}, {"_id": 1}) is not None
+    return migrations_done[name]
+
+async def migrate_embedded_batteries():
+    """Jednorázová online migrace vnořených baterií do kolekce `batteries` (idempotentní, po objektech)."""
+    if await db.migrations.find_one({"id": "batteries_v1"}): return
+    migrated = 0
+    cursor = db.objects.find({"technologies.batteries.0": {"$exists": True}}, {"_id": 0, "id": 1, "technologies": 1})
+    async for obj in cursor:
+        docs = split_batteries(obj["id"], obj["technologies"])
+        if docs:
+            await db.batteries.bulk_write([
+                UpdateOne({"objectId": d["objectId"], "technologyId": d["technologyId"], "id": d["id"]},
+                          {"$setOnInsert": d}, upsert=True)
+                for d in docs
+            ], ordered=False)
+        await db.objects.update_one({"id": obj["id"]}, {"$set": {"technologies.$[].batteries": []}})
+        migrated += len(docs)
+    await db.migrations.update_one(
+        {"id": "batteries_v1"},
+        {"$set": {"completedAt": datetime.utcnow().isoformat(), "migrated": migrated}},
+        upsert=True
+    )
+    migrations_done["batteries_v1"] = True
+    invalidate_stats_cache()
+
+# --- DENÍK (SAMOSTATNÁ KOLEKCE) ---
+# Záznamy deníku jsou v kolekci `logs` (pole LogEntry + objectId), dokument objektu má logEntries
+# prázdné. GET /objects/{id} vrací jen posledních LOG_EMBED_LIMIT záznamů, starší přes /objects/{id}/logs.
+LOG_EMBED_LIMIT = 20
+LOG_PAGE_SIZE = 50
+
+def log_to_doc(obj_id: str, log: dict) -> dict:
+    doc = {k: v for k, v in log.items() if k != "_id"}
+    if "id" not in doc: doc["id"] = uuid.uuid4().hex
+    doc["objectId"] = obj_id
+    return doc
+
+def log_upsert(doc: dict) -> UpdateOne:
+    """Idempotentní zápis záznamu (opakované odeslání z offline klienta nevytvoří duplikát)."""
+    return UpdateOne({"objectId": doc["objectId"], "id": doc["id"]}, {"$setOnInsert": doc}, upsert=True)
+
+def log_cursor_token(entry: dict) -> str:
+    return f"{entry.get('date') or ''}|{entry.get('id')}"
+
+async def load_logs(obj_id: str, before: Optional[str] = None, limit: int = LOG_PAGE_SIZE) -> List[dict]:
+    """Záznamy objektu od nejnovějšího, keyset podle (date, id). `before` = token z log_cursor_token."""
+    query: Dict[str, Any] = {"objectId": obj_id}
+    before_date, before_id = (before.split("|", 1) + [None])[:2] if before else (None, None)
+    if before:
+        query["$or"] = [{"date": {"$lt": before_date}}, {"date": before_date, "id": {"$lt": before_id or ""}}]
+    logs = [d async for d in db.logs.find(query, {"_id": 0, "objectId": 0}).sort([("date", -1), ("id", -1)]).limit(limit)]
+
+    # Dokud neproběhne migrace, může objekt mít ještě vnořené záznamy - kolekce má přednost
+    if await migration_completed("logs_v1"): return logs
+    obj = await db.objects.find_one({"id": obj_id, "logEntries.0": {"$exists": True}}, {"_id": 0, "logEntries": 1})
+    if obj:
+        stored_ids = {d.get("id") for d in logs}
+        embedded = [e for e in obj["logEntries"] if e.get("id") not in stored_ids and
+                    (not before or (e.get("date") or "", e.get("id") or "") < (before_date, before_id or ""))]
+        logs = sorted(logs + embedded, key=lambda e: (e.get("date") or "", e.get("id") or ""), reverse=True)[:limit]
+    return logs
+
+async def migrate_embedded_logs():
+    """Jednorázová online migrace vnořených logEntries do kolekce `logs` (idempotentní, po objektech)."""
+    if await db.migrations.find_one({"id": "logs_v1"}): return
+    migrated = 0
+    async for obj in db.objects.find({"logEntries.0": {"$exists": True}}, {"_id": 0, "id": 1, "logEntries": 1}):
+        docs = [log_to_doc(obj["id"], e) for e in obj["logEntries"]]
+        await db.logs.bulk_write([log_upsert(d) for d in docs], ordered=False)
+        await db.objects.update_one({"id": obj["id"]}, {"$set": {"logEntries": []}})
+        migrated += len(docs)
+    await db.migrations.update_one(
+        {"id": "logs_v1"},
+        {"$set": {"completedAt": datetime.utcnow().isoformat(), "migrated": migrated}},
+        upsert=True
+    )
+    migrations_done["logs_v1"] = True
+
+# --- HESLA (BCRYPT MIMO EVENT LOOP) ---
+# bcrypt trvá stovky ms CPU - běží v omezeném poolu vláken, aby neblokoval ostatní requesty.
+# Při plné frontě odmítneme hned (429) místo hromadění čekajících přihlášení.
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
+_password_jobs = 0  # běžící + čekající úlohy
+
+async def run_password_job(fn, *args):
+    global _password_jobs
+    if _password_jobs >= PASSWORD_HASH_WORKERS + PASSWORD_HASH_MAX_QUEUE:
+        raise HTTPException(429, "Server is busy, try again", headers={"Retry-After": "1"})
+    _password_jobs += 1
+    try:
+        return await asyncio.get_running_loop().run_in_executor(password_executor, fn, *args)
+    finally:
+        _password_jobs -= 1
+
+async def verify_password(plain, hashed): return await run_password_job(pwd_context.verify, plain, hashed)
+async def get_password_hash(pwd): return await run_password_job(pwd_context.hash, pwd)
 def create_access_token(data: dict):
     to_encode = data.copy()
     to_encode.update({"exp": datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)})
@@ -88,14 +417,23 @@ async def get_current_user(authorization: str = Header(None)):
     try:
         scheme, token = authorization.split()
         if scheme.lower() != 'bearer': raise HTTPException(401, "Invalid scheme")
+    except Exception: raise HTTPException(401, "Invalid token")
+    return await get_user_from_token(token)
+
+async def get_user_from_token(token: str):
+    try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email = payload.get("sub")
         if not email: raise HTTPException(401, "Invalid payload")
     except Exception: raise HTTPException(401, "Invalid token")
-    
-    user = await db.users.find_one({"email": email})
-    if not user: raise HTTPException(401, "User not found")
-    return fix_mongo_id(user)
+
+    user = user_cache.get(email)
+    if user is None:
+        user = await db.users.find_one({"email": email})
+        if not user: raise HTTPException(401, "User not found")
+        user = fix_mongo_id(user)
+        user_cache.set(email, user)
+    return dict(user)
 
 async def get_current_admin(user: dict = Depends(get_current_user)):
     if user.get("role") != "ADMIN": raise HTTPException(403, "Not admin")
@@ -107,7 +445,7 @@ async def get_current_admin(user: dict = Depends(get_current_user)):
 @app.post("/auth/login")
 async def login(creds: dict = Body(...)):
     user = await db.users.find_one({"email": creds.get("email")})
-    if not user or not verify_password(creds.get("password"), user["hashed_password"]):
+    if not user or not await verify_password(creds.get("password"), user["hashed_password"]):
         raise HTTPException(400, "Bad credentials")
     if not user.get("isAuthorized"): raise HTTPException(403, "Not authorized")
     return {"token": create_access_token({"sub": user["email"]}), "user": fix_mongo_id(user)}
@@ -118,9 +456,10 @@ async def register(req: dict = Body(...)):
     new_user = {
         "id": uuid.uuid4().hex, "name": req["name"], "email": req["email"], 
         "role": "TECHNICIAN", "isAuthorized": False, 
-        "hashed_password": get_password_hash(req["password"]), "createdAt": datetime.utcnow().isoformat()
+        "hashed_password": await get_password_hash(req["password"]), "createdAt": datetime.utcnow().isoformat()
     }
     await db.users.insert_one(new_user)
+    user_cache.invalidate(new_user["email"])
     return {"status": "success"}
 
 # ==========================================
@@ -156,48 +495,515 @@ async def save_company_settings(settings: CompanySettings, user: dict = Depends(
 # ==========================================
 
 # 1. Objekty - GET ALL
+BATTERY_STATUSES = ["HEALTHY", "WARNING", "CRITICAL", "REPLACED"]
+
+# Projekce pro seznam a mapu - bez logů, souborů, kontaktů a událostí
+OBJECT_SUMMARY_STAGES = [
+    {"$lookup": {"from": "batteries", "localField": "id", "foreignField": "objectId", "as": "batteryStats",
+                 "pipeline": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]}},
+    {"$project": {
+        "_id": 0, "id": 1, "name": 1, "address": 1, "groupId": 1, "lat": 1, "lng": 1,
+        "batteryStatusCounts": {s: {"$sum": {"$map": {
+            "input": {"$filter": {"input": "$batteryStats", "cond": {"$eq": ["$$this._id", s]}}},
+            "in": "$$this.count"
+        }}} for s in BATTERY_STATUSES}
+    }}
+]
+
 @app.get("/objects")
-async def get_objects(user: dict = Depends(get_current_user)):
-    return [fix_mongo_id(doc) async for doc in db.objects.find({})]
+async def get_objects(
+    view: str = "full",
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    after: Optional[str] = None,
+    groupId: Optional[str] = None,
+    q: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    """
+    Seznam objektů. view=summary vrací jen pole pro seznam/mapu.
+    Stránkování je keyset podle `id`: další stránka = after=<id posledního záznamu>.
+    Hlavičky X-Sync-Epoch / X-Sync-Cursor = výchozí bod pro /objects/changes (čtou se před výpisem).
+    """
+    if view not in ("full", "summary"): raise HTTPException(400, "Invalid view")
+    epoch, sync_cursor = await sync_position()
+    sync_headers = {"X-Sync-Epoch": epoch, "X-Sync-Cursor": str(sync_cursor)}
+
+    query: Dict[str, Any] = {}
+    if groupId: query["groupId"] = groupId
+    if after: query["id"] = {"$gt": after}
+    if q:
+        pattern = {"$regex": re.escape(q), "$options": "i"}
+        query["$or"] = [{"name": pattern}, {"address": pattern}]
+
+    if view == "summary":
+        pipeline: List[dict] = [{"$match": query}, {"$sort": {"id": 1}}]
+        if limit: pipeline.append({"$limit": limit})
+        pipeline += OBJECT_SUMMARY_STAGES
+        response = stream_json_array(db.objects.aggregate(pipeline))
+    else:
+        cursor = db.objects.find(query, {"_id": 0})
+        if limit or after: cursor = cursor.sort("id", 1)
+        if limit: cursor = cursor.limit(limit)
+        response = stream_json_array(iter_with_batteries(cursor))
+    response.headers.update(sync_headers)
+    return response
+
+# 1b. Objekty - ZMĚNY OD REVIZE (inkrementální sync)
+@app.get("/objects/changes")
+async def get_object_changes(
+    since: int = 0,
+    epoch: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=5000),
+    user: dict = Depends(get_current_user)
+):
+    """
+    Objekty změněné po revizi `since` a id smazaných objektů, seřazené podle revize.
+    Klient si uloží `cursor` a `epoch`; při resync=true musí načíst /objects znovu celé.
+    Dokud hasMore=true, pokračuje hned s since=cursor.
+    """
+    counter = await db.counters.find_one_and_update(
+        {"id": OBJECT_REV_COUNTER},
+        {"$setOnInsert": {"seq": 0, "epoch": uuid.uuid4().hex}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    if epoch and epoch != counter["epoch"]:
+        return {"epoch": counter["epoch"], "cursor": counter["seq"], "resync": True,
+                "changed": [], "deleted": [], "hasMore": False}
+
+    changed = [d async for d in db.objects.find({"rev": {"$gt": since}}, {"_id": 0}).sort("rev", 1).limit(limit)]
+    deleted = [d async for d in db.object_tombstones.find({"rev": {"$gt": since}}, {"_id": 0}).sort("rev", 1).limit(limit)]
+
+    # Plná stránka z jedné kolekce = z druhé smíme vzít jen revize do její poslední
+    full_pages = [page[-1]["rev"] for page in (changed, deleted) if len(page) == limit]
+    bound = min(full_pages) if full_pages else None
+    if bound is not None:
+        changed = [d for d in changed if d["rev"] <= bound]
+        deleted = [d for d in deleted if d["rev"] <= bound]
+    has_more = bound is not None
+
+    if has_more:
+        cursor = bound
+    else:
+        # Revize se přidělí před zápisem - nejčerstvější změny posíláme, ale kurzor za ně neposuneme,
+        # dokud neuplyne SYNC_SETTLE_SECONDS (jinak by se mohl ztratit pomalejší souběžný zápis)
+        cutoff = (datetime.utcnow() - timedelta(seconds=SYNC_SETTLE_SECONDS)).isoformat()
+        cursor = since
+        events = sorted([(d["rev"], d.get("updatedAt") or "") for d in changed] +
+                        [(d["rev"], d.get("deletedAt") or "") for d in deleted])
+        for rev, ts in events:
+            if ts > cutoff: break
+            cursor = rev
+
+    # Explicitní odpověď - vrácený dict by FastAPI nejdřív prohnal jsonable_encoder
+    return FastJSONResponse({
+        "epoch": counter["epoch"], "cursor": cursor, "resync": False, "hasMore": has_more,
+        "changed": await attach_batteries(changed),
+        "deleted": [d["id"] for d in deleted],
+    })
 
 # 2. Objekty - GET ONE
 @app.get("/objects/{obj_id}")
 async def get_object(obj_id: str, user: dict = Depends(get_current_user)):
     doc = await db.objects.find_one({"id": obj_id})
     if not doc: raise HTTPException(404, "Object not found")
-    return fix_mongo_id(doc)
+    doc["logEntries"] = await load_logs(obj_id, limit=LOG_EMBED_LIMIT)
+    # Starší záznamy načítá záložka Deník přes GET /objects/{id}/logs?before=<logEntriesNextBefore>
+    doc["logEntriesNextBefore"] = log_cursor_token(doc["logEntries"][-1]) if len(doc["logEntries"]) == LOG_EMBED_LIMIT else None
+    return (await attach_batteries([fix_mongo_id(doc)]))[0]
 
 # 3. Objekty - CREATE
+OBJECT_ARRAY_FIELDS = ["technologies", "logEntries", "scheduledEvents", "files", "tasks", "contacts", "pendingIssues"]
+
 @app.post("/objects")
 async def create_object(obj: dict = Body(...), user: dict = Depends(get_current_user)):
     if "id" not in obj: obj["id"] = uuid.uuid4().hex
     
     # Inicializace polí
-    for field in ["technologies", "logEntries", "scheduledEvents", "files", "tasks", "contacts", "pendingIssues"]:
+    for field in OBJECT_ARRAY_FIELDS:
         if field not in obj: obj[field] = []
-        
+
+    battery_docs = split_batteries(obj["id"], obj["technologies"])
+    log_docs = [log_to_doc(obj["id"], e) for e in obj["logEntries"]]
+    obj["logEntries"] = []
+    obj.update(await revision_stamp())
     await db.objects.insert_one(obj)
-    return fix_mongo_id(obj)
+    await db.object_tombstones.delete_one({"id": obj["id"]})
+    if battery_docs: await db.batteries.insert_many(battery_docs)
+    if log_docs: await db.logs.bulk_write([log_upsert(d) for d in log_docs], ordered=False)
+    if "lat" in obj or "lng" in obj: await sync_object_locations({"id": obj["id"]})
+    invalidate_stats_cache()
+    created = (await attach_batteries([fix_mongo_id(obj)]))[0]
+    await notify_object(obj["id"], "create", created)
+    return created
 
 # 4. Objekty - UPDATE ROOT
 @app.patch("/objects/{obj_id}")
 async def update_object_root(obj_id: str, updates: dict = Body(...), user: dict = Depends(get_current_user)):
-    protected_fields = ["technologies", "logEntries", "scheduledEvents", "files", "tasks", "contacts", "pendingIssues", "_id", "id"]
+    protected_fields = ["technologies", "logEntries", "scheduledEvents", "files", "tasks", "contacts", "pendingIssues", "_id", "id", "rev", "updatedAt", "location"]
     safe_updates = {k: v for k, v in updates.items() if k not in protected_fields}
     
     if not safe_updates:
         return {"status": "no_changes"}
     
-    result = await db.objects.update_one({"id": obj_id}, {"$set": safe_updates})
+    result = await db.objects.update_one({"id": obj_id}, await stamped({"$set": safe_updates}))
     if result.matched_count == 0: raise HTTPException(404, "Object not found")
+    if "lat" in safe_updates or "lng" in safe_updates: await sync_object_locations({"id": obj_id})
+    # Přesun do jiné skupiny mění statistiky obou skupin
+    if "groupId" in safe_updates: invalidate_stats_cache()
+    await notify_object(obj_id, "update", safe_updates)
     return {"status": "updated", "fields": list(safe_updates.keys())}
 
 # 5. Objekty - DELETE
 @app.delete("/objects/{obj_id}")
 async def delete_object(obj_id: str, user: dict = Depends(get_current_user)):
-    await db.objects.delete_one({"id": obj_id})
+    removed = await db.objects.find_one_and_delete({"id": obj_id}, projection={"_id": 0, "files.url": 1, "groupId": 1})
+    await db.batteries.delete_many({"objectId": obj_id})
+    await db.logs.delete_many({"objectId": obj_id})
+    if removed:
+        await db.object_tombstones.update_one(
+            {"id": obj_id},
+            {"$set": {"rev": await next_object_revision(), "deletedAt": datetime.utcnow().isoformat()}},
+            upsert=True
+        )
+    for f in (removed or {}).get("files") or []: await release_upload(f.get("url"))
+    invalidate_stats_cache()
+    if removed: await notify_object(obj_id, "delete", group_id=removed.get("groupId"))
     return {"status": "deleted"}
 
+# ==========================================
+# --- DÁVKOVÉ OPERACE (OFFLINE SYNC) ---
+# ==========================================
+# Stejné operace jako jednotlivé endpointy níže, poslané najednou:
+#   {"op": "batteries.update", "objectId": "...", "techId": "...", "batteryId": "...", "data": {...}}
+# Slučitelné operace jednoho objektu se složí do jednoho update_one se sloučenými array_filters,
+# vše dohromady jde jedním bulk_write do objects a po jednom do batteries a logs.
+OBJECT_COLLECTIONS = ["files", "scheduledEvents", "contacts", "pendingIssues"]
+BATCH_MAX_OPERATIONS = 500
+BATCH_SNAPSHOT_PROJECTION = {
+    "_id": 0, "id": 1, "technologies.id": 1, "technologies.batteries.id": 1, "tasks.id": 1,
+    **{f"{c}.id": 1 for c in OBJECT_COLLECTIONS}, "files.url": 1,
+}
+
+class _ObjectUpdateBuilder:
+    """Skládá $set/$push/$pull fragmenty jednoho objektu do co nejmenšího počtu update dokumentů.
+
+    Nový dokument se založí, jen když by cesta kolidovala s cestou v posledním (Mongo nepovolí
+    např. $push do tasks a $set do tasks.$[x] v jednom update). Pořadí operací zůstává zachováno.
+    """
+    def __init__(self):
+        self.entries: List[dict] = []
+        self._idents: Dict[tuple, str] = {}
+
+    def ident(self, *key) -> str:
+        # Stejný prvek = stejný identifikátor, takže dvě změny téhož pole se poznají jako kolize
+        if key not in self._idents: self._idents[key] = f"{key[0]}{len(self._idents)}"
+        return self._idents[key]
+
+    def _entry(self, path: str, operator: str, mergeable: bool = False) -> dict:
+        current = self.entries[-1] if self.entries else None
+        if current is not None:
+            if mergeable and current["paths"].get(path) == operator: return current
+            if not any(p == path or p.startswith(path + ".") or path.startswith(p + ".") for p in current["paths"]):
+                current["paths"][path] = operator
+                return current
+        current = {"update": {}, "filters": {}, "paths": {path: operator}}
+        self.entries.append(current)
+        return current
+
+    def set(self, path: str, value: Any, filters: Dict[str, dict]):
+        entry = self._entry(path, "$set")
+        entry["update"].setdefault("$set", {})[path] = value
+        entry["filters"].update(filters)
+
+    def push(self, path: str, item: dict, prepend: bool = False):
+        entry = self._entry(path, "$push", mergeable=True)
+        spec = entry["update"].setdefault("$push", {}).setdefault(path, {"$each": []})
+        if prepend:
+            spec["$each"].insert(0, item)
+            spec["$position"] = 0
+        else:
+            spec["$each"].append(item)
+
+    def pull(self, path: str, item_id: str, filters: Dict[str, dict] = None):
+        entry = self._entry(path, "$pull", mergeable=True)
+        entry["update"].setdefault("$pull", {}).setdefault(path, {"id": {"$in": []}})["id"]["$in"].append(item_id)
+        entry["filters"].update(filters or {})
+
+    def element(self, array: str, item_id: str, *parent) -> tuple:
+        """Cesta a array filter pro prvek pole podle id (např. tasks.$[e0])."""
+        name = self.ident("e", array, *parent, item_id)
+        return name, {name: {f"{name}.id": item_id}}
+
+def _batch_require(condition: bool, message: str):
+    if not condition: raise HTTPException(404, message)
+
+def _batch_unique_batteries(docs: List[dict]):
+    if len({d["id"] for d in docs}) != len(docs): raise HTTPException(409, "Duplicate battery id")
+
+def _compile_batch_op(op: dict, state: Dict[str, dict], stored: set, builder: _ObjectUpdateBuilder,
+                      writes: Dict[str, list], released: List[str]):
+    """Zvaliduje operaci proti stavu objektu (včetně dřívějších operací dávky) a přidá její zápisy."""
+    name, obj_id, data = op.get("op"), op.get("objectId"), op.get("data") or {}
+    if not isinstance(data, dict): raise HTTPException(400, "Invalid data")
+    obj = state.get(obj_id)
+    _batch_require(obj is not None, "Object not found")
+    target, _, action = (name or "").partition(".")
+    techs: Dict[str, set] = obj["technologies"]
+    battery_writes = writes["batteries"]
+
+    if target == "technologies":
+        tech_id = op.get("techId")
+        if action == "add":
+            tech = dict(data)
+            if tech.get("id") in techs: raise HTTPException(409, "Technology already exists")
+            docs = split_batteries(obj_id, [tech])
+            _batch_unique_batteries(docs)
+            builder.push("technologies", tech)
+            battery_writes.extend(InsertOne(d) for d in docs)
+            techs[tech.get("id")] = set()
+            stored.update((obj_id, tech.get("id"), d["id"]) for d in docs)
+            return
+        _batch_require(tech_id in techs, "Technology not found")
+        t_name, t_filter = builder.element("technologies", tech_id)
+        if action == "update":
+            # Nejdřív celá validace - chyba po builder.set by v dávce zanechala zápis odmítnuté operace
+            docs = [battery_to_doc(obj_id, tech_id, b) for b in data["batteries"]] if data.get("batteries") is not None else None
+            if docs is not None: _batch_unique_batteries(docs)
+            fields = {k: v for k, v in data.items() if k not in ("id", "batteries")}
+            for k, v in fields.items(): builder.set(f"technologies.$[{t_name}].{k}", v, t_filter)
+            if docs is not None:
+                battery_writes.append(DeleteMany({"objectId": obj_id, "technologyId": tech_id}))
+                battery_writes.extend(InsertOne(d) for d in docs)
+                stored.difference_update({k for k in stored if k[:2] == (obj_id, tech_id)})
+                stored.update((obj_id, tech_id, d["id"]) for d in docs)
+            return
+        if action == "remove":
+            builder.pull("technologies", tech_id)
+            battery_writes.append(DeleteMany({"objectId": obj_id, "technologyId": tech_id}))
+            del techs[tech_id]
+            return
+
+    if target == "batteries":
+        tech_id, bat_id = op.get("techId"), op.get("batteryId")
+        _batch_require(tech_id in techs, "Technology not found")
+        if action == "add":
+            doc = battery_to_doc(obj_id, tech_id, data)
+            # `stored` obsahuje i baterie přidané dřívějšími operacemi téže dávky
+            if (obj_id, tech_id, doc["id"]) in stored or doc["id"] in techs[tech_id]:
+                raise HTTPException(409, "Battery with this id already exists")
+            battery_writes.append(InsertOne(doc))
+            stored.add((obj_id, tech_id, doc["id"]))
+            return
+        key = (obj_id, tech_id, bat_id)
+        _batch_require(key in stored or bat_id in techs[tech_id], "Battery not found")
+        t_name, t_filter = builder.element("technologies", tech_id)
+        if action == "update":
+            safe = {k: v for k, v in data.items() if k not in BATTERY_PROTECTED_FIELDS}
+            if not safe: return
+            if key in stored:
+                battery_writes.append(UpdateOne({"objectId": obj_id, "technologyId": tech_id, "id": bat_id}, {"$set": safe}))
+            else:
+                # Baterie ještě nebyla zmigrována z objektu
+                b_name, b_filter = builder.element("batteries", bat_id, tech_id)
+                for k, v in safe.items():
+                    builder.set(f"technologies.$[{t_name}].batteries.$[{b_name}].{k}", v, {**t_filter, **b_filter})
+            return
+        if action == "remove":
+            if key in stored:
+                battery_writes.append(DeleteOne({"objectId": obj_id, "technologyId": tech_id, "id": bat_id}))
+                stored.discard(key)
+            else:
+                builder.pull(f"technologies.$[{t_name}].batteries", bat_id, t_filter)
+                techs[tech_id].discard(bat_id)
+            return
+
+    if target == "logEntries" and action == "add":
+        writes["logs"].append(log_upsert(log_to_doc(obj_id, data)))
+        return
+
+    if target == "tasks" or target in OBJECT_COLLECTIONS:
+        items: Dict[str, Any] = obj[target]
+        if action == "add":
+            builder.push(target, data)
+            items[data.get("id")] = data.get("url")
+            return
+        item_id = op.get("itemId")
+        _batch_require(item_id in items, "Item not found")
+        if action == "remove":
+            builder.pull(target, item_id)
+            url = items.pop(item_id)
+            if target == "files" and url: released.append(url)
+            return
+        if action == "update" and target in ("tasks", "pendingIssues"):
+            e_name, e_filter = builder.element(target, item_id)
+            fields = data if target == "tasks" else {"status": data.get("status")}
+            for k, v in fields.items():
+                if k != "id": builder.set(f"{target}.$[{e_name}].{k}", v, e_filter)
+            return
+
+    raise HTTPException(400, f"Unsupported operation: {name}")
+
+def _fail_batch_writes(results: List[dict], owners: List[List[int]], count: int, write_errors: List[dict], note: str = ""):
+    """
+    Chyby z BulkWriteError na výsledky operací. Po první chybě (ordered) se další zápisy neprovedly.
+    `note` se připojí ke zprávě, když část operace (zápis objektu) už uložená je.
+    """
+    for err in write_errors:
+        code = 409 if err.get("code") == 11000 else 500
+        for i in owners[err["index"]]:
+            if results[i]["status"] == "ok": results[i] = {"index": i, "status": "error", "code": code, "error": f"{err.get('errmsg')}{note}"}
+    first = min((err["index"] for err in write_errors), default=count)
+    for position in range(first + 1, count):
+        for i in owners[position]:
+            if results[i]["status"] == "ok":
+                results[i] = {"index": i, "status": "error", "code": 500, "error": f"Not applied, an earlier write in the batch failed{note}"}
+
+async def run_batch(operations: List[dict]) -> dict:
+    if len(operations) > BATCH_MAX_OPERATIONS: raise HTTPException(400, "Too many operations")
+    obj_ids = list({op.get("objectId") for op in operations if isinstance(op, dict) and op.get("objectId")})
+
+    # Stav dotčených objektů (jen id prvků) - jeden dotaz do objects a jeden do batteries
+    state: Dict[str, dict] = {}
+    async for doc in db.objects.find({"id": {"$in": obj_ids}}, BATCH_SNAPSHOT_PROJECTION):
+        state[doc["id"]] = {
+            "technologies": {t.get("id"): {b.get("id") for b in t.get("batteries") or []} for t in doc.get("technologies") or []},
+            "tasks": {t.get("id"): None for t in doc.get("tasks") or []},
+            **{c: {i.get("id"): i.get("url") for i in doc.get(c) or []} for c in OBJECT_COLLECTIONS},
+        }
+    stored = {(b["objectId"], b["technologyId"], b["id"]) async for b in db.batteries.find(
+        {"objectId": {"$in": obj_ids}}, {"_id": 0, "objectId": 1, "technologyId": 1, "id": 1})}
+
+    builders: Dict[str, _ObjectUpdateBuilder] = {}
+    applied: Dict[str, List[int]] = {}
+    writes: Dict[str, list] = {"batteries": [], "logs": []}
+    # Pro každý zápis indexy operací, ze kterých vznikl (chyba zápisu -> chyba těchto operací)
+    owners: Dict[str, List[List[int]]] = {"objects": [], "batteries": [], "logs": []}
+    released: List[str] = []
+    release_owners: List[int] = []
+    results = []
+    for index, op in enumerate(operations):
+        sizes = {name: len(ops) for name, ops in writes.items()}
+        released_size = len(released)
+        try:
+            if not isinstance(op, dict): raise HTTPException(400, "Invalid operation")
+            builder = builders.setdefault(op.get("objectId"), _ObjectUpdateBuilder())
+            _compile_batch_op(op, state, stored, builder, writes, released)
+            applied.setdefault(op["objectId"], []).append(index)
+            results.append({"index": index, "status": "ok"})
+            for name, ops in writes.items(): owners[name] += [[index]] * (len(ops) - sizes[name])
+            release_owners += [index] * (len(released) - released_size)
+        except HTTPException as e:
+            for name, ops in writes.items(): del ops[sizes[name]:]
+            del released[released_size:]
+            results.append({"index": index, "status": "error", "code": e.status_code, "error": e.detail})
+
+    object_writes = []
+    for obj_id, indexes in applied.items():
+        entries = builders[obj_id].entries or [{"update": {}, "filters": {}}]
+        entries[-1]["update"].setdefault("$set", {}).update(await revision_stamp())
+        object_writes += [
+            UpdateOne({"id": obj_id}, e["update"], array_filters=list(e["filters"].values()) or None)
+            for e in entries
+        ]
+        owners["objects"] += [indexes] * len(entries)
+    if object_writes:
+        try:
+            await db.objects.bulk_write(object_writes, ordered=True)
+        except BulkWriteError as e:
+            _fail_batch_writes(results, owners["objects"], len(object_writes), e.details.get("writeErrors") or [])
+    # Baterie, deník a uvolnění souborů jen pro operace, jejichž zápis objektu prošel
+    # (jinak by např. technologies.add nechala osiřelé baterie a files.remove smazala odkazovaný soubor)
+    for name, ops in writes.items():
+        kept = [(write, owner) for write, owner in zip(ops, owners[name]) if all(results[i]["status"] == "ok" for i in owner)]
+        if not kept: continue
+        try:
+            await db[name].bulk_write([write for write, _ in kept], ordered=True)
+        except BulkWriteError as e:
+            _fail_batch_writes(results, [owner for _, owner in kept], len(kept), e.details.get("writeErrors") or [],
+                               note=" (object changes of this operation were already saved)")
+    for url, i in zip(released, release_owners):
+        if results[i]["status"] == "ok": await release_upload(url)
+
+    applied = {obj_id: [operations[i] for i in indexes if results[i]["status"] == "ok"] for obj_id, indexes in applied.items()}
+    if applied: invalidate_stats_cache()
+    for obj_id, ops in applied.items():
+        if ops: await notify_object(obj_id, "batch", [{k: v for k, v in op.items() if k != "objectId"} for op in ops])
+    failed = sum(1 for r in results if r["status"] == "error")
+    return {
+        "status": "ok" if not failed else ("failed" if failed == len(results) else "partial"),
+        "results": results,
+        "writes": {"objects": len(object_writes), **{name: len(ops) for name, ops in writes.items()}},
+    }
+
+@app.post("/objects/{obj_id}/batch")
+async def batch_object(obj_id: str, operations: List[dict] = Body(...), user: dict = Depends(get_current_user)):
+    """Dávka operací nad jedním objektem (objectId v operacích se ignoruje)."""
+    return await run_batch([{**op, "objectId": obj_id} if isinstance(op, dict) else op for op in operations])
+
+@app.post("/batch")
+async def batch_objects(operations: List[dict] = Body(...), user: dict = Depends(get_current_user)):
+    """Dávka operací napříč objekty - každá operace nese objectId."""
+    return await run_batch(operations)
+
+# ==========================================
+# --- STATISTIKY (DASHBOARD) ---
+# ==========================================
+
+@app.get("/stats/dashboard")
+async def get_dashboard_stats(groupId: Optional[str] = None, user: dict = Depends(get_current_user)):
+    """Agregované počty pro dashboard (stavy baterií, baterie na objekt, úkoly po termínu)."""
+    cache_key = groupId or "*"
+    cached = stats_cache.get(cache_key)
+    if cached is not None: return cached
+
+    match = {"groupId": groupId} if groupId else {}
+    # Termíny úkolů bývají jen datum - po termínu je úkol až od následujícího dne
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+
+    objects = [doc async for doc in db.objects.find(match, {"_id": 0, "id": 1, "name": 1})]
+    battery_match = {"objectId": {"$in": [o["id"] for o in objects]}} if groupId else {}
+
+    # Jeden průchod kolekcí baterií: počty podle (objekt, stav)
+    status_counts = {s: 0 for s in BATTERY_STATUSES}
+    per_object: Dict[str, int] = {}
+    battery_pipeline = [
+        {"$match": battery_match},
+        {"$group": {"_id": {"objectId": "$objectId", "status": "$status"}, "count": {"$sum": 1}}}
+    ]
+    async for row in db.batteries.aggregate(battery_pipeline):
+        bat_status, count = row["_id"].get("status"), row["count"]
+        if bat_status: status_counts[bat_status] = status_counts.get(bat_status, 0) + count
+        per_object[row["_id"]["objectId"]] = per_object.get(row["_id"]["objectId"], 0) + count
+    if not await migration_completed("batteries_v1"):
+        embedded_pipeline = [
+            {"$match": {**match, "technologies.batteries.0": {"$exists": True}}},
+            {"$unwind": "$technologies"}, {"$unwind": "$technologies.batteries"},
+            {"$group": {"_id": {"objectId": "$id", "status": "$technologies.batteries.status"}, "count": {"$sum": 1}}},
+        ]
+        async for row in db.objects.aggregate(embedded_pipeline):
+            bat_status, count = row["_id"].get("status"), row["count"]
+            if bat_status: status_counts[bat_status] = status_counts.get(bat_status, 0) + count
+            per_object[row["_id"]["objectId"]] = per_object.get(row["_id"]["objectId"], 0) + count
+
+    task_pipeline = [
+        {"$match": {**match, "tasks": {"$elemMatch": {"status": {"$ne": "DONE"}, "deadline": {"$lt": today}}}}},
+        {"$unwind": "$tasks"},
+        {"$match": {"tasks.status": {"$ne": "DONE"}, "tasks.deadline": {"$lt": today}}},
+        {"$count": "count"}
+    ]
+    overdue = await db.objects.aggregate(task_pipeline).to_list(length=1)
+
+    result = {
+        "totalObjects": len(objects),
+        "totalBatteries": sum(status_counts.values()),
+        "batteryStatusCounts": status_counts,
+        "batteriesPerObject": [{"id": o["id"], "name": o.get("name"), "batteries": per_object.get(o["id"], 0)} for o in objects],
+        "overdueTasks": overdue[0]["count"] if overdue else 0,
+    }
+    stats_cache.set(cache_key, result)
+    return result
+
 # ==========================================
 # --- ATOMICKÉ OPERACE (TECHNOLOGIES, ETC.) ---
 # ==========================================
@@ -205,118 +1011,355 @@ async def delete_object(obj_id: str, user: dict = Depends(get_current_user)):
 # A) TECHNOLOGIE
 @app.post("/objects/{obj_id}/technologies")
 async def add_technology(obj_id: str, tech: dict = Body(...), user: dict = Depends(get_current_user)):
-    await db.objects.update_one({"id": obj_id}, {"$push": {"technologies": tech}})
+    battery_docs = split_batteries(obj_id, [tech])
+    result = await db.objects.update_one({"id": obj_id}, await stamped({"$push": {"technologies": tech}}))
+    if result.matched_count == 0: raise HTTPException(404, "Object not found")
+    if battery_docs: await db.batteries.insert_many(battery_docs)
+    invalidate_stats_cache()
+    await notify_object(obj_id, "technologies.add", tech)
     return {"status": "added"}
 
 @app.patch("/objects/{obj_id}/technologies/{tech_id}")
 async def update_technology(obj_id: str, tech_id: str, updates: dict = Body(...), user: dict = Depends(get_current_user)):
-    set_data = {f"technologies.$[elem].{k}": v for k, v in updates.items()}
-    result = await db.objects.update_one(
-        {"id": obj_id}, {"$set": set_data}, array_filters=[{"elem.id": tech_id}]
-    )
-    if result.matched_count == 0: raise HTTPException(404, "Object or technology not found")
+    batteries = updates.pop("batteries", None)
+    updates.pop("id", None)
+    if updates:
+        set_data = {f"technologies.$[elem].{k}": v for k, v in updates.items()}
+        result = await db.objects.update_one(
+            {"id": obj_id}, await stamped({"$set": set_data}), array_filters=[{"elem.id": tech_id}]
+        )
+        if result.matched_count == 0: raise HTTPException(404, "Object or technology not found")
+    elif not await db.objects.find_one({"id": obj_id, "technologies.id": tech_id}, {"_id": 1}):
+        raise HTTPException(404, "Object or technology not found")
+
+    # Celá sada baterií v PATCH technologie = náhrada baterií této technologie
+    if batteries is not None:
+        await db.batteries.delete_many({"objectId": obj_id, "technologyId": tech_id})
+        if batteries: await db.batteries.insert_many([battery_to_doc(obj_id, tech_id, b) for b in batteries])
+        if not updates: await touch_object(obj_id)
+        invalidate_stats_cache()
+    await notify_object(obj_id, "technologies.update", {"id": tech_id, **updates, **({"batteries": batteries} if batteries is not None else {})})
     return {"status": "updated"}
 
 @app.delete("/objects/{obj_id}/technologies/{tech_id}")
 async def remove_technology(obj_id: str, tech_id: str, user: dict = Depends(get_current_user)):
-    await db.objects.update_one({"id": obj_id}, {"$pull": {"technologies": {"id": tech_id}}})
+    await db.objects.update_one({"id": obj_id}, await stamped({"$pull": {"technologies": {"id": tech_id}}}))
+    await db.batteries.delete_many({"objectId": obj_id, "technologyId": tech_id})
+    invalidate_stats_cache()
+    await notify_object(obj_id, "technologies.remove", {"id": tech_id})
     return {"status": "removed"}
 
 # B) BATERIE
 @app.post("/objects/{obj_id}/technologies/{tech_id}/batteries")
 async def add_battery(obj_id: str, tech_id: str, battery: dict = Body(...), user: dict = Depends(get_current_user)):
-    await db.objects.update_one(
-        {"id": obj_id, "technologies.id": tech_id},
-        {"$push": {"technologies.$.batteries": battery}}
-    )
+    if not await db.objects.find_one({"id": obj_id, "technologies.id": tech_id}, {"_id": 1}):
+        raise HTTPException(404, "Object or technology not found")
+    battery_doc = battery_to_doc(obj_id, tech_id, battery)
+    try:
+        await db.batteries.insert_one(battery_doc)
+    except DuplicateKeyError:
+        raise HTTPException(409, "Battery with this id already exists")
+    await touch_object(obj_id)
+    invalidate_stats_cache()
+    battery_doc.pop("_id", None)
+    await notify_object(obj_id, "batteries.add", battery_doc)
     return {"status": "added"}
 
 @app.patch("/objects/{obj_id}/technologies/{tech_id}/batteries/{bat_id}")
 async def update_battery_status(obj_id: str, tech_id: str, bat_id: str, update: dict = Body(...), user: dict = Depends(get_current_user)):
-    set_data = {f"technologies.$[t].batteries.$[b].{k}": v for k, v in update.items()}
-    await db.objects.update_one(
-        {"id": obj_id}, {"$set": set_data}, array_filters=[{"t.id": tech_id}, {"b.id": bat_id}]
+    safe_update = {k: v for k, v in update.items() if k not in BATTERY_PROTECTED_FIELDS}
+    if not safe_update: return {"status": "no_changes"}
+    result = await db.batteries.update_one(
+        {"objectId": obj_id, "technologyId": tech_id, "id": bat_id}, {"$set": safe_update}
     )
+    if result.matched_count == 0:
+        # Baterie ještě nebyla zmigrována z objektu
+        set_data = {f"technologies.$[t].batteries.$[b].{k}": v for k, v in safe_update.items()}
+        await db.objects.update_one(
+            {"id": obj_id}, {"$set": set_data}, array_filters=[{"t.id": tech_id}, {"b.id": bat_id}]
+        )
+    await touch_object(obj_id)
+    invalidate_stats_cache()
+    await notify_object(obj_id, "batteries.update", {"id": bat_id, "technologyId": tech_id, **safe_update})
     return {"status": "updated"}
 
 @app.delete("/objects/{obj_id}/technologies/{tech_id}/batteries/{bat_id}")
 async def remove_battery(obj_id: str, tech_id: str, bat_id: str, user: dict = Depends(get_current_user)):
-    await db.objects.update_one(
-        {"id": obj_id, "technologies.id": tech_id},
-        {"$pull": {"technologies.$.batteries": {"id": bat_id}}}
-    )
+    result = await db.batteries.delete_one({"objectId": obj_id, "technologyId": tech_id, "id": bat_id})
+    if result.deleted_count == 0:
+        # Baterie ještě nebyla zmigrována z objektu
+        await db.objects.update_one(
+            {"id": obj_id, "technologies.id": tech_id},
+            {"$pull": {"technologies.$.batteries": {"id": bat_id}}}
+        )
+    await touch_object(obj_id)
+    invalidate_stats_cache()
+    await notify_object(obj_id, "batteries.remove", {"id": bat_id, "technologyId": tech_id})
     return {"status": "removed"}
 
 # C) LOGY
+@app.get("/objects/{obj_id}/logs")
+async def get_logs(
+    obj_id: str,
+    before: Optional[str] = None,
+    limit: int = Query(LOG_PAGE_SIZE, ge=1, le=500),
+    user: dict = Depends(get_current_user)
+):
+    """Stránka deníku od nejnovějších. Další stránka = before=<nextBefore z předchozí odpovědi>."""
+    items = await load_logs(obj_id, before, limit)
+    return {"items": items, "nextBefore": log_cursor_token(items[-1]) if len(items) == limit else None}
+
 @app.post("/objects/{obj_id}/logs")
 async def add_log(obj_id: str, log: dict = Body(...), user: dict = Depends(get_current_user)):
-    await db.objects.update_one({"id": obj_id}, {"$push": {"logEntries": {"$each": [log], "$position": 0}}})
-    return {"status": "added"}
+    result = await db.objects.update_one({"id": obj_id}, {"$set": await revision_stamp()})
+    if result.matched_count == 0: raise HTTPException(404, "Object not found")
+    doc = log_to_doc(obj_id, log)
+    await db.logs.bulk_write([log_upsert(doc)])
+    doc.pop("_id", None)
+    await notify_object(obj_id, "logEntries.add", doc)
+    return {"status": "added", "id": doc["id"]}
 
 # D) TASKS
 @app.post("/objects/{obj_id}/tasks")
 async def add_task(obj_id: str, task: dict = Body(...), user: dict = Depends(get_current_user)):
-    await db.objects.update_one({"id": obj_id}, {"$push": {"tasks": task}})
+    await db.objects.update_one({"id": obj_id}, await stamped({"$push": {"tasks": task}}))
+    invalidate_stats_cache()
+    await notify_object(obj_id, "tasks.add", task)
     return {"status": "added"}
 
 @app.patch("/objects/{obj_id}/tasks/{task_id}")
 async def update_task(obj_id: str, task_id: str, update: dict = Body(...), user: dict = Depends(get_current_user)):
     set_data = {f"tasks.$[elem].{k}": v for k, v in update.items()}
     await db.objects.update_one(
-        {"id": obj_id}, {"$set": set_data}, array_filters=[{"elem.id": task_id}]
+        {"id": obj_id}, await stamped({"$set": set_data}), array_filters=[{"elem.id": task_id}]
     )
+    invalidate_stats_cache()
+    await notify_object(obj_id, "tasks.update", {"id": task_id, **update})
     return {"status": "updated"}
 
 @app.delete("/objects/{obj_id}/tasks/{task_id}")
 async def remove_task(obj_id: str, task_id: str, user: dict = Depends(get_current_user)):
-    await db.objects.update_one({"id": obj_id}, {"$pull": {"tasks": {"id": task_id}}})
+    await db.objects.update_one({"id": obj_id}, await stamped({"$pull": {"tasks": {"id": task_id}}}))
+    invalidate_stats_cache()
+    await notify_object(obj_id, "tasks.remove", {"id": task_id})
     return {"status": "removed"}
 
 # E) KOLEKCE (Files, Issues, Events, Contacts)
 @app.post("/objects/{obj_id}/{collection_name}")
 async def add_to_collection(obj_id: str, collection_name: str, item: dict = Body(...), user: dict = Depends(get_current_user)):
-    if collection_name not in ["files", "scheduledEvents", "contacts", "pendingIssues"]:
+    if collection_name not in OBJECT_COLLECTIONS:
         raise HTTPException(400, "Invalid collection")
-    await db.objects.update_one({"id": obj_id}, {"$push": {collection_name: item}})
+    await db.objects.update_one({"id": obj_id}, await stamped({"$push": {collection_name: item}}))
+    await notify_object(obj_id, f"{collection_name}.add", item)
     return {"status": "added"}
 
 @app.delete("/objects/{obj_id}/{collection_name}/{item_id}")
 async def remove_from_collection(obj_id: str, collection_name: str, item_id: str, user: dict = Depends(get_current_user)):
-    if collection_name not in ["files", "scheduledEvents", "contacts", "pendingIssues"]:
+    if collection_name not in OBJECT_COLLECTIONS:
         raise HTTPException(400, "Invalid collection")
-    await db.objects.update_one({"id": obj_id}, {"$pull": {collection_name: {"id": item_id}}})
+    removed = await db.objects.find_one_and_update(
+        {"id": obj_id}, await stamped({"$pull": {collection_name: {"id": item_id}}}),
+        projection={"_id": 0, "files": {"$elemMatch": {"id": item_id}}}
+    )
+    if collection_name == "files" and removed:
+        for f in removed.get("files") or []: await release_upload(f.get("url"))
+    await notify_object(obj_id, f"{collection_name}.remove", {"id": item_id})
     return {"status": "removed"}
 
 @app.patch("/objects/{obj_id}/pendingIssues/{issue_id}")
 async def update_issue_status(obj_id: str, issue_id: str, update: dict = Body(...), user: dict = Depends(get_current_user)):
     await db.objects.update_one(
         {"id": obj_id, "pendingIssues.id": issue_id},
-        {"$set": {"pendingIssues.$.status": update.get("status")}}
+        await stamped({"$set": {"pendingIssues.$.status": update.get("status")}})
     )
+    await notify_object(obj_id, "pendingIssues.update", {"id": issue_id, "status": update.get("status")})
     return {"status": "updated"}
 
+# ==========================================
+# --- PLÁN ÚDRŽBY ---
+# ==========================================
+
+def planner_battery_branches(date_from: str, date_to: str, horizon: str) -> List[dict]:
+    return [
+        {"nextReplacementDate": {"$gte": date_from, "$lte": date_to}},
+        {"nextReplacementDate": {"$lte": horizon}},
+        {"status": {"$in": ["WARNING", "CRITICAL", "REPLACED"]}},
+    ]
+
+def _planner_source(match: dict, unwind: List[str], item: dict) -> List[dict]:
+    """Jeden zdroj položek plánovače (baterie / pravidelné události / závady) jako část pipeline."""
+    stages: List[dict] = [{"$match": match}]
+    stages += [{"$unwind": f"${path}"} for path in unwind]
+    stages.append({"$project": {"_id": 0, "objId": "$id", "objName": "$name", "groupId": "$groupId", **item}})
+    return stages
+
+@app.get("/planner")
+async def get_planner(
+    date_from: Optional[str] = Query(None, alias="from"),
+    date_to: Optional[str] = Query(None, alias="to"),
+    groupId: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    """
+    Pracovní seznam plánu údržby (baterie, pravidelné události, otevřené závady) seřazený podle data.
+    Vrací položky v okně from..to (YYYY-MM-DD, výchozí aktuální měsíc) a navíc vše po termínu
+    nebo v předstihu podle notificationLeadTimeWeeks skupiny objektu.
+    """
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    if not date_from: date_from = today.replace(day=1).strftime("%Y-%m-%d")
+    if not date_to:
+        next_month = (today.replace(day=1) + timedelta(days=32)).replace(day=1)
+        date_to = (next_month - timedelta(days=1)).strftime("%Y-%m-%d")
+    today_str = today.strftime("%Y-%m-%d")
+
+    # Horní mez pro indexový předfiltr = nejdelší předstih ze všech skupin
+    max_lead = DEFAULT_LEAD_TIME_WEEKS
+    async for g in db.groups.find({}, {"_id": 0, "notificationLeadTimeWeeks": 1}):
+        max_lead = max(max_lead, g.get("notificationLeadTimeWeeks") or 0)
+    horizon = (today + timedelta(weeks=max_lead)).strftime("%Y-%m-%d")
+
+    base = {"groupId": groupId} if groupId else {}
+    battery_base = {"objectId": {"$in": await db.objects.distinct("id", base)}} if groupId else {}
+    ev_date = "scheduledEvents.nextDate"
+
+    # Každá větev $or musí mít vlastní index (nextReplacementDate, status) - jinak celý $or skončí
+    # jako COLLSCAN; hlídá to tvar planner.batteries v /admin/query-audit
+    battery_source = [
+        {"$match": {**battery_base, "$or": planner_battery_branches(date_from, date_to, horizon)}},
+        {"$lookup": {"from": "objects", "localField": "objectId", "foreignField": "id", "as": "obj",
+                     "pipeline": [{"$project": {"_id": 0, "id": 1, "name": 1, "groupId": 1, "technologies.id": 1, "technologies.name": 1}}]}},
+        {"$unwind": "$obj"},
+        {"$project": {
+            "_id": 0, "objId": "$obj.id", "objName": "$obj.name", "groupId": "$obj.groupId",
+            "id": {"$concat": ["b-", "$id"]},
+            "type": "battery",
+            "techName": {"$first": {"$map": {
+                "input": {"$filter": {"input": "$obj.technologies", "cond": {"$eq": ["$$this.id", "$technologyId"]}}},
+                "in": "$$this.name"
+            }}},
+            "date": {"$substrCP": ["$nextReplacementDate", 0, 10]},
+            "forceOverdue": {"$ne": ["$status", "HEALTHY"]},
+            "info": {"$concat": [{"$toString": "$capacityAh"}, "Ah / ", {"$toString": "$voltageV"}, "V"]},
+            "note": "$notes",
+        }},
+    ]
+    event_source = _planner_source(
+        {**base, "$or": [
+            {ev_date: {"$gte": date_from, "$lte": date_to}},
+            {ev_date: {"$lte": horizon}},
+        ]},
+        ["scheduledEvents"],
+        {
+            "id": {"$concat": ["se-", "$scheduledEvents.id"]},
+            "type": "scheduled",
+            "techName": "$scheduledEvents.title",
+            "date": {"$substrCP": ["$scheduledEvents.nextDate", 0, 10]},
+            "forceOverdue": {"$literal": False},
+            "info": "$scheduledEvents.interval",
+            "note": "$scheduledEvents.description",
+        }
+    )
+    issue_source = _planner_source(
+        {**base, "pendingIssues.status": "OPEN"},
+        ["pendingIssues"],
+        {
+            "id": {"$concat": ["issue-", "$pendingIssues.id"]},
+            "type": "issue",
+            "techName": {"$literal": "Odložená závada"},
+            "date": {"$substrCP": ["$pendingIssues.createdAt", 0, 10]},
+            "forceOverdue": {"$literal": True},
+            "info": {"$concat": ["Autor: ", {"$ifNull": ["$pendingIssues.createdBy", ""]}]},
+            "note": "$pendingIssues.text",
+        }
+    )
+    issue_source.insert(2, {"$match": {"pendingIssues.status": "OPEN"}})
+    sources = [event_source, issue_source]
+    if not await migration_completed("batteries_v1"):
+        bat = "technologies.batteries"
+        sources.append(_planner_source(
+            {**base, f"{bat}.0": {"$exists": True}},
+            ["technologies", bat],
+            {
+                "id": {"$concat": ["b-", f"${bat}.id"]},
+                "type": "battery",
+                "techName": "$technologies.name",
+                "date": {"$substrCP": [f"${bat}.nextReplacementDate", 0, 10]},
+                "forceOverdue": {"$ne": [f"${bat}.status", "HEALTHY"]},
+                "info": {"$concat": [{"$toString": f"${bat}.capacityAh"}, "Ah / ", {"$toString": f"${bat}.voltageV"}, "V"]},
+                "note": f"${bat}.notes",
+            }
+        ))
+
+    pipeline = battery_source + [{"$unionWith": {"coll": "objects", "pipeline": source}} for source in sources] + [
+        {"$lookup": {"from": "groups", "localField": "groupId", "foreignField": "id", "as": "grp",
+                     "pipeline": [{"$project": {"_id": 0, "notificationLeadTimeWeeks": 1}}]}},
+        {"$set": {"leadTimeWeeks": {"$ifNull": [{"$first": "$grp.notificationLeadTimeWeeks"}, DEFAULT_LEAD_TIME_WEEKS]}}},
+        {"$set": {"warnUntil": {"$dateToString": {"format": "%Y-%m-%d", "date": {
+            "$add": [today, {"$multiply": ["$leadTimeWeeks", 7 * 24 * 3600 * 1000]}]
+        }}}}},
+        {"$set": {
+            "isOverdue": {"$or": ["$forceOverdue", {"$lt": ["$date", today_str]}]},
+            "isUpcoming": {"$and": [
+                {"$ne": ["$type", "issue"]},
+                {"$gte": ["$date", today_str]},
+                {"$lte": ["$date", "$warnUntil"]},
+            ]},
+        }},
+        {"$match": {"$or": [
+            {"isOverdue": True}, {"isUpcoming": True},
+            {"date": {"$gte": date_from, "$lte": date_to}},
+        ]}},
+        {"$sort": {"date": 1, "id": 1}},
+        {"$unset": ["grp", "warnUntil", "forceOverdue"]},
+    ]
+    return FastJSONResponse([doc async for doc in db.batteries.aggregate(pipeline)])
+
 # ==========================================
 # --- GENERÁTOR REVIZÍ / PROTOKOLŮ ---
 # ==========================================
 
+# Pořadová čísla revizí drží kolekce `counters` (jeden dokument na rok, id "reports_<rok>").
+# $inc přes find_one_and_update je atomické, takže dva technici nikdy nedostanou stejné číslo.
+
+async def seed_report_counters():
+    """Nastaví čítače podle nejvyššího existujícího čísla v každém roce (idempotentní, $max)."""
+    max_seq: Dict[int, int] = {}
+    async for doc in db.reports.find({}, {"_id": 0, "reportNumber": 1}):
+        try:
+            seq, year = (int(part) for part in str(doc.get("reportNumber", "")).split("/"))
+        except ValueError:
+            continue
+        max_seq[year] = max(max_seq.get(year, 0), seq)
+    for year, seq in max_seq.items():
+        await db.counters.update_one({"id": f"reports_{year}"}, {"$max": {"seq": seq}}, upsert=True)
+
+async def reserve_report_numbers(year: int, count: int = 1) -> List[str]:
+    """Atomicky rezervuje souvislý blok `count` čísel revizí pro daný rok."""
+    doc = await db.counters.find_one_and_update(
+        {"id": f"reports_{year}"},
+        {"$inc": {"seq": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    last = doc["seq"]
+    return [f"{seq}/{year}" for seq in range(last - count + 1, last + 1)]
+
 async def generate_report_number(year: int) -> str:
     """Vygeneruje číslo revize ve formátu PORADÍ/ROK (např. 52/2025)"""
-    regex = f"/{year}$"
-    last_report = await db.reports.find_one(
-        {"reportNumber": {"$regex": regex}},
-        sort=[("createdAt", -1)]
-    )
-    
-    if last_report:
-        try:
-            last_seq = int(last_report["reportNumber"].split("/")[0])
-            new_seq = last_seq + 1
-        except:
-            new_seq = 1
-    else:
-        new_seq = 1
-        
-    return f"{new_seq}/{year}"
+    return (await reserve_report_numbers(year))[0]
+
+@app.post("/reports/numbers/reserve")
+async def reserve_report_numbers_endpoint(body: dict = Body(...), user: dict = Depends(get_current_user)):
+    """Rezervace bloku čísel pro dávkové generování. Body: { "count": 10, "year": 2025 }"""
+    count = body.get("count", 1)
+    if not isinstance(count, int) or not 1 <= count <= 1000: raise HTTPException(400, "Invalid count")
+    year = body.get("year") or datetime.now().year
+    try:
+        year = int(year)
+    except (TypeError, ValueError):
+        raise HTTPException(400, "Invalid year")
+    if not 2000 <= year <= 9999: raise HTTPException(400, "Invalid year")
+    return {"numbers": await reserve_report_numbers(year, count)}
 
 @app.post("/reports/generate")
 async def generate_report_draft(
@@ -333,6 +1376,7 @@ async def generate_report_draft(
     # 1. Načtení dat (Snapshoty)
     obj_doc = await db.objects.find_one({"id": obj_id})
     if not obj_doc: raise HTTPException(404, "Object not found")
+    await attach_batteries([obj_doc])
     
     group_doc = await db.groups.find_one({"id": obj_doc.get("groupId")}) if obj_doc.get("groupId") else None
     company_doc = await db.settings.find_one({"id": "global_settings"})
@@ -416,6 +1460,7 @@ async def generate_report_draft(
     )
     
     await db.reports.insert_one(new_report.dict())
+    await notify_report(new_report.id, "create", obj_id)
     return new_report
 
 @app.get("/reports")
@@ -423,8 +1468,7 @@ async def get_reports(objectId: Optional[str] = None, user: dict = Depends(get_c
     query = {}
     if objectId: query["objectId"] = objectId
     
-    cursor = db.reports.find(query).sort("createdAt", -1)
-    return [fix_mongo_id(doc) async for doc in cursor]
+    return stream_json_array(db.reports.find(query, {"_id": 0}).sort("createdAt", -1))
 
 @app.get("/reports/{report_id}")
 async def get_report(report_id: str, user: dict = Depends(get_current_user)):
@@ -440,8 +1484,12 @@ async def update_report(report_id: str, updates: dict = Body(...), user: dict =
     if "id" in updates: del updates["id"]
     if "_id" in updates: del updates["_id"]
     
-    res = await db.reports.update_one({"id": report_id}, {"$set": updates})
-    if res.matched_count == 0: raise HTTPException(404, "Report not found")
+    res = await db.reports.find_one_and_update({"id": report_id}, {"$set": updates}, projection={"_id": 0, "objectId": 1})
+    if res is None: raise HTTPException(404, "Report not found")
+    await notify_report(report_id, "update", res.get("objectId"), {k: updates[k] for k in ("status", "updatedAt") if k in updates})
+
+    # Finální revize se hned předrenderuje do PDF, aby bylo stažení okamžité
+    if updates.get("status") == "FINAL": await enqueue_pdf_render(report_id)
     return {"status": "updated"}
 
 @app.post("/reports/{report_id}/clone")
@@ -472,126 +1520,226 @@ async def clone_report(report_id: str, user: dict = Depends(get_current_user)):
         m["value"] = "" 
         
     await db.reports.insert_one(new_report)
+    await notify_report(new_report["id"], "create", new_report.get("objectId"))
     return fix_mongo_id(new_report)
 
 @app.delete("/reports/{report_id}")
 async def delete_report(report_id: str, user: dict = Depends(get_current_user)):
-    await db.reports.delete_one({"id": report_id})
+    removed = await db.reports.find_one_and_delete({"id": report_id}, projection={"_id": 0, "objectId": 1})
+    async for job in db.render_jobs.find({"reportId": report_id, "file": {"$ne": None}}, {"_id": 0, "file": 1}):
+        try: os.remove(job["file"])
+        except FileNotFoundError: pass
+    await db.render_jobs.delete_many({"reportId": report_id})
+    if removed: await notify_report(report_id, "delete", removed.get("objectId"))
     return {"status": "deleted"}
 
+# Vyrenderované HTML podle (id, updatedAt) - nezměněná revize se nerenderuje znovu
+report_render_cache = TTLCache(REPORT_RENDER_CACHE_TTL_SECONDS, max_size=256)
+
+def report_etag(report_id: str, updated_at: Optional[str]) -> str:
+    return '"' + hashlib.sha1(f"{report_id}|{updated_at}".encode("utf-8")).hexdigest() + '"'
+
 @app.get("/reports/{report_id}/pdf")
-async def generate_pdf(report_id: str):
-    doc = await db.reports.find_one({"id": report_id})
-    if not doc: raise HTTPException(404, "Report not found")
-    
+async def generate_pdf(report_id: str, if_none_match: Optional[str] = Header(None)):
     # Zde by byla integrace WeasyPrint. Prozatím vracíme HTML náhled.
     # V produkci: import weasyprint ...
-    
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="utf-8">
-        <style>
-            body {{ font-family: DejaVu Sans, sans-serif; padding: 40px; color: #333; }}
-            .header {{ text-align: center; border-bottom: 2px solid #333; margin-bottom: 20px; padding-bottom: 10px; }}
-            h1 {{ font-size: 24px; margin: 0; }}
-            h2 {{ font-size: 16px; margin: 5px 0 0; color: #666; }}
-            
-            .section {{ margin-bottom: 20px; }}
-            .grid {{ display: grid; grid-template-columns: 1fr 1fr; gap: 20px; }}
-            
-            .box {{ border: 1px solid #ddd; padding: 15px; border-radius: 5px; background: #f9f9f9; }}
-            .box h3 {{ margin-top: 0; font-size: 14px; text-transform: uppercase; color: #555; }}
-            
-            table {{ width: 100%; border-collapse: collapse; margin-top: 10px; font-size: 12px; }}
-            th, td {{ border: 1px solid #ccc; padding: 8px; text-align: left; }}
-            th {{ background: #eee; }}
-            
-            .footer {{ margin-top: 50px; border-top: 1px solid #ccc; padding-top: 20px; font-size: 12px; }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>ZPRÁVA O REVIZI {doc.get('type')}</h1>
-            <h2>Číslo protokolu: {doc.get('reportNumber')}</h2>
-        </div>
-        
-        <div class="grid section">
-            <div class="box">
-                <h3>Objednatel</h3>
-                <p><strong>{doc.get('customerInfo', {}).get('name')}</strong></p>
-                <p>IČ: {doc.get('customerInfo', {}).get('ico', '-')}</p>
-                <p>{doc.get('customerInfo', {}).get('address', {}).get('street')}</p>
-            </div>
-            <div class="box">
-                <h3>Dodavatel (Servis)</h3>
-                <p><strong>{doc.get('supplierInfo', {}).get('name')}</strong></p>
-                <p>IČ: {doc.get('supplierInfo', {}).get('ico')}</p>
-                <p>{doc.get('supplierInfo', {}).get('address', {}).get('street')}</p>
-            </div>
-        </div>
-
-        <div class="section">
-             <h3>Předmět revize</h3>
-             <p>{doc.get('subject')}</p>
-        </div>
-
-        <div class="section">
-            <h3>Měření a zkoušky</h3>
-            <table>
-                <tr>
-                    <th style="width: 50%">Měření</th>
-                    <th>Hodnota</th>
-                    <th>Verdikt</th>
-                </tr>
-                {''.join([f"<tr><td>{m['label']}</td><td><strong>{m['value']}</strong> {m.get('unit','')}</td><td>{m['verdict']}</td></tr>" for m in doc.get('measurements', [])])}
-            </table>
-        </div>
-        
-        <div class="section box" style="background: #fff; border-color: #333;">
-            <h3>Celkový posudek</h3>
-            <p style="font-size: 14px; font-weight: bold;">{doc.get('conclusion')}</p>
-        </div>
-
-        <div class="footer grid">
-            <div>
-                Datum provedení: {doc.get('dateExecution')}<br/>
-                Příští revize: <strong>{doc.get('dateNext')}</strong>
-            </div>
-            <div style="text-align: right;">
-                Technik: {doc.get('technicianName')}<br/>
-                Osvědčení: {doc.get('technicianCertificate') or '-'}
-            </div>
-        </div>
-    </body>
-    </html>
+    meta = await db.reports.find_one({"id": report_id}, {"_id": 0, "updatedAt": 1})
+    if not meta: raise HTTPException(404, "Report not found")
+
+    etag = report_etag(report_id, meta.get("updatedAt"))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    html_content = report_render_cache.get(etag)
+    if html_content is None:
+        doc = await db.reports.find_one({"id": report_id})
+        if not doc: raise HTTPException(404, "Report not found")
+        html_content = render_report_html(doc)
+        etag = headers["ETag"] = report_etag(report_id, doc.get("updatedAt"))
+        report_render_cache.set(etag, html_content)
+
+    return Response(html_content.encode('utf-8'), media_type="text/html", headers=headers)
+
+# ==========================================
+# --- PDF PROTOKOLY (FRONTA RENDEROVÁNÍ) ---
+# ==========================================
+
+# Render do PDF trvá sekundy CPU - úlohy jdou přes kolekci `render_jobs` (stav přežije restart)
+# do asyncio fronty, kterou zpracovává PDF_WORKERS smyček nad process poolem.
+pdf_executor: Optional[ProcessPoolExecutor] = None
+pdf_queue: "asyncio.Queue[str]" = asyncio.Queue()
+
+def report_pdf_path(report_id: str, updated_at: Optional[str]) -> str:
+    version = hashlib.sha1(str(updated_at).encode("utf-8")).hexdigest()[:12]
+    return os.path.join(PDF_DIR, f"{report_id}_{version}.pdf")
+
+def _write_file_atomic(path: str, data: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f: f.write(data)
+    os.replace(tmp, path)
+
+async def enqueue_pdf_render(report_id: str) -> dict:
     """
-    
-    return StreamingResponse(io.BytesIO(html_content.encode('utf-8')), media_type="text/html")
+    Zařadí render aktuální verze revize. Na jednu verzi (reportId, reportUpdatedAt) připadá jediná
+    úloha (unikátní index + upsert), souběžné požadavky ji tedy sdílí. Selhaná úloha nebo hotová
+    bez souboru se zařadí znovu.
+    """
+    meta = await db.reports.find_one({"id": report_id}, {"_id": 0, "updatedAt": 1})
+    if not meta: raise HTTPException(404, "Report not found")
+    updated_at = meta.get("updatedAt")
+
+    job_id = uuid.uuid4().hex
+    try:
+        job = await db.render_jobs.find_one_and_update(
+            {"reportId": report_id, "reportUpdatedAt": updated_at},
+            {"$setOnInsert": {"id": job_id, "status": "QUEUED", "file": None, "error": None,
+                              "createdAt": datetime.utcnow().isoformat(), "startedAt": None, "finishedAt": None}},
+            projection={"_id": 0}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Souběžný upsert stejné verze vyhrál - použijeme jeho úlohu
+        job = await db.render_jobs.find_one({"reportId": report_id, "reportUpdatedAt": updated_at}, {"_id": 0})
+    if job["id"] == job_id:
+        await pdf_queue.put(job_id)
+        return job
+
+    if job["status"] == "FAILED" or (job["status"] == "DONE" and not os.path.exists(job["file"] or "")):
+        retry = await db.render_jobs.find_one_and_update(
+            {"id": job["id"], "status": job["status"]},
+            {"$set": {"status": "QUEUED", "file": None, "error": None, "startedAt": None, "finishedAt": None}},
+            projection={"_id": 0}, return_document=ReturnDocument.AFTER
+        )
+        if retry:
+            await pdf_queue.put(retry["id"])
+            return retry
+        job = await db.render_jobs.find_one({"id": job["id"]}, {"_id": 0}) or job
+    return job
+
+def _remove_files(paths: List[str]):
+    for path in paths:
+        try: os.remove(path)
+        except FileNotFoundError: pass
+
+async def _drop_old_pdf_versions(report_id: str, updated_at: Optional[str]):
+    """Po dokončení nové verze smaže PDF a úlohy starších verzí téže revize."""
+    old = [j async for j in db.render_jobs.find(
+        {"reportId": report_id, "reportUpdatedAt": {"$ne": updated_at}, "status": {"$in": ["DONE", "FAILED"]}},
+        {"_id": 0, "id": 1, "file": 1})]
+    if not old: return
+    await asyncio.to_thread(_remove_files, [j["file"] for j in old if j.get("file")])
+    await db.render_jobs.delete_many({"id": {"$in": [j["id"] for j in old]}})
+
+async def _process_render_job(job_id: str):
+    job = await db.render_jobs.find_one_and_update(
+        {"id": job_id, "status": "QUEUED"},
+        {"$set": {"status": "RUNNING", "startedAt": datetime.utcnow().isoformat()}}
+    )
+    if not job: return
+    try:
+        doc = await db.reports.find_one({"id": job["reportId"]}, {"_id": 0})
+        if not doc: raise ValueError("Report not found")
+        # Úloha patří jedné verzi; revize upravená mezitím má vlastní úlohu
+        if doc.get("updatedAt") != job["reportUpdatedAt"]: raise ValueError("Report was modified, render it again")
+        pdf = await asyncio.get_running_loop().run_in_executor(pdf_executor, render_report_pdf, doc)
+        path = report_pdf_path(doc["id"], doc.get("updatedAt"))
+        await asyncio.to_thread(_write_file_atomic, path, pdf)
+        result = {"status": "DONE", "file": path}
+    except Exception as e:
+        result = {"status": "FAILED", "error": str(e)}
+    result["finishedAt"] = datetime.utcnow().isoformat()
+    await db.render_jobs.update_one({"id": job_id}, {"$set": result})
+    if result["status"] == "DONE": await _drop_old_pdf_versions(job["reportId"], job["reportUpdatedAt"])
+
+async def pdf_render_worker():
+    while True:
+        job_id = await pdf_queue.get()
+        try:
+            await _process_render_job(job_id)
+        except Exception:
+            pass  # stav úlohy zůstane v DB, po restartu se zkusí znovu
+        finally:
+            pdf_queue.task_done()
+
+async def dedupe_render_jobs():
+    """Starší verze zakládaly na jednu verzi revize více úloh - ponecháme nejnovější, jinak neprojde unikátní index."""
+    async for dup in db.render_jobs.aggregate([
+        {"$sort": {"createdAt": -1}},
+        {"$group": {"_id": {"r": "$reportId", "u": "$reportUpdatedAt"}, "ids": {"$push": "$id"}, "n": {"$sum": 1}}},
+        {"$match": {"n": {"$gt": 1}}},
+    ]):
+        await db.render_jobs.delete_many({"id": {"$in": dup["ids"][1:]}})
+
+async def start_pdf_workers():
+    global pdf_executor
+    pdf_executor = ProcessPoolExecutor(max_workers=PDF_WORKERS)
+    # Úlohy přerušené restartem vrátíme do fronty
+    await db.render_jobs.update_many({"status": "RUNNING"}, {"$set": {"status": "QUEUED"}})
+    async for job in db.render_jobs.find({"status": "QUEUED"}, {"_id": 0, "id": 1}).sort("createdAt", 1):
+        await pdf_queue.put(job["id"])
+    for _ in range(PDF_WORKERS):
+        asyncio.create_task(pdf_render_worker())
+
+@app.post("/reports/{report_id}/render")
+async def render_report(report_id: str, user: dict = Depends(get_current_user)):
+    return await enqueue_pdf_render(report_id)
+
+@app.get("/render-jobs/{job_id}")
+async def get_render_job(job_id: str, user: dict = Depends(get_current_user)):
+    job = await db.render_jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job: raise HTTPException(404, "Job not found")
+    return job
+
+@app.get("/reports/{report_id}/pdf/file")
+async def download_report_pdf(report_id: str, if_none_match: Optional[str] = Header(None)):
+    """Hotové PDF aktuální verze revize. Render se zařazuje jen přes POST /reports/{id}/render."""
+    meta = await db.reports.find_one({"id": report_id}, {"_id": 0, "updatedAt": 1, "reportNumber": 1})
+    if not meta: raise HTTPException(404, "Report not found")
+
+    etag = report_etag(report_id, meta.get("updatedAt"))
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    path = report_pdf_path(report_id, meta.get("updatedAt"))
+    if not os.path.exists(path): raise HTTPException(404, "PDF not rendered yet (POST /reports/{id}/render)")
+
+    filename = quote(f"revize_{str(meta.get('reportNumber') or report_id).replace('/', '-')}.pdf")
+    headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{filename}"
+    return FileResponse(path, media_type="application/pdf", headers=headers)
 
 # ==========================================
 # --- OSTATNÍ EXISTUJÍCÍ ENDPOINTY ---
 # ==========================================
 
+def with_ids(items: List[Any]) -> List[dict]:
+    """Hromadné uložení seznamu: id se přidělí při zápisu (bez něj by prvek šel načíst jen podle _id)."""
+    if not all(isinstance(i, dict) for i in items): raise HTTPException(400, "Expected a list of objects")
+    return [{**{k: v for k, v in i.items() if k != "_id"}, "id": i.get("id") or uuid.uuid4().hex} for i in items]
+
 @app.get("/groups")
 async def get_groups(user: dict = Depends(get_current_user)):
-    return [fix_mongo_id(d) async for d in db.groups.find({})]
+    return FastJSONResponse([d async for d in db.groups.find({}, {"_id": 0})])
 
 @app.post("/groups")
 async def create_group_or_bulk(data: Any = Body(...), user: dict = Depends(get_current_user)):
     if isinstance(data, list):
+        data = with_ids(data)
         await db.groups.delete_many({})
         if data: await db.groups.insert_many(data)
+        notify_global("group", "reload")
         return {"status": "bulk_saved"}
     else:
         if "id" not in data: data["id"] = uuid.uuid4().hex
         await db.groups.insert_one(data)
+        notify_global("group", "create", data["id"], fix_mongo_id(dict(data)))
         return {"status": "created"}
 
 @app.delete("/groups/{group_id}")
 async def delete_group(group_id: str, user: dict = Depends(get_current_user)):
     await db.groups.delete_one({"id": group_id})
+    notify_global("group", "delete", group_id)
     return {"status": "deleted"}
 
 @app.patch("/groups/{group_id}")
@@ -600,146 +1748,617 @@ async def update_group(group_id: str, updates: dict = Body(...), user: dict = De
     if "_id" in updates: del updates["_id"]
     result = await db.groups.update_one({"id": group_id}, {"$set": updates})
     if result.matched_count == 0: raise HTTPException(404, "Group not found")
+    notify_global("group", "update", group_id, updates)
     return {"status": "updated"}
 
 @app.get("/templates")
 async def get_templates(user: dict = Depends(get_current_user)):
-    return [fix_mongo_id(d) async for d in db.templates.find({})]
+    return FastJSONResponse([d async for d in db.templates.find({}, {"_id": 0})])
 
 @app.post("/templates")
 async def save_templates(templates: List[dict] = Body(...), user: dict = Depends(get_current_user)):
+    templates = with_ids(templates)
     await db.templates.delete_many({})
     if templates: await db.templates.insert_many(templates)
     return {"status": "saved"}
 
+# Soubory se ukládají podle obsahu: uploads/<sha256[:2]>/<sha256><přípona>.
+# Kolekce `upload_blobs` drží počet odkazů - stejný soubor nahraný k více objektům zabírá disk jen jednou.
+UPLOAD_TMP_DIR = os.path.join(UPLOAD_DIR, ".tmp")
+
+def _blob_relpath(sha256: str, ext: str) -> str:
+    return f"{sha256[:2]}/{sha256}{ext}"
+
+def _hash_and_write(digest, buffer, chunk: bytes):
+    digest.update(chunk)
+    buffer.write(chunk)
+
+async def release_upload(url: Optional[str]):
+    """Sníží počet odkazů na soubor; při nule smaže soubor i záznam. Staré (ne-hash) soubory ignoruje."""
+    if not url or not url.startswith("/uploads/"): return
+    blob = await db.upload_blobs.find_one_and_update(
+        {"path": url[len("/uploads/"):], "refCount": {"$gt": 0}},
+        {"$inc": {"refCount": -1}},
+        return_document=ReturnDocument.AFTER
+    )
+    if not blob or blob["refCount"] > 0: return
+    # Soubor nejdřív odsuneme stranou a záznam smažeme, jen když ho mezitím nikdo znovu nenahrál;
+    # jinak ho vrátíme (upload_file mezitím mohl zapsat vlastní kopii - pak stačí smazat tu naši)
+    token = uuid.uuid4().hex
+    marked = await db.upload_blobs.update_one({"id": blob["id"], "refCount": {"$lte": 0}}, {"$set": {"deleting": token}})
+    if not marked.modified_count: return
+    path = os.path.join(UPLOAD_DIR, blob["path"])
+    trash = f"{path}.{token}.deleted"
+    try: os.rename(path, trash)
+    except FileNotFoundError: trash = None
+    deleted = await db.upload_blobs.delete_one({"id": blob["id"], "refCount": {"$lte": 0}, "deleting": token})
+    if deleted.deleted_count:
+        remove_derivatives(UPLOAD_DIR, path)
+        if trash: os.remove(trash)
+    elif trash:
+        if os.path.exists(path): os.remove(trash)
+        else: os.replace(trash, path)
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...), user: dict = Depends(get_current_user)):
+async def upload_file(
+    file: UploadFile = File(...),
+    maxBytes: Optional[int] = Query(None, ge=1),
+    user: dict = Depends(get_current_user)
+):
+    """Nahrání souboru po částech mimo event loop. maxBytes může limit jen zpřísnit (UPLOAD_MAX_BYTES)."""
+    limit = min(maxBytes or UPLOAD_MAX_BYTES, UPLOAD_MAX_BYTES)
+    ext = os.path.splitext(file.filename or "")[1].lower()
+    os.makedirs(UPLOAD_TMP_DIR, exist_ok=True)
+    tmp_path = os.path.join(UPLOAD_TMP_DIR, uuid.uuid4().hex)
+    digest, size = hashlib.sha256(), 0
     try:
-        ext = os.path.splitext(file.filename)[1]
-        name = f"{uuid.uuid4()}{ext}"
-        path = os.path.join(UPLOAD_DIR, name)
-        with open(path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        return {"url": f"/uploads/{name}", "filename": file.filename}
+        with open(tmp_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > limit: raise HTTPException(413, f"File too large (max {limit} B)")
+                await asyncio.to_thread(_hash_and_write, digest, buffer, chunk)
+
+        sha256 = digest.hexdigest()
+        relpath = _blob_relpath(sha256, ext)
+        previous = await db.upload_blobs.find_one_and_update(
+            {"id": f"{sha256}{ext}"},
+            {"$inc": {"refCount": 1}, "$unset": {"deleting": ""},
+             "$setOnInsert": {"sha256": sha256, "path": relpath, "size": size, "createdAt": datetime.utcnow().isoformat()}},
+            upsert=True
+        )
+        final_path = os.path.join(UPLOAD_DIR, relpath)
+        # Soubor přesuneme vždy (stejný hash = stejný obsah) - souběžné release_upload ho mohl právě mazat
+        missing = not os.path.exists(final_path)
+        os.makedirs(os.path.dirname(final_path), exist_ok=True)
+        os.replace(tmp_path, final_path)
+        if (previous is None or missing) and is_image(final_path): schedule_derivatives(UPLOAD_DIR, final_path)
+        return {"url": f"/uploads/{relpath}", "filename": file.filename, "size": size,
+                "sha256": sha256, "deduplicated": previous is not None}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(500, f"Upload error: {e}")
+    finally:
+        if os.path.exists(tmp_path): os.remove(tmp_path)
 
 # --- BACKUP & RESTORE ---
+BACKUP_COLLECTIONS = ["objects", "groups", "templates", "users", "settings", "reports", "battery_types", "batteries", "logs", "upload_blobs"]
+BACKUP_FORMAT = "ndjson-v1"
+BACKUP_CHUNK_SIZE = 1024 * 1024
+BACKUP_CURSOR_BATCH = 500
+
+class _ZipStreamBuffer(io.RawIOBase):
+    """Nepřevíjitelný výstup pro ZipFile - sbírá zapsané bajty, generátor je průběžně odesílá."""
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.size = 0
+
+    def writable(self): return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self.size += len(b)
+        return len(b)
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.size = 0
+        return data
+
+def _take(iterator, count: int) -> list:
+    return list(islice(iterator, count))
+
+def _write_backup_docs(entry, docs: List[dict]):
+    """Běží v threadu: serializace a DEFLATE jedné dávky dokumentů."""
+    entry.write(b"".join(json.dumps(fix_mongo_id(d), cls=JSONEncoder, ensure_ascii=False).encode("utf-8") + b"\n" for d in docs))
+
+def _list_upload_files() -> List[str]:
+    if not os.path.exists(UPLOAD_DIR): return []
+    found = []
+    for root, dirs, files in os.walk(UPLOAD_DIR):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        found += [os.path.relpath(os.path.join(root, f), UPLOAD_DIR).replace(os.sep, "/") for f in files]
+    return found
+
+def _copy_chunk(src, dst) -> int:
+    chunk = src.read(BACKUP_CHUNK_SIZE)
+    if chunk: dst.write(chunk)
+    return len(chunk)
+
+async def _stream_backup_zip():
+    """
+    ZIP se zálohou po částech: manifest, <kolekce>.ndjson po dávkách z kurzoru, pak uploads/.
+    Serializace, komprese i čtení souborů běží v threadu, event loop jen předává hotové bloky.
+    """
+    buf = _ZipStreamBuffer()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        manifest = {"format": BACKUP_FORMAT, "createdAt": datetime.utcnow().isoformat(), "collections": BACKUP_COLLECTIONS}
+        zip_file.writestr("manifest.json", json.dumps(manifest))
+
+        for name in BACKUP_COLLECTIONS:
+            with zip_file.open(f"{name}.ndjson", "w", force_zip64=True) as entry:
+                cursor = db[name].find({}).batch_size(BACKUP_CURSOR_BATCH)
+                while docs := await cursor.to_list(length=BACKUP_CURSOR_BATCH):
+                    await asyncio.to_thread(_write_backup_docs, entry, docs)
+                    if buf.size >= BACKUP_CHUNK_SIZE: yield buf.pop()
+            yield buf.pop()
+
+        for rel in await asyncio.to_thread(_list_upload_files):
+            try:
+                src = await asyncio.to_thread(open, os.path.join(UPLOAD_DIR, rel), "rb")
+            except FileNotFoundError:
+                continue  # smazán mezi výpisem adresáře a čtením
+            try:
+                with zip_file.open(f"uploads/{rel}", "w", force_zip64=True) as dst:
+                    while await asyncio.to_thread(_copy_chunk, src, dst):
+                        if buf.size >= BACKUP_CHUNK_SIZE: yield buf.pop()
+            finally:
+                src.close()
+            yield buf.pop()
+    yield buf.pop()
+
 @app.get("/backup/export")
 async def export_backup(user: dict = Depends(get_current_admin)):
-    data = {
-        "objects": [fix_mongo_id(d) async for d in db.objects.find({})],
-        "groups": [fix_mongo_id(d) async for d in db.groups.find({})],
-        "templates": [fix_mongo_id(d) async for d in db.templates.find({})],
-        "users": [fix_mongo_id(d) async for d in db.users.find({})],
-        "settings": [fix_mongo_id(d) async for d in db.settings.find({})],
-        "reports": [fix_mongo_id(d) async for d in db.reports.find({})],
-        "battery_types": [fix_mongo_id(d) async for d in db.battery_types.find({})]
-    }
-
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-        zip_file.writestr("data.json", json.dumps(data, cls=JSONEncoder, indent=2))
-        if os.path.exists(UPLOAD_DIR):
-            for root, dirs, files in os.walk(UPLOAD_DIR):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    zip_file.write(file_path, os.path.join("uploads", file))
-
-    zip_buffer.seek(0)
     timestamp = datetime.now().strftime("%Y-%m-%d_%H-%M")
     return StreamingResponse(
-        zip_buffer, 
+        _stream_backup_zip(),
         media_type="application/zip", 
         headers={"Content-Disposition": f"attachment; filename=batteryguard_backup_{timestamp}.zip"}
     )
 
+BACKUP_IMPORT_BATCH = 1000
+STAGING_PREFIX = "_import_"
+UPLOAD_STAGING_DIR = f"{UPLOAD_DIR}.__import__"
+# Ostrá data odložená během výměny - při chybě se z nich vrací původní stav
+PREIMPORT_PREFIX = "_preimport_"
+UPLOAD_PREIMPORT_DIR = f"{UPLOAD_DIR}.__preimport__"
+
+# Stav posledního/běžícího importu (jeden import najednou)
+import_lock = asyncio.Lock()
+import_progress: Dict[str, Any] = {"status": "idle"}
+
+def _iter_backup_collection(zip_file: zipfile.ZipFile, name: str, legacy: Optional[dict]):
+    """Dokumenty jedné kolekce ze zálohy - NDJSON se čte po řádcích, starý data.json je už načtený."""
+    if legacy is not None:
+        yield from legacy.get(name) or []
+        return
+    if f"{name}.ndjson" not in zip_file.namelist(): return
+    with zip_file.open(f"{name}.ndjson") as entry:
+        for line in io.TextIOWrapper(entry, encoding="utf-8"):
+            if line.strip(): yield json.loads(line)
+
+async def _load_staging_collection(zip_file: zipfile.ZipFile, name: str, legacy: Optional[dict]) -> int:
+    """Naplní stagingovou kolekci po dávkách a vytvoří na ní indexy z registru (ověří i unikátnost)."""
+    staging = db[f"{STAGING_PREFIX}{name}"]
+    await staging.drop()
+    await db.create_collection(staging.name)
+    count = 0
+    docs = _iter_backup_collection(zip_file, name, legacy)
+    # Dekomprese a json.loads běží v threadu, do Monga se zapisuje po dávkách
+    while batch := await asyncio.to_thread(_take, docs, BACKUP_IMPORT_BATCH):
+        for doc in batch: doc.pop("_id", None)
+        await staging.insert_many(batch, ordered=False)
+        count += len(batch)
+        import_progress["collections"][name] = count
+    import_progress["collections"][name] = count
+    for keys, options in INDEX_REGISTRY.get(name, []):
+        await staging.create_index(keys, **options)
+    return count
+
+def _read_legacy_backup(zip_file: zipfile.ZipFile) -> dict:
+    with zip_file.open("data.json") as entry:
+        return json.load(entry)
+
+def _extract_backup_uploads(zip_file: zipfile.ZipFile) -> int:
+    """Rozbalí uploads/ ze zálohy do stagingového adresáře (po částech, bez načtení do paměti)."""
+    shutil.rmtree(UPLOAD_STAGING_DIR, ignore_errors=True)
+    os.makedirs(UPLOAD_STAGING_DIR, exist_ok=True)
+    count = 0
+    for member in zip_file.namelist():
+        if member.startswith("uploads/") and not member.endswith("/"):
+            # Zachová podadresáře (uploads/<hash[:2]>/...), ale nepustí cesty mimo staging
+            parts = [p for p in member[len("uploads/"):].split("/") if p and p not in (".", "..")]
+            if parts:
+                target = os.path.join(UPLOAD_STAGING_DIR, *parts)
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                with zip_file.open(member) as src, open(target, "wb") as dst:
+                    shutil.copyfileobj(src, dst, BACKUP_CHUNK_SIZE)
+                count += 1
+    return count
+
+def _move_dir_entries(src: str, dst: str):
+    """Přesune obsah adresáře (ne adresář samotný - UPLOAD_DIR může být mount, proto ne rename)."""
+    os.makedirs(dst, exist_ok=True)
+    for name in os.listdir(src):
+        os.replace(os.path.join(src, name), os.path.join(dst, name))
+
+def _clear_dir(path: str):
+    for entry in os.scandir(path):
+        if entry.is_dir(): shutil.rmtree(entry.path)
+        else: os.remove(entry.path)
+
+def _swap_uploads():
+    """Odloží současné soubory do UPLOAD_PREIMPORT_DIR a nahradí je stagingem."""
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    shutil.rmtree(UPLOAD_PREIMPORT_DIR, ignore_errors=True)
+    _move_dir_entries(UPLOAD_DIR, UPLOAD_PREIMPORT_DIR)
+    _move_dir_entries(UPLOAD_STAGING_DIR, UPLOAD_DIR)
+
+def _restore_uploads():
+    """Vrátí odložené soubory (po chybě ve výměně)."""
+    if not os.path.isdir(UPLOAD_PREIMPORT_DIR): return
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    _clear_dir(UPLOAD_DIR)
+    _move_dir_entries(UPLOAD_PREIMPORT_DIR, UPLOAD_DIR)
+    shutil.rmtree(UPLOAD_PREIMPORT_DIR, ignore_errors=True)
+
+async def _rename_collection(src: str, dst: str):
+    await client.admin.command("renameCollection", f"{db.name}.{src}", to=f"{db.name}.{dst}", dropTarget=True)
+
+async def _swap_collections():
+    """Ostré kolekce nejdřív odloží pod PREIMPORT_PREFIX, teprve pak na jejich místo přejmenuje staging."""
+    existing = set(await db.list_collection_names())
+    for name in BACKUP_COLLECTIONS:
+        await db[f"{PREIMPORT_PREFIX}{name}"].drop()
+        if name in existing: await _rename_collection(name, f"{PREIMPORT_PREFIX}{name}")
+    for name in BACKUP_COLLECTIONS:
+        await _rename_collection(f"{STAGING_PREFIX}{name}", name)
+
+async def _rollback_swap():
+    """Vrátí odložené kolekce a soubory. Kolekce, která před importem neexistovala, se jen zahodí."""
+    existing = set(await db.list_collection_names())
+    for name in BACKUP_COLLECTIONS:
+        if f"{PREIMPORT_PREFIX}{name}" in existing:
+            await _rename_collection(f"{PREIMPORT_PREFIX}{name}", name)
+        elif name not in existing or f"{STAGING_PREFIX}{name}" not in existing:
+            # Buď kolekce vůbec nebyla, nebo je na jejím místě už obnovená - původně neexistovala
+            await db[name].drop()
+    await asyncio.to_thread(_restore_uploads)
+
+async def _drop_preimport():
+    for name in BACKUP_COLLECTIONS:
+        await db[f"{PREIMPORT_PREFIX}{name}"].drop()
+    shutil.rmtree(UPLOAD_PREIMPORT_DIR, ignore_errors=True)
+    shutil.rmtree(UPLOAD_STAGING_DIR, ignore_errors=True)
+
+@app.get("/backup/import/status")
+async def import_backup_status(user: dict = Depends(get_current_admin)):
+    return import_progress
+
 @app.post("/backup/import")
 async def import_backup(file: UploadFile = File(...), user: dict = Depends(get_current_admin)):
+    """
+    Obnova ze zálohy: ZIP se streamuje na disk, kolekce se po dávkách plní do stagingu
+    a teprve když vše projde, nahradí se ostré kolekce přes renameCollection. Ostré kolekce a soubory
+    se přitom nejdřív odloží (PREIMPORT_PREFIX), takže chyba při stagingu i při výměně vrátí
+    současná data. Chyba až v dodatečných krocích po výměně (migrace, čítače) nechá obnovená data
+    na místě - hlásí se jako "restored with errors". Selže-li i návrat, odložená data zůstanou
+    v kolekcích _preimport_* a adresáři uploads.__preimport__. Průběh: GET /backup/import/status.
+    """
     if not file.filename.endswith(".zip"): raise HTTPException(400, "Must be ZIP")
+    if import_lock.locked(): raise HTTPException(409, "Import already running")
+
+    async with import_lock:
+        import_progress.clear()
+        import_progress.update({"status": "running", "phase": "upload", "bytesReceived": 0,
+                                "collections": {}, "files": 0, "startedAt": datetime.utcnow().isoformat()})
+        fd, tmp_path = tempfile.mkstemp(suffix=".zip")
+        try:
+            # 1. Upload na disk po částech
+            with os.fdopen(fd, "wb") as tmp:
+                while chunk := await file.read(BACKUP_CHUNK_SIZE):
+                    await asyncio.to_thread(tmp.write, chunk)
+                    import_progress["bytesReceived"] += len(chunk)
+
+            with await asyncio.to_thread(zipfile.ZipFile, tmp_path, "r") as zip_file:
+                names = zip_file.namelist()
+                legacy = None
+                if "data.json" in names:
+                    legacy = await asyncio.to_thread(_read_legacy_backup, zip_file)
+                elif "manifest.json" not in names:
+                    raise HTTPException(400, "Missing data.json or manifest.json")
+
+                # 2. Staging kolekcí a souborů
+                import_progress["phase"] = "staging"
+                for name in BACKUP_COLLECTIONS:
+                    await _load_staging_collection(zip_file, name, legacy)
+                legacy = None
+                import_progress["files"] = await asyncio.to_thread(_extract_backup_uploads, zip_file)
+
+            # 3. Výměna - až teď se sahá na ostrá data
+            import_progress["phase"] = "swap"
+            await _swap_collections()
+            await asyncio.to_thread(_swap_uploads)
+            import_progress["phase"] = "finalize"
+            await _drop_preimport()
+
+            user_cache.invalidate()
+            invalidate_stats_cache()
+            await seed_report_counters()
+
+            # Synchronizující klienti musí po obnově načíst vše znovu
+            await db.object_tombstones.delete_many({})
+            last = await db.objects.find_one({"rev": {"$exists": True}}, {"_id": 0, "rev": 1}, sort=[("rev", -1)])
+            await db.counters.update_one(
+                {"id": OBJECT_REV_COUNTER},
+                {"$max": {"seq": (last or {}).get("rev", 0)}, "$set": {"epoch": uuid.uuid4().hex}},
+                upsert=True
+            )
+
+            # Starší zálohy mají baterie a deník vnořené v objektech
+            await db.migrations.delete_many({"id": {"$in": ["batteries_v1", "logs_v1"]}})
+            migrations_done.clear()
+            await migrate_embedded_batteries()
+            await migrate_embedded_logs()
+            await sync_object_locations({})
+            broker.publish(RESYNC)
+
+            import_progress.update({"status": "success", "phase": "done", "finishedAt": datetime.utcnow().isoformat()})
+            return {"status": "success", "collections": import_progress["collections"], "files": import_progress["files"]}
+        except Exception as e:
+            error = getattr(e, "detail", None) or str(e)
+            phase = import_progress.get("phase")
+            if phase == "finalize":
+                # Data ze zálohy už jsou na místě, selhal až úklid/přepočet - nevracet
+                message = f"Backup restored, but post-restore steps failed: {error}"
+                broker.publish(RESYNC)
+            elif phase == "swap":
+                try:
+                    await _rollback_swap()
+                    message = f"Restore failed, previous data kept: {error}"
+                except Exception as rollback_error:
+                    logger.exception("Návrat dat po neúspěšné obnově selhal")
+                    message = (f"Restore failed and rollback failed ({rollback_error}) - data are partially restored, "
+                               f"previous data remain in {PREIMPORT_PREFIX}* collections: {error}")
+                broker.publish(RESYNC)
+            else:
+                message = f"Restore failed, previous data kept: {error}"
+            import_progress.update({"status": "failed", "error": message, "finishedAt": datetime.utcnow().isoformat()})
+            for name in BACKUP_COLLECTIONS:
+                await db[f"{STAGING_PREFIX}{name}"].drop()
+            shutil.rmtree(UPLOAD_STAGING_DIR, ignore_errors=True)
+            if isinstance(e, HTTPException) and phase not in ("swap", "finalize"): raise
+            raise HTTPException(500, message)
+        finally:
+            os.remove(tmp_path)
+
+# --- HROMADNÝ IMPORT OBJEKTŮ (CSV / XLSX) ---
+# Soubor se uloží na disk a čte po IMPORT_BATCH_ROWS řádcích v threadu (importer.py). Každá dávka je
+# jeden bulk_write do objects a jeden do batteries, v paměti je vždy jen jedna dávka.
+IMPORT_BATCH_ROWS = 500
+IMPORT_MAX_ERRORS = 1000
+
+def _next_rows(rows, count: int) -> List[tuple]:
+    return list(islice(rows, count))
+
+def _merge_import_batch(valid: List[tuple]):
+    """Řádky dávky -> objekty, technologie a baterie bez duplicit (další řádek stejného objektu doplní pole)."""
+    objects: Dict[str, dict] = {}
+    technologies: Dict[tuple, dict] = {}
+    batteries: Dict[tuple, dict] = {}
+    for obj, tech, battery in valid:
+        objects.setdefault(obj["id"], {}).update(obj)
+        if tech: technologies.setdefault((obj["id"], tech["id"]), {}).update(tech)
+        if battery: batteries[(obj["id"], tech["id"], battery["id"])] = battery_to_doc(obj["id"], tech["id"], battery)
+    return objects, technologies, batteries
+
+async def _preview_import_batch(valid: List[tuple], report: dict):
+    """Dry run: jen spočítá, co by se založilo a co aktualizovalo."""
+    objects, technologies, batteries = _merge_import_batch(valid)
+    existing = {o["id"] async for o in db.objects.find({"id": {"$in": list(objects)}}, {"_id": 0, "id": 1})}
+    stored = {(b["objectId"], b["technologyId"], b["id"]) async for b in db.batteries.find(
+        {"id": {"$in": [k[2] for k in batteries]}}, {"_id": 0, "objectId": 1, "technologyId": 1, "id": 1})}
+    report["objects"]["created"] += len(objects) - len(existing)
+    report["objects"]["updated"] += len(existing)
+    report["technologies"] += len(technologies)
+    report["batteries"]["created"] += len(batteries.keys() - stored)
+    report["batteries"]["updated"] += len(batteries.keys() & stored)
+
+async def _write_import_batch(valid: List[tuple], report: dict):
+    objects, technologies, batteries = _merge_import_batch(valid)
+    first_rev, now = await reserve_object_revisions(len(objects)), datetime.utcnow().isoformat()
+    object_writes = []
+    for n, (obj_id, fields) in enumerate(objects.items()):
+        on_insert = {**{k: v for k, v in OBJECT_DEFAULTS.items() if k not in fields}, **{f: [] for f in OBJECT_ARRAY_FIELDS}}
+        object_writes.append(UpdateOne({"id": obj_id}, {"$set": {**fields, "rev": first_rev + n, "updatedAt": now},
+                                                        "$setOnInsert": on_insert}, upsert=True))
+    result = await db.objects.bulk_write(object_writes, ordered=False)
+    report["objects"]["created"] += result.upserted_count
+    report["objects"]["updated"] += len(objects) - result.upserted_count
+
+    # Existující technologii se přepíšou uvedená pole, chybějící se přidá (každá ze dvou operací trefí jen jeden případ)
+    tech_writes = []
+    for (obj_id, tech_id), fields in technologies.items():
+        changes = {f"technologies.$.{k}": v for k, v in fields.items() if k != "id"}
+        if changes: tech_writes.append(UpdateOne({"id": obj_id, "technologies.id": tech_id}, {"$set": changes}))
+        tech_writes.append(UpdateOne({"id": obj_id, "technologies.id": {"$ne": tech_id}},
+                                     {"$push": {"technologies": {**TECHNOLOGY_DEFAULTS, **fields, "batteries": []}}}))
+    if tech_writes: await db.objects.bulk_write(tech_writes, ordered=False)
+    report["technologies"] += len(technologies)
+
+    if batteries:
+        result = await db.batteries.bulk_write([
+            UpdateOne({"objectId": k[0], "technologyId": k[1], "id": k[2]}, {"$set": doc}, upsert=True)
+            for k, doc in batteries.items()
+        ], ordered=False)
+        report["batteries"]["created"] += result.upserted_count
+        report["batteries"]["updated"] += len(batteries) - result.upserted_count
+
+    await db.object_tombstones.delete_many({"id": {"$in": list(objects)}})
+    located = [obj_id for obj_id, fields in objects.items() if "lat" in fields or "lng" in fields]
+    if located: await sync_object_locations({"id": {"$in": located}})
+
+@app.post("/import/objects")
+async def import_objects(file: UploadFile = File(...), dryRun: bool = False, user: dict = Depends(get_current_admin)):
+    """
+    Import objektů, technologií a baterií z CSV nebo XLSX (sloupce viz importer.py). Řádky s chybou
+    se přeskočí a vrátí v `errors` (číslo řádku + zprávy). dryRun=true jen ověří soubor a spočítá změny.
+    Import je upsert podle id - po opravě chyb jde stejný soubor nahrát znovu.
+    """
+    if import_lock.locked(): raise HTTPException(409, "Import already running")
+    async with import_lock:
+        return await _run_object_import(file, dryRun)
+
+def _import_row_error(report: dict, number: int, messages: List[str]):
+    report["invalid"] += 1
+    if len(report["errors"]) < IMPORT_MAX_ERRORS: report["errors"].append({"row": number, "errors": messages})
+    else: report["errorsTruncated"] = True
+
+async def _load_import_references(object_ids: set, known_objects: set, known_technologies: set):
+    """Doplní známé objekty a jejich technologie z DB (pro řádky, které je odkazují jen id)."""
+    async for o in db.objects.find({"id": {"$in": list(object_ids)}}, {"_id": 0, "id": 1, "technologies.id": 1}):
+        known_objects.add(o["id"])
+        known_technologies.update((o["id"], t.get("id")) for t in o.get("technologies") or [])
+
+async def _run_object_import(file: UploadFile, dryRun: bool) -> dict:
+    """Tělo importu - běží pod import_lock (souběžně nesmí běžet jiný import ani obnova zálohy)."""
+    started = time.perf_counter()
+    fd, tmp_path = tempfile.mkstemp(suffix=os.path.splitext(file.filename or "")[1].lower())
+    report: Dict[str, Any] = {"dryRun": dryRun, "rows": 0, "valid": 0, "invalid": 0, "objects": {"created": 0, "updated": 0},
+                              "technologies": 0, "batteries": {"created": 0, "updated": 0}, "errors": [], "errorsTruncated": False}
     try:
-        content = await file.read()
-        zip_buffer = io.BytesIO(content)
-        with zipfile.ZipFile(zip_buffer, "r") as zip_file:
-            if "data.json" not in zip_file.namelist(): raise HTTPException(400, "Missing data.json")
-            json_data = json.loads(zip_file.read("data.json").decode("utf-8"))
-            
-            # Vymazání současných dat
-            await db.objects.delete_many({})
-            await db.groups.delete_many({})
-            await db.templates.delete_many({})
-            await db.users.delete_many({})
-            await db.settings.delete_many({})
-            await db.reports.delete_many({})
-            await db.battery_types.delete_many({})
-
-            # Vložení dat
-            if json_data.get("objects"): await db.objects.insert_many(json_data["objects"])
-            if json_data.get("groups"): await db.groups.insert_many(json_data["groups"])
-            if json_data.get("templates"): await db.templates.insert_many(json_data["templates"])
-            if json_data.get("users"): await db.users.insert_many(json_data["users"])
-            if json_data.get("settings"): await db.settings.insert_many(json_data["settings"])
-            if json_data.get("reports"): await db.reports.insert_many(json_data["reports"])
-            if json_data.get("battery_types"): await db.battery_types.insert_many(json_data["battery_types"])
-
-            # Obnovení souborů
-            if os.path.exists(UPLOAD_DIR):
-                shutil.rmtree(UPLOAD_DIR)
-            os.makedirs(UPLOAD_DIR, exist_ok=True)
-            for member in zip_file.namelist():
-                if member.startswith("uploads/") and not member.endswith("/"):
-                    filename = os.path.basename(member)
-                    if filename:
-                        target_path = os.path.join(UPLOAD_DIR, filename)
-                        with open(target_path, "wb") as f:
-                            f.write(zip_file.read(member))
-        return {"status": "success"}
-    except Exception as e:
-        raise HTTPException(500, f"Restore failed: {str(e)}")
+        size = 0
+        with os.fdopen(fd, "wb") as tmp:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > UPLOAD_MAX_BYTES: raise HTTPException(413, f"File too large (max {UPLOAD_MAX_BYTES} B)")
+                await asyncio.to_thread(tmp.write, chunk)
+        try:
+            rows = iter_rows(tmp_path, file.filename)
+        except ValueError as e:
+            raise HTTPException(400, str(e))
+        parser = RowParser(
+            [bt async for bt in db.battery_types.find({}, {"_id": 0, "id": 1, "name": 1, "capacityAh": 1, "voltageV": 1, "lifeMonths": 1})],
+            [g async for g in db.groups.find({}, {"_id": 0, "id": 1, "name": 1, "defaultBatteryLifeMonths": 1})],
+        )
+        # Objekty a technologie, které existují v DB nebo je založil dřívější řádek souboru
+        known_objects: set = set()
+        known_technologies: set = set()
+        looked_up: set = set()
+        while True:
+            try:
+                batch = await asyncio.to_thread(_next_rows, rows, IMPORT_BATCH_ROWS)
+            except Exception as e:
+                raise HTTPException(400, f"Cannot read file after row {report['rows'] + 1}: {e}")
+            if not batch: break
+            parsed = []
+            for number, row in batch:
+                try:
+                    parsed.append((number, parser.parse(number, row)))
+                except RowError as e:
+                    _import_row_error(report, number, e.messages)
+            batch_objects = {obj["id"] for _, (obj, _, _) in parsed} - looked_up
+            looked_up |= batch_objects
+            await _load_import_references(batch_objects, known_objects, known_technologies)
+            valid = []
+            for number, (obj, tech, battery) in parsed:
+                errors = unresolved_references(obj, tech, known_objects, known_technologies)
+                if errors:
+                    _import_row_error(report, number, errors)
+                    continue
+                known_objects.add(obj["id"])
+                if tech: known_technologies.add((obj["id"], tech["id"]))
+                valid.append((obj, tech, battery))
+            report["rows"] += len(batch)
+            report["valid"] += len(valid)
+            if valid: await (_preview_import_batch if dryRun else _write_import_batch)(valid, report)
+    finally:
+        os.remove(tmp_path)
+
+    if report["valid"] and not dryRun:
+        invalidate_stats_cache()
+        # Stovky objektů najednou - klienti i vyhledávací index načtou vše znovu místo jednotlivých událostí
+        broker.publish(RESYNC)
+    report["errors"].sort(key=lambda e: e["row"])
+    report["tookMs"] = round((time.perf_counter() - started) * 1000, 1)
+    return report
 
 # QR KÓD
+def object_qr_url(obj_id: str) -> str:
+    return f"{PUBLIC_URL}/#/object/{obj_id}"
+
+def qr_safe_name(doc: dict) -> str:
+    base_name = (doc.get('name') or 'object').replace(' ', '_')
+    return "".join([c for c in base_name if c.isalnum() or c in ('_', '-')])
+
 @app.get("/qr/object/{obj_id}")
 async def get_object_qr(obj_id: str): 
-    doc = await db.objects.find_one({"id": obj_id})
+    doc = await db.objects.find_one({"id": obj_id}, {"_id": 0, "name": 1})
     if not doc: raise HTTPException(404, "Object not found")
-    target_url = f"{PUBLIC_URL}/#/object/{obj_id}"
-    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=10, border=4)
-    qr.add_data(target_url)
-    qr.make(fit=True)
-    img = qr.make_image(image_factory=StyledPilImage, module_drawer=RoundedModuleDrawer())
-    img_buffer = io.BytesIO()
-    img.save(img_buffer, format="PNG")
-    img_buffer.seek(0)
-    from urllib.parse import quote
-    base_name = doc.get('name', 'object').replace(' ', '_')
-    safe_name = "".join([c for c in base_name if c.isalnum() or c in ('_', '-')])
-    encoded_filename = quote(f"qr_{safe_name}.png")
-    return StreamingResponse(img_buffer, media_type="image/png", headers={"Content-Disposition": f"inline; filename*=UTF-8''{encoded_filename}"})
+    png = await get_qr_png(object_qr_url(obj_id))
+    encoded_filename = quote(f"qr_{qr_safe_name(doc)}.png")
+    return Response(png, media_type="image/png", headers={"Content-Disposition": f"inline; filename*=UTF-8''{encoded_filename}"})
+
+@app.get("/qr/group/{group_id}")
+async def get_group_qr_sheet(group_id: str, format: str = "zip", user: dict = Depends(get_current_user)):
+    """QR štítky pro všechny objekty skupiny najednou: ZIP s PNG nebo tiskové PDF (format=pdf)."""
+    if format not in ("zip", "pdf"): raise HTTPException(400, "Invalid format")
+    objects = [d async for d in db.objects.find({"groupId": group_id}, {"_id": 0, "id": 1, "name": 1}).sort("name", 1)]
+    if not objects: raise HTTPException(404, "No objects in group")
+
+    pngs = await asyncio.gather(*(get_qr_png(object_qr_url(o["id"])) for o in objects))
+
+    if format == "pdf":
+        pdf = await build_qr_sheet_pdf([(o.get("name") or o["id"], png) for o, png in zip(objects, pngs)])
+        media_type, body, ext = "application/pdf", pdf, "pdf"
+    else:
+        zip_buffer = io.BytesIO()
+        used_names = set()
+        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_STORED) as zip_file:
+            for o, png in zip(objects, pngs):
+                name = f"qr_{qr_safe_name(o)}.png"
+                if name in used_names: name = f"qr_{qr_safe_name(o)}_{o['id']}.png"
+                used_names.add(name)
+                zip_file.writestr(name, png)
+        media_type, body, ext = "application/zip", zip_buffer.getvalue(), "zip"
+
+    encoded_filename = quote(f"qr_skupina_{group_id}.{ext}")
+    return Response(body, media_type=media_type, headers={"Content-Disposition": f"attachment; filename*=UTF-8''{encoded_filename}"})
 
 # BATTERY TYPES
 @app.get("/battery-types")
 async def get_battery_types_endpoint(user: dict = Depends(get_current_user)):
-    return [fix_mongo_id(d) async for d in db.battery_types.find({})]
+    return FastJSONResponse([d async for d in db.battery_types.find({}, {"_id": 0})])
 
 @app.post("/battery-types")
 async def create_battery_type_endpoint(bt: dict = Body(...), user: dict = Depends(get_current_admin)):
     if "id" not in bt: bt["id"] = uuid.uuid4().hex
     await db.battery_types.insert_one(bt)
-    return fix_mongo_id(bt)
+    bt = fix_mongo_id(bt)
+    notify_global("batteryType", "create", bt["id"], bt)
+    return bt
 
 @app.delete("/battery-types/{bt_id}")
 async def delete_battery_type_endpoint(bt_id: str, user: dict = Depends(get_current_admin)):
     await db.battery_types.delete_one({"id": bt_id})
+    notify_global("batteryType", "delete", bt_id)
     return {"status": "deleted"}
 
 # USERS
 @app.get("/users")
 async def get_all_users_endpoint(user: dict = Depends(get_current_admin)):
-    users = []
-    async for doc in db.users.find({}):
-        doc.pop("hashed_password", None)
-        users.append(fix_mongo_id(doc))
-    return users
+    return FastJSONResponse([d async for d in db.users.find({}, {"_id": 0, "hashed_password": 0})])
 
 @app.post("/users")
 async def create_user_admin_endpoint(req: dict = Body(...), user: dict = Depends(get_current_admin)):
@@ -748,26 +2367,34 @@ async def create_user_admin_endpoint(req: dict = Body(...), user: dict = Depends
     new_user = {
         "id": uuid.uuid4().hex, "name": req.get("name", "Neznámý"), "email": req.get("email"),
         "role": req.get("role", "TECHNICIAN"), "isAuthorized": True,
-        "hashed_password": get_password_hash(raw_password), "createdAt": datetime.utcnow().isoformat()
+        "hashed_password": await get_password_hash(raw_password), "createdAt": datetime.utcnow().isoformat()
     }
     await db.users.insert_one(new_user)
+    user_cache.invalidate(new_user["email"])
     new_user.pop("hashed_password", None)
     return fix_mongo_id(new_user)
 
+@app.get("/admin/cache-stats")
+async def get_cache_stats(user: dict = Depends(get_current_admin)):
+    return {"users": user_cache.stats(), "dashboard": stats_cache.stats(), "map": map_tile_cache.stats(), "events": broker.stats(),
+            "search": {**search_index.stats(), "pending": len(search_state["dirty"])}}
+
 @app.patch("/users/{user_id}/password")
 async def admin_change_user_password(user_id: str, body: dict = Body(...), user: dict = Depends(get_current_admin)):
     new_password = body.get("newPassword")
     if not new_password: raise HTTPException(400, "Required")
-    result = await db.users.update_one({"id": user_id}, {"$set": {"hashed_password": get_password_hash(new_password)}})
+    result = await db.users.update_one({"id": user_id}, {"$set": {"hashed_password": await get_password_hash(new_password)}})
     if result.matched_count == 0: raise HTTPException(404, "Not found")
+    user_cache.invalidate()
     return {"status": "password_updated"}
 
 @app.patch("/auth/password")
 async def change_self_password(body: dict = Body(...), user: dict = Depends(get_current_user)):
     current_password, new_password = body.get("currentPassword"), body.get("newPassword")
     full_user = await db.users.find_one({"email": user["email"]})
-    if not verify_password(current_password, full_user["hashed_password"]): raise HTTPException(400, "Invalid password")
-    await db.users.update_one({"email": user["email"]}, {"$set": {"hashed_password": get_password_hash(new_password)}})
+    if not await verify_password(current_password, full_user["hashed_password"]): raise HTTPException(400, "Invalid password")
+    await db.users.update_one({"email": user["email"]}, {"$set": {"hashed_password": await get_password_hash(new_password)}})
+    user_cache.invalidate(user["email"])
     return {"status": "password_changed"}
 
 
@@ -797,12 +2424,738 @@ async def save_measurement_settings(defs: List[MeasurementDefinition], user: dic
     return {"status": "saved"}
 
 
+# ==========================================
+# --- ŽIVÉ ZMĚNY (SSE) ---
+# ==========================================
+
+def _sse(event: dict) -> str:
+    return f"event: {event['entity']}\ndata: {json.dumps(event, default=str, ensure_ascii=False)}\n\n"
+
+@app.get("/events")
+async def change_events(request: Request, groupId: Optional[str] = None, token: Optional[str] = None,
+                        authorization: str = Header(None)):
+    """
+    Server-Sent Events se změnami objektů, revizí, skupin a typů baterií.
+    EventSource neumí posílat hlavičky, proto lze token předat i jako ?token=.
+    Při přetečení fronty přijde událost `resync` a spojení se ukončí - klient dotáhne
+    změny přes GET /objects/changes a připojí se znovu.
+    """
+    if authorization: await get_current_user(authorization)
+    elif token: await get_user_from_token(token)
+    else: raise HTTPException(401, "Missing auth")
+
+    sub = broker.subscribe(groupId)
+
+    async def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected(): break
+                    yield ": keepalive\n\n"
+                    continue
+                yield _sse(event)
+                if event is RESYNC: break
+        finally:
+            broker.unsubscribe(sub)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+CHANGE_STREAM_COLLECTIONS = ["objects", "object_tombstones", "reports", "groups", "battery_types"]
+
+async def _change_to_event(change: dict) -> Optional[dict]:
+    """Převede událost change streamu na stejný tvar, jaký publikují endpointy v režimu local."""
+    coll, op = change["ns"]["coll"], change["operationType"]
+    doc = change.get("fullDocument") or {}
+    if coll == "objects":
+        if op not in ("insert", "update", "replace") or not doc: return None  # smazání hlásí tombstone
+        data = (change.get("updateDescription") or {}).get("updatedFields") if op == "update" else None
+        return {"entity": "object", "op": "create" if op == "insert" else "update", "id": doc.get("id"),
+                "groupId": doc.get("groupId"), "rev": doc.get("rev"), "data": data}
+    if coll == "object_tombstones":
+        if op not in ("insert", "update", "replace") or not doc: return None
+        return {"entity": "object", "op": "delete", "id": doc.get("id"), "rev": doc.get("rev"), "global": True}
+    if coll == "reports":
+        if op == "delete": return {"entity": "report", "op": "delete", "global": True}
+        obj = await db.objects.find_one({"id": doc.get("objectId")}, {"_id": 0, "groupId": 1}) or {}
+        return {"entity": "report", "op": "create" if op == "insert" else "update", "id": doc.get("id"),
+                "objectId": doc.get("objectId"), "groupId": obj.get("groupId")}
+    entity = "group" if coll == "groups" else "batteryType"
+    if op == "delete" or not doc: return {"entity": entity, "op": "reload", "global": True}
+    return {"entity": entity, "op": "create" if op == "insert" else "update", "id": doc.get("id"),
+            "global": True, "data": fix_mongo_id(doc)}
+
+CHANGE_STREAM_UNSUPPORTED = 40573  # $changeStream je jen na replica setu
+
+async def watch_mongo_changes():
+    """
+    CHANGE_FEED_MODE=mongo: události z change streamů (vidí i zápisy z jiných instancí API).
+    Při výpadku se připojuje znovu s rostoucí prodlevou; události z výpadku jsou ztracené,
+    po obnovení proto klienti dostanou resync.
+    """
+    global CHANGE_FEED_MODE
+    pipeline = [{"$match": {"ns.coll": {"$in": CHANGE_STREAM_COLLECTIONS}}}]
+    delay, interrupted = 1, False
+    while True:
+        try:
+            async with db.watch(pipeline, full_document="updateLookup") as stream:
+                if interrupted: broker.publish(RESYNC)
+                delay, interrupted = 1, False
+                async for change in stream:
+                    event = await _change_to_event(change)
+                    if event: broker.publish(event)
+        except OperationFailure as e:
+            if e.code == CHANGE_STREAM_UNSUPPORTED:
+                # Standalone Mongo change streamy nepodporuje - přepneme na publikování z endpointů
+                logger.warning("Change streams are not supported, falling back to CHANGE_FEED_MODE=local")
+                CHANGE_FEED_MODE = "local"
+                return
+            logger.exception("Change stream failed, retrying in %s s", delay)
+        except Exception:
+            logger.exception("Change stream failed, retrying in %s s", delay)
+        interrupted = True
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, CHANGE_STREAM_MAX_RETRY_SECONDS)
+
+# ==========================================
+# --- FULLTEXTOVÉ HLEDÁNÍ ---
+# ==========================================
+# Index (search.py) se postaví líně při prvním hledání. Změny objektů si značí z událostí brokeru
+# a přeindexují se dávkou před dalším dotazem; jednou za SEARCH_REBUILD_SECONDS se staví celý znovu.
+search_index = SearchIndex()
+search_state: Dict[str, Any] = {"stale": True, "builtAt": 0.0, "dirty": set()}
+search_lock = asyncio.Lock()
+
+SEARCH_PROJECTION = {
+    "_id": 0, "id": 1, "name": 1, "address": 1, "description": 1, "technicalDescription": 1, "groupId": 1,
+    "contacts.name": 1, "contacts.phone": 1, "contacts.email": 1,
+    "technologies.name": 1, "technologies.batteries.serialNumber": 1,
+}
+
+async def _load_search_items(ids: Optional[List[str]] = None) -> List[tuple]:
+    scope = {"$in": ids} if ids is not None else None
+    serials: Dict[str, List[str]] = {}
+    battery_query: Dict[str, Any] = {"serialNumber": {"$nin": [None, ""]}}
+    if scope: battery_query["objectId"] = scope
+    async for bat in db.batteries.find(battery_query, {"_id": 0, "objectId": 1, "serialNumber": 1}):
+        serials.setdefault(bat["objectId"], []).append(bat["serialNumber"])
+    cursor = db.objects.find({"id": scope} if scope else {}, SEARCH_PROJECTION)
+    return [(obj, serials.get(obj["id"], [])) async for obj in cursor]
+
+def _build_search_index(items: List[tuple]) -> SearchIndex:
+    fresh = SearchIndex()
+    fresh.rebuild(items)
+    return fresh
+
+async def refresh_search_index():
+    global search_index
+    async with search_lock:
+        if search_state["stale"] or time.monotonic() - search_state["builtAt"] > SEARCH_REBUILD_SECONDS:
+            search_state.update(stale=False, dirty=set())
+            # Tokenizace celé databáze trvá - staví se ve vlákně do nového indexu a pak se jen vymění
+            # reference; hledání do té doby používá starý index
+            search_index = await asyncio.to_thread(_build_search_index, await _load_search_items())
+            search_state["builtAt"] = time.monotonic()
+        elif search_state["dirty"]:
+            ids = list(search_state["dirty"])
+            search_state["dirty"] = set()
+            items = await _load_search_items(ids)
+            for obj, serials in items: search_index.replace(obj, serials)
+            for obj_id in set(ids) - {obj["id"] for obj, _ in items}: search_index.remove(obj_id)
+
+async def change_listener():
+    """
+    Odvozená data ze změn objektů: značí objekty k přeindexování a maže dlaždice mapy.
+    Při přetečení fronty (resync) se index postaví znovu celý.
+    """
+    sub = broker.subscribe(internal=True)
+    while True:
+        event = await sub.queue.get()
+        if event["entity"] == "resync":
+            broker.unsubscribe(sub)
+            sub = broker.subscribe(internal=True)
+            search_state["stale"] = True
+            map_tile_cache.invalidate()
+        elif event["entity"] == "object" and event.get("id"):
+            search_state["dirty"].add(event["id"])
+            map_tile_cache.invalidate()
+
+@app.get("/search")
+async def search_objects(
+    q: str = Query(..., min_length=1, max_length=200),
+    limit: int = Query(20, ge=1, le=100),
+    groupId: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    """
+    Hledání objektů podle názvu, adresy, popisu, kontaktů, technologií a výrobních čísel baterií.
+    Bez diakritiky, slova dotazu jako prefixy. Zásahy mají `highlights` s rozsahy shody v hodnotě pole.
+    """
+    started = time.perf_counter()
+    await refresh_search_index()
+    hits = search_index.search(q, limit, groupId)
+    return {"query": q, "hits": hits, "tookMs": round((time.perf_counter() - started) * 1000, 2)}
+
+# ==========================================
+# --- MAPA (DLAŽDICE A SHLUKY) ---
+# ==========================================
+# Objekty mají GeoJSON `location` odvozené z lat/lng (2dsphere index). GET /map skládá výřez
+# z dlaždic (geo.py); každá dlaždice (skupina, zoom, x, y) se počítá jednou a drží v cache,
+# změny objektů cache mažou (viz change_listener).
+map_tile_cache = TTLCache(MAP_TILE_CACHE_TTL_SECONDS, max_size=4096)
+
+# lat/lng -> location, neplatné nebo chybějící souřadnice pole odstraní (pipeline update, bez čtení)
+OBJECT_LOCATION_EXPR = {"$cond": [
+    {"$and": [
+        {"$isNumber": "$lat"}, {"$isNumber": "$lng"},
+        {"$lte": [{"$abs": "$lat"}, 90]}, {"$lte": [{"$abs": "$lng"}, 180]},
+    ]},
+    {"type": "Point", "coordinates": ["$lng", "$lat"]},
+    "$$REMOVE"
+]}
+
+async def sync_object_locations(query: dict):
+    await db.objects.update_many(query, [{"$set": {"location": OBJECT_LOCATION_EXPR}}])
+
+async def compute_map_tiles(zoom: int, tiles: List[tuple], group_id: Optional[str]) -> Dict[tuple, List[dict]]:
+    """Vypočítá dlaždice jedním dotazem do objects (obdélník přes všechny) a jedním do batteries."""
+    xs, ys = [t[0] for t in tiles], [t[1] for t in tiles]
+    min_lng, _, _, max_lat = tile_bounds(zoom, min(xs), min(ys))
+    _, min_lat, max_lng, _ = tile_bounds(zoom, max(xs), max(ys))
+    query: Dict[str, Any] = {"location": {"$exists": True}}
+    polygon = bbox_polygon((min_lng, min_lat, max_lng, max_lat))
+    if polygon: query["location"] = {"$geoWithin": {"$geometry": polygon}}
+    if group_id: query["groupId"] = group_id
+
+    points: Dict[tuple, List[dict]] = {t: [] for t in tiles}
+    by_id: Dict[str, dict] = {}
+    async for obj in db.objects.find(query, {"_id": 0, "id": 1, "name": 1, "groupId": 1, "location": 1}):
+        lng, lat = obj["location"]["coordinates"]
+        fx, fy = tile_coords(lng, lat, zoom)
+        bucket = points.get((int(fx), int(fy)))
+        if bucket is None: continue  # mimo požadované dlaždice (rozšířený polygon)
+        point = {"id": obj["id"], "name": obj.get("name"), "groupId": obj.get("groupId"), "lat": lat, "lng": lng, "worstStatus": None}
+        bucket.append(point)
+        by_id[obj["id"]] = point
+
+    if by_id:
+        pipeline = [
+            {"$match": {"objectId": {"$in": list(by_id)}}},
+            {"$group": {"_id": "$objectId", "statuses": {"$addToSet": "$status"}}},
+        ]
+        async for row in db.batteries.aggregate(pipeline):
+            by_id[row["_id"]]["worstStatus"] = worst_status(row["statuses"])
+
+    grid = None if zoom >= MAP_MARKER_ZOOM else CLUSTER_GRID
+    return {(x, y): cluster_tile(pts, zoom, x, y, grid) for (x, y), pts in points.items()}
+
+@app.get("/map")
+async def get_map(
+    bbox: str,
+    zoom: int = Query(..., ge=0, le=22),
+    groupId: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    """
+    Značky a shluky pro výřez mapy. bbox=minLng,minLat,maxLng,maxLat, zoom jako v Leaflet.
+    Shluk nese počet objektů, těžiště, bbox a nejhorší stav baterie; od MAP_MARKER_ZOOM jen značky.
+    """
+    try:
+        bounds = tuple(float(v) for v in bbox.split(","))
+        if len(bounds) != 4 or not all(math.isfinite(v) for v in bounds): raise ValueError
+    except ValueError:
+        raise HTTPException(400, "Invalid bbox")
+    if bounds[0] > bounds[2] or bounds[1] > bounds[3]: raise HTTPException(400, "Invalid bbox")
+    try:
+        tiles = tiles_in_bbox(bounds, zoom, limit=MAP_MAX_TILES)
+    except ValueError:
+        raise HTTPException(400, "Bounding box too large for this zoom")
+
+    features: List[dict] = []
+    missing = []
+    for x, y in tiles:
+        cached = map_tile_cache.get(f"{groupId or '*'}:{zoom}:{x}:{y}")
+        if cached is None: missing.append((x, y))
+        else: features += cached
+    if missing:
+        for (x, y), tile_features in (await compute_map_tiles(zoom, missing, groupId)).items():
+            map_tile_cache.set(f"{groupId or '*'}:{zoom}:{x}:{y}", tile_features)
+            features += tile_features
+    return {"zoom": zoom, "tiles": len(tiles), "features": features}
+
+# ==========================================
+# --- ŽIVOTNÍ CYKLUS BATERIÍ A VÝHLED VÝMĚN ---
+# ==========================================
+# Termíny a stavy všech baterií se přepočítají najednou (forecast.py, NumPy) a zpět se zapíší
+# jen změněné. Baterie dosud vnořené v objektech (před migrací) se nepřepočítávají.
+LIFECYCLE_PROJECTION = {"_id": 0, "objectId": 1, "technologyId": 1, "id": 1, "typeId": 1, "status": 1,
+                        "installDate": 1, "manufactureDate": 1, "nextReplacementDate": 1, "capacityAh": 1, "voltageV": 1}
+
+async def load_fleet(group_id: Optional[str] = None, battery_query: Optional[dict] = None) -> Fleet:
+    groups = {g["id"]: g async for g in db.groups.find({}, {"_id": 0, "id": 1, "defaultBatteryLifeMonths": 1, "notificationLeadTimeWeeks": 1})}
+    object_query = {"groupId": group_id} if group_id else {}
+    group_of_object = {o["id"]: o.get("groupId") async for o in db.objects.find(object_query, {"_id": 0, "id": 1, "groupId": 1})}
+    types = {t["id"]: t async for t in db.battery_types.find({}, {"_id": 0, "id": 1, "lifeMonths": 1})}
+    query: Dict[str, Any] = {**(battery_query or {}), "status": {"$ne": "REPLACED"}}
+    if group_id: query["objectId"] = {"$in": list(group_of_object)}
+    rows = [b async for b in db.batteries.find(query, LIFECYCLE_PROJECTION)]
+    return Fleet(rows, group_of_object, groups, types)
+
+async def _applied_lifecycle_updates(items: List[tuple]) -> List[bool]:
+    """Pro každé ((objectId, technologyId, id), update) vrátí, zda baterie v DB nese hodnoty z update."""
+    applied = []
+    for start in range(0, len(items), LIFECYCLE_WRITE_BATCH):
+        chunk = items[start:start + LIFECYCLE_WRITE_BATCH]
+        cursor = db.batteries.find(
+            {"objectId": {"$in": list({k[0] for k, _ in chunk})}, "id": {"$in": [k[2] for k, _ in chunk]}},
+            {"_id": 0, "objectId": 1, "technologyId": 1, "id": 1, "nextReplacementDate": 1, "status": 1}
+        )
+        stored = {(d.get("objectId"), d.get("technologyId"), d.get("id")): d async for d in cursor}
+        for key, update in chunk:
+            doc = stored.get(key)
+            applied.append(doc is not None and all(doc.get(f) == v for f, v in update.items()))
+    return applied
+
+async def recompute_battery_lifecycle(dry_run: bool = False, battery_query: Optional[dict] = None) -> dict:
+    """
+    Přepočte nextReplacementDate a status flotily (nebo baterií z `battery_query`); zapisuje jen rozdíly
+    (bulk_write po dávkách). Stav se jen zhoršuje; baterie změněné od načtení se přeskočí (`conflicts`).
+    Přechod do WARNING/CRITICAL vytvoří upozornění.
+    """
+    started = time.perf_counter()
+    fleet = await load_fleet(battery_query=battery_query)
+    due, codes = compute_lifecycle(fleet, np.datetime64(datetime.utcnow().date(), "D"))
+    codes = escalate(fleet, codes)
+    changed = np.flatnonzero(changed_mask(fleet, due, codes))
+    due_str = format_dates(due)
+    writes, pending = [], []
+    for i in changed.tolist():
+        obj_id, tech_id, bat_id = fleet.keys[i]
+        update = {"nextReplacementDate": str(due_str[i]) or None}
+        if codes[i] >= 0: update["status"] = str(STATUS_NAMES[codes[i]])
+        # Zapíše se jen, pokud baterii mezitím nikdo neupravil (jinak ji vezme další přepočet)
+        read_due, read_status = fleet.read_values[i]
+        writes.append(UpdateOne({"objectId": obj_id, "technologyId": tech_id, "id": bat_id,
+                                 "nextReplacementDate": read_due, "status": read_status}, {"$set": update}))
+        pending.append((i, update))
+    result = {"batteries": fleet.size, "changed": len(writes),
+              "objects": len({fleet.keys[i][0] for i, _ in pending}), "dryRun": dry_run}
+    if dry_run or not writes:
+        return {**result, "tookMs": round((time.perf_counter() - started) * 1000, 1)}
+
+    matched = 0
+    for start in range(0, len(writes), LIFECYCLE_WRITE_BATCH):
+        matched += (await db.batteries.bulk_write(writes[start:start + LIFECYCLE_WRITE_BATCH], ordered=False)).matched_count
+    result["conflicts"] = len(writes) - matched
+    if matched < len(writes):
+        # bulk_write nevrací výsledek po operacích - přeskočené baterie se poznají podle stavu v DB
+        applied = await _applied_lifecycle_updates([(fleet.keys[i], update) for i, update in pending])
+        pending = [p for p, ok in zip(pending, applied) if ok]
+    # Revize, události i upozornění jen pro baterie, jejichž zápis opravdu prošel
+    touched, alerts = {}, []
+    for i, update in pending:
+        obj_id, tech_id, bat_id = fleet.keys[i]
+        touched.setdefault(obj_id, []).append({"id": bat_id, "technologyId": tech_id, **update})
+        if update.get("status") in NOTIFY_STATUSES and update["status"] != fleet.current_status[i]:
+            alerts.append(notification_doc(NOTIFY_STATUSES[update["status"]], obj_id, fleet.group_of_object.get(obj_id),
+                                           bat_id, update["nextReplacementDate"], technologyId=tech_id))
+    result["objects"] = len(touched)
+    if not touched:
+        return {**result, "notifications": 0, "tookMs": round((time.perf_counter() - started) * 1000, 1)}
+    # Jedna rezervace rozsahu revizí pro všechny dotčené objekty místo $inc po jednom
+    first_rev, now = await reserve_object_revisions(len(touched)), datetime.utcnow().isoformat()
+    obj_writes = [UpdateOne({"id": obj_id}, {"$set": {"rev": first_rev + n, "updatedAt": now}}) for n, obj_id in enumerate(touched)]
+    for start in range(0, len(obj_writes), LIFECYCLE_WRITE_BATCH):
+        await db.objects.bulk_write(obj_writes[start:start + LIFECYCLE_WRITE_BATCH], ordered=False)
+    invalidate_stats_cache()
+    if CHANGE_FEED_MODE == "local":
+        for n, (obj_id, batteries) in enumerate(touched.items()):
+            broker.publish({"entity": "object", "op": "batteries.lifecycle", "id": obj_id,
+                            "groupId": fleet.group_of_object.get(obj_id), "rev": first_rev + n, "data": batteries})
+    result["notifications"] = await materialise_notifications(alerts)
+    return {**result, "tookMs": round((time.perf_counter() - started) * 1000, 1)}
+
+@app.post("/batteries/recompute")
+async def recompute_batteries(dryRun: bool = False, user: dict = Depends(get_current_admin)):
+    return await recompute_battery_lifecycle(dryRun)
+
+@app.get("/forecast/replacements")
+async def get_replacement_forecast(
+    months: int = Query(12, ge=1, le=FORECAST_MAX_MONTHS),
+    groupId: Optional[str] = None,
+    user: dict = Depends(get_current_user)
+):
+    """
+    Kolik baterií bude potřeba vyměnit v jednotlivých měsících (od aktuálního), celkem a po typech.
+    Termíny se počítají stejně jako při přepočtu, takže výhled nezávisí na tom, kdy přepočet proběhl.
+    """
+    cache_key = f"forecast:{groupId or '*'}:{months}"
+    cached = stats_cache.get(cache_key)
+    if cached is not None: return cached
+    fleet = await load_fleet(groupId)
+    today = np.datetime64(datetime.utcnow().date(), "D")
+    due, _ = compute_lifecycle(fleet, today)
+    result = {"groupId": groupId, "batteries": fleet.size, **monthly_forecast(fleet, due, today, months)}
+    stats_cache.set(cache_key, result)
+    return result
+
+# ==========================================
+# --- PLÁNOVAČ A UPOZORNĚNÍ ---
+# ==========================================
+# Periodické úlohy (scheduler.py) spouští jen jeden worker - držitel zámku `leases.scheduler`.
+# Zámek se obnovuje před každou úlohou; když držitel spadne, převezme ho jiný worker po vypršení.
+# Stav úloh (datum posledního úspěšného běhu, metriky) je v `scheduler_jobs`.
+SCHEDULER_LEASE_ID = "scheduler"
+SCHEDULER_LEASE_SECONDS = SCHEDULER_INTERVAL_SECONDS * 2 + 60
+WORKER_ID = uuid.uuid4().hex
+NOTIFY_STATUSES = {"WARNING": "BATTERY_DUE", "CRITICAL": "BATTERY_OVERDUE"}
+NOTIFICATION_PAGE_SIZE = 50
+
+scheduler = Scheduler()
+
+def _shift_day(day: str, days: int) -> str:
+    return (datetime.strptime(day[:10], "%Y-%m-%d") + timedelta(days=days)).strftime("%Y-%m-%d")
+
+def notification_doc(kind: str, obj_id: str, group_id: Optional[str], item_id: str, due_date: Optional[str], **extra) -> dict:
+    return {"id": uuid.uuid4().hex, "key": f"{kind}:{obj_id}:{item_id}:{due_date}", "type": kind,
+            "objectId": obj_id, "groupId": group_id, "itemId": item_id, "dueDate": due_date,
+            "createdAt": datetime.utcnow().isoformat(), "read": False, **extra}
+
+async def materialise_notifications(docs: List[dict]) -> int:
+    """Upsert podle `key` (položka + termín) - stejné upozornění vznikne jen jednou. Vrací počet nových."""
+    if not docs: return 0
+    object_ids = list({d["objectId"] for d in docs})
+    names = {o["id"]: o.get("name") async for o in db.objects.find({"id": {"$in": object_ids}}, {"_id": 0, "id": 1, "name": 1})}
+    created = 0
+    for start in range(0, len(docs), LIFECYCLE_WRITE_BATCH):
+        batch = [{**d, "objectName": names.get(d["objectId"])} for d in docs[start:start + LIFECYCLE_WRITE_BATCH]]
+        result = await db.notifications.bulk_write(
+            [UpdateOne({"key": d["key"]}, {"$setOnInsert": d}, upsert=True) for d in batch], ordered=False
+        )
+        created += result.upserted_count
+        if CHANGE_FEED_MODE == "local":
+            for index in result.upserted_ids:
+                d = {k: v for k, v in batch[index].items() if k != "_id"}
+                broker.publish({"entity": "notification", "op": "create", "id": d["id"], "groupId": d["groupId"], "data": d})
+    return created
+
+async def group_lead_days() -> Dict[Optional[str], int]:
+    """Předstih upozornění ve dnech podle skupiny; klíč None = objekty bez skupiny."""
+    leads: Dict[Optional[str], int] = {None: DEFAULT_LEAD_TIME_WEEKS * 7}
+    async for g in db.groups.find({}, {"_id": 0, "id": 1, "notificationLeadTimeWeeks": 1}):
+        leads[g["id"]] = (g.get("notificationLeadTimeWeeks") or DEFAULT_LEAD_TIME_WEEKS) * 7
+    return leads
+
+def _event_alert(obj: dict, event: dict, leads: Dict[Optional[str], int], today: str) -> Optional[dict]:
+    """EVENT_DUE, pokud je událost dnes v předstihu své skupiny."""
+    due = event["nextDate"][:10]
+    alert_from = _shift_day(due, -leads.get(obj.get("groupId"), leads[None]))
+    if alert_from > today: return None
+    return notification_doc("EVENT_DUE", obj["id"], obj.get("groupId"), event["id"], due, title=event.get("title"))
+
+@scheduler.job("batteryStatus")
+async def age_battery_statuses(today: str) -> int:
+    """
+    Přepočet celé flotily jedním vektorovým průchodem. Okno od posledního běhu nestačí - baterie už po termínu,
+    změna předstihu skupiny nebo životnosti typu posunou stav i bez průchodu termínu; zapisují se jen rozdíly.
+    """
+    return (await recompute_battery_lifecycle())["changed"]
+
+@scheduler.job("eventAlerts")
+async def alert_upcoming_events(today: str) -> int:
+    """
+    Upozornění na aktivní pravidelné události, které jsou právě v předstihu skupiny (notificationLeadTimeWeeks).
+    Vyhodnocuje se celý předstih, ne jen přírůstek od posledního běhu (událost založená rovnou v předstihu, změna
+    předstihu) - opakovaná upozornění odfiltruje unikátní `key`. Události po termínu posune recurringEvents.
+    """
+    leads = await group_lead_days()
+    window = {"isActive": True, "nextDate": {"$gte": today, "$lt": _shift_day(today, 1 + max(leads.values()))}}
+    pipeline = [
+        {"$match": {"scheduledEvents": {"$elemMatch": window}}},
+        {"$unwind": "$scheduledEvents"},
+        {"$match": {f"scheduledEvents.{k}": v for k, v in window.items()}},
+        {"$project": {"_id": 0, "id": 1, "groupId": 1, "event": "$scheduledEvents"}},
+    ]
+    alerts = [a async for row in db.objects.aggregate(pipeline) if row["event"].get("id") and (a := _event_alert(row, row["event"], leads, today))]
+    return await materialise_notifications(alerts)
+
+@scheduler.job("recurringEvents")
+async def advance_recurring_events(today: str) -> int:
+    """
+    Posune nextDate aktivních opakovaných událostí po termínu na další výskyt podle intervalu.
+    Bere všechny události po termínu, ne jen od posledního běhu - uživatel může nextDate přepsat do minulosti.
+    """
+    query = {"scheduledEvents": {"$elemMatch": {"isActive": True, "nextDate": {"$lt": today}, "interval": {"$in": list(INTERVAL_MONTHS)}}}}
+    updates = []
+    async for obj in db.objects.find(query, {"_id": 0, "id": 1, "groupId": 1, "scheduledEvents": 1}):
+        moved = {}
+        for event in obj.get("scheduledEvents") or []:
+            next_date = event.get("nextDate")
+            # Bez id nejde událost adresovat array filtrem (a upozornění by neměla klíč)
+            if not event.get("id") or not event.get("isActive") or not isinstance(next_date, str) or next_date[:10] >= today: continue
+            advanced = advance_date(next_date, event.get("interval"), today)
+            if advanced: moved[event["id"]] = {**event, "nextDate": advanced}
+        if moved: updates.append((obj, moved))
+    if not updates: return 0
+
+    first_rev, now = await reserve_object_revisions(len(updates)), datetime.utcnow().isoformat()
+    writes = [
+        UpdateOne({"id": obj["id"]},
+                  {"$set": {**{f"scheduledEvents.$[e{k}].nextDate": e["nextDate"] for k, e in enumerate(moved.values())},
+                            "rev": first_rev + n, "updatedAt": now}},
+                  array_filters=[{f"e{k}.id": event_id} for k, event_id in enumerate(moved)])
+        for n, (obj, moved) in enumerate(updates)
+    ]
+    for start in range(0, len(writes), LIFECYCLE_WRITE_BATCH):
+        await db.objects.bulk_write(writes[start:start + LIFECYCLE_WRITE_BATCH], ordered=False)
+    invalidate_stats_cache()
+    if CHANGE_FEED_MODE == "local":
+        for n, (obj, moved) in enumerate(updates):
+            broker.publish({"entity": "object", "op": "scheduledEvents.advance", "id": obj["id"], "groupId": obj.get("groupId"),
+                            "rev": first_rev + n, "data": [{"id": e["id"], "nextDate": e["nextDate"]} for e in moved.values()]})
+    # Nový termín může ležet rovnou v předstihu (měsíční událost, 4 týdny) - eventAlerts ho už neuvidí
+    leads = await group_lead_days()
+    await materialise_notifications([a for obj, moved in updates for e in moved.values() if (a := _event_alert(obj, e, leads, today))])
+    return sum(len(moved) for _, moved in updates)
+
+async def acquire_scheduler_lease() -> bool:
+    """Získá nebo prodlouží zámek plánovače. Zámek jiného workeru, který ještě nevypršel, vrací False."""
+    now = datetime.utcnow()
+    try:
+        await db.leases.update_one(
+            {"id": SCHEDULER_LEASE_ID, "$or": [{"owner": WORKER_ID}, {"expiresAt": {"$lt": now.isoformat()}}]},
+            {"$set": {"owner": WORKER_ID, "renewedAt": now.isoformat(),
+                      "expiresAt": (now + timedelta(seconds=SCHEDULER_LEASE_SECONDS)).isoformat()}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def run_scheduled_jobs() -> bool:
+    """Jedno kolo všech úloh. Bez zámku (nebo při jeho ztrátě) skončí a vrátí False."""
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    for name in scheduler.jobs:
+        if not await acquire_scheduler_lease(): return False
+        metrics = await scheduler.run(name, today)
+        update = {k: metrics[k] for k in ("lastRunAt", "lastDurationMs", "lastProcessed", "lastError")}
+        update["worker"] = WORKER_ID
+        if metrics["lastError"] is None: update["lastRunDate"] = today
+        await db.scheduler_jobs.update_one(
+            {"id": name},
+            {"$set": update, "$inc": {"runs": 1, "failures": int(metrics["lastError"] is not None),
+                                      "totalProcessed": metrics["lastProcessed"] or 0}},
+            upsert=True
+        )
+    return True
+
+async def scheduler_loop():
+    while True:
+        try:
+            await run_scheduled_jobs()
+        except Exception:
+            logger.exception("Scheduler round failed, retrying in %s s", SCHEDULER_INTERVAL_SECONDS)
+        await asyncio.sleep(SCHEDULER_INTERVAL_SECONDS)
+
+@app.get("/notifications")
+async def get_notifications(
+    groupId: Optional[str] = None,
+    unread: bool = False,
+    before: Optional[str] = None,
+    limit: int = Query(NOTIFICATION_PAGE_SIZE, ge=1, le=500),
+    user: dict = Depends(get_current_user)
+):
+    """Upozornění od nejnovějších, keyset podle (createdAt, id). Další stránka = before=<nextBefore>."""
+    query: Dict[str, Any] = {}
+    if groupId: query["groupId"] = groupId
+    if unread: query["read"] = False
+    if before:
+        before_at, before_id = (before.split("|", 1) + [""])[:2]
+        query["$or"] = [{"createdAt": {"$lt": before_at}}, {"createdAt": before_at, "id": {"$lt": before_id}}]
+    items = [d async for d in db.notifications.find(query, {"_id": 0, "key": 0}).sort([("createdAt", -1), ("id", -1)]).limit(limit)]
+    next_before = f"{items[-1]['createdAt']}|{items[-1]['id']}" if len(items) == limit else None
+    return {"items": items, "nextBefore": next_before}
+
+@app.patch("/notifications/{notification_id}")
+async def update_notification(notification_id: str, update: dict = Body(...), user: dict = Depends(get_current_user)):
+    doc = await db.notifications.find_one_and_update(
+        {"id": notification_id}, {"$set": {"read": bool(update.get("read", True))}},
+        projection={"_id": 0, "key": 0}, return_document=ReturnDocument.AFTER
+    )
+    if not doc: raise HTTPException(404, "Notification not found")
+    return doc
+
+@app.get("/admin/scheduler")
+async def get_scheduler_status(user: dict = Depends(get_current_admin)):
+    return {
+        "enabled": SCHEDULER_ENABLED, "worker": WORKER_ID, "intervalSeconds": SCHEDULER_INTERVAL_SECONDS,
+        "lease": await db.leases.find_one({"id": SCHEDULER_LEASE_ID}, {"_id": 0}),
+        "jobs": [j async for j in db.scheduler_jobs.find({}, {"_id": 0})],
+        "local": scheduler.stats(),
+    }
+
+@app.post("/admin/scheduler/run")
+async def run_scheduler_now(user: dict = Depends(get_current_admin)):
+    """Okamžité kolo úloh; jen pokud tenhle worker zámek získá (jinak úlohy právě běží jinde)."""
+    if not await run_scheduled_jobs(): raise HTTPException(409, "Scheduler lease is held by another worker")
+    return {"status": "ok", "jobs": scheduler.stats()}
+
+# ==========================================
+# --- INDEXY A AUDIT DOTAZŮ ---
+# ==========================================
+
+# Deklarativní registr indexů: kolekce -> [(klíče, volby)]. Aplikuje se idempotentně při startu.
+INDEX_REGISTRY: Dict[str, List[tuple]] = {
+    "objects": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("groupId", ASCENDING), ("id", ASCENDING)], {}),
+        ([("scheduledEvents.nextDate", ASCENDING)], {}),
+        ([("rev", ASCENDING)], {}),
+        ([("location", "2dsphere")], {}),
+    ],
+    "object_tombstones": [([("id", ASCENDING)], {"unique": True}), ([("rev", ASCENDING)], {})],
+    "batteries": [
+        ([("objectId", ASCENDING), ("technologyId", ASCENDING), ("id", ASCENDING)], {"unique": True}),
+        ([("status", ASCENDING), ("nextReplacementDate", ASCENDING)], {}),
+        ([("nextReplacementDate", ASCENDING)], {}),
+        ([("typeId", ASCENDING)], {}),
+    ],
+    "logs": [
+        ([("objectId", ASCENDING), ("id", ASCENDING)], {"unique": True}),
+        ([("objectId", ASCENDING), ("date", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    "users": [
+        ([("email", ASCENDING)], {"unique": True}),
+        ([("id", ASCENDING)], {}),
+    ],
+    "reports": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("objectId", ASCENDING), ("createdAt", DESCENDING)], {}),
+        ([("createdAt", DESCENDING)], {}),
+    ],
+    "groups": [([("id", ASCENDING)], {"unique": True})],
+    "battery_types": [([("id", ASCENDING)], {"unique": True})],
+    "settings": [([("id", ASCENDING)], {"unique": True})],
+    "templates": [([("id", ASCENDING)], {})],
+    "counters": [([("id", ASCENDING)], {"unique": True})],
+    "upload_blobs": [([("id", ASCENDING)], {"unique": True}), ([("path", ASCENDING)], {})],
+    "render_jobs": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("reportId", ASCENDING), ("reportUpdatedAt", ASCENDING)], {"unique": True}),
+        ([("status", ASCENDING), ("createdAt", ASCENDING)], {}),
+    ],
+    "migrations": [([("id", ASCENDING)], {"unique": True})],
+    "notifications": [
+        ([("key", ASCENDING)], {"unique": True}),
+        ([("id", ASCENDING)], {}),
+        ([("createdAt", DESCENDING), ("id", DESCENDING)], {}),
+        ([("groupId", ASCENDING), ("createdAt", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    "leases": [([("id", ASCENDING)], {"unique": True})],
+    "scheduler_jobs": [([("id", ASCENDING)], {"unique": True})],
+}
+
+# Výsledek posledního bootstrapu (pro admin audit)
+index_bootstrap_report: List[dict] = []
+
+async def ensure_indexes():
+    """Vytvoří chybějící indexy z registru. Chyba jednoho indexu (např. duplicity) nezastaví start."""
+    index_bootstrap_report.clear()
+    for coll_name, indexes in INDEX_REGISTRY.items():
+        for keys, options in indexes:
+            entry = {"collection": coll_name, "keys": keys, **options}
+            try:
+                entry["name"] = await db[coll_name].create_index(keys, **options)
+                entry["ok"] = True
+            except OperationFailure as e:
+                entry["ok"] = False
+                entry["error"] = str(e)
+            index_bootstrap_report.append(entry)
+
+# Známé tvary dotazů z tohoto souboru (ukázkové hodnoty - explain řeší jen plán, ne data)
+QUERY_SHAPES: List[dict] = [
+    {"name": "objects.by_id", "collection": "objects", "filter": {"id": "x"}},
+    {"name": "objects.by_group_page", "collection": "objects", "filter": {"groupId": "x"}, "sort": {"id": 1}},
+    {"name": "objects.keyset_page", "collection": "objects", "filter": {"id": {"$gt": "x"}}, "sort": {"id": 1}},
+    {"name": "objects.changes", "collection": "objects", "filter": {"rev": {"$gt": 0}}, "sort": {"rev": 1}},
+    {"name": "objects.map_window", "collection": "objects", "filter": {"location": {"$geoWithin": {"$geometry": {
+        "type": "Polygon", "coordinates": [[[14.0, 49.0], [15.0, 49.0], [15.0, 50.0], [14.0, 50.0], [14.0, 49.0]]]}}}}},
+    {"name": "object_tombstones.changes", "collection": "object_tombstones", "filter": {"rev": {"$gt": 0}}, "sort": {"rev": 1}},
+    {"name": "objects.events_window", "collection": "objects", "filter": {"scheduledEvents.nextDate": {"$gte": "2000-01-01", "$lte": "2000-12-31"}}},
+    {"name": "batteries.by_object", "collection": "batteries", "filter": {"objectId": "x"}},
+    {"name": "batteries.by_key", "collection": "batteries", "filter": {"objectId": "x", "technologyId": "x", "id": "x"}},
+    {"name": "batteries.due_window", "collection": "batteries", "filter": {"nextReplacementDate": {"$gte": "2000-01-01", "$lte": "2000-12-31"}}},
+    {"name": "batteries.by_status", "collection": "batteries", "filter": {"status": {"$in": ["WARNING", "CRITICAL"]}}},
+    {"name": "planner.batteries", "collection": "batteries", "filter": {"$or": planner_battery_branches("2000-01-01", "2000-01-31", "2000-02-28")}},
+    {"name": "logs.page", "collection": "logs", "filter": {"objectId": "x", "date": {"$lt": "x"}}, "sort": {"date": -1, "id": -1}},
+    {"name": "notifications.page", "collection": "notifications", "filter": {"groupId": "x", "createdAt": {"$lt": "x"}}, "sort": {"createdAt": -1, "id": -1}},
+    {"name": "leases.by_id", "collection": "leases", "filter": {"id": "scheduler"}},
+    {"name": "users.by_email", "collection": "users", "filter": {"email": "x"}},
+    {"name": "users.by_id", "collection": "users", "filter": {"id": "x"}},
+    {"name": "reports.by_id", "collection": "reports", "filter": {"id": "x"}},
+    {"name": "reports.by_object", "collection": "reports", "filter": {"objectId": "x"}, "sort": {"createdAt": -1}},
+    {"name": "reports.recent", "collection": "reports", "filter": {}, "sort": {"createdAt": -1}},
+    {"name": "groups.by_id", "collection": "groups", "filter": {"id": "x"}},
+    {"name": "battery_types.by_id", "collection": "battery_types", "filter": {"id": "x"}},
+    {"name": "settings.by_id", "collection": "settings", "filter": {"id": "global_settings"}},
+    {"name": "counters.by_id", "collection": "counters", "filter": {"id": "reports_2000"}},
+]
+
+def _plan_stages(plan: Any) -> List[str]:
+    """Všechny názvy stage v (vnořeném) plánu dotazu."""
+    stages: List[str] = []
+    if isinstance(plan, dict):
+        if "stage" in plan: stages.append(plan["stage"])
+        for value in plan.values(): stages += _plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan: stages += _plan_stages(item)
+    return stages
+
+@app.get("/admin/query-audit")
+async def query_audit(user: dict = Depends(get_current_admin)):
+    """Spustí explain() nad známými tvary dotazů a nahlásí ty, které skončí na COLLSCAN."""
+    results = []
+    for shape in QUERY_SHAPES:
+        find_cmd = {"find": shape["collection"], "filter": shape["filter"]}
+        if "sort" in shape: find_cmd["sort"] = shape["sort"]
+        explain = await db.command({"explain": find_cmd, "verbosity": "queryPlanner"})
+        stages = _plan_stages(explain.get("queryPlanner", {}).get("winningPlan", {}))
+        results.append({"name": shape["name"], "collection": shape["collection"],
+                        "stages": stages, "collscan": "COLLSCAN" in stages})
+    return {
+        "collscans": [r["name"] for r in results if r["collscan"]],
+        "queries": results,
+        "indexes": index_bootstrap_report,
+    }
+
+async def run_migrations():
+    """Online migrace na pozadí; plánovač startuje až po nich (úlohy čtou jen kolekce batteries a logs)."""
+    try:
+        await migrate_embedded_batteries()
+        await migrate_embedded_logs()
+        await migrate_object_revisions()
+    except Exception:
+        logger.exception("Online migration failed, scheduler not started")
+        return
+    if SCHEDULER_ENABLED: await scheduler_loop()
+
 @app.on_event("startup")
 async def startup_db_client():
+    await sync_object_locations({"lat": {"$exists": True}, "location": {"$exists": False}})
+    await dedupe_render_jobs()
+    await ensure_indexes()
+    asyncio.create_task(run_migrations())
+    await seed_report_counters()
+    await start_pdf_workers()
+    if CHANGE_FEED_MODE == "mongo": asyncio.create_task(watch_mongo_changes())
+    asyncio.create_task(change_listener())
     if not await db.users.find_one({}):
         await db.users.insert_one({
             "id": "admin", "name": "Admin", "email": ADMIN_EMAIL, "role": "ADMIN", 
-            "isAuthorized": True, "hashed_password": get_password_hash(ADMIN_PASSWORD)
+            "isAuthorized": True, "hashed_password": await get_password_hash(ADMIN_PASSWORD)
         })
     if not await db.templates.find_one({}):
         await db.templates.insert_many([
@@ -30,6 +30,7 @@ class BatteryTypeModel(BaseModel):
     capacityAh: float  # 17
     voltageV: float    # 12
     technology: Optional[str] = "VRLA" # Volitelné (GEL, AGM...)
+    lifeMonths: Optional[int] = None   # Životnost podle výrobce; jinak výchozí životnost skupiny
 
 class Battery(BaseModel):
     id: str
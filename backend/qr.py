@@ -0,0 +1,121 @@
+"""
+QR kódy objektů.
+
+Vykreslení (StyledPilImage + RoundedModuleDrawer) je náročné na CPU, proto běží v process poolu.
+Hotová PNG se drží v LRU cache v paměti a na disku (klíč = hash cílové URL, tj. PUBLIC_URL + id objektu).
+"""
+import os
+import io
+import asyncio
+import hashlib
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+QR_WORKERS = int(os.getenv("QR_WORKERS", "2"))
+QR_CACHE_DIR = os.getenv("QR_CACHE_DIR", os.path.join("cache", "qr"))
+QR_MEMORY_CACHE_SIZE = int(os.getenv("QR_MEMORY_CACHE_SIZE", "512"))
+
+# Tiskový arch: A4 při 300 DPI, 3 x 4 štítky
+SHEET_SIZE = (2480, 3508)
+SHEET_COLS, SHEET_ROWS = 3, 4
+SHEET_MARGIN = 120
+
+_executor: Optional[ProcessPoolExecutor] = None
+_memory_cache: "OrderedDict[str, bytes]" = OrderedDict()
+_in_flight: Dict[str, asyncio.Future] = {}
+
+def _get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None: _executor = ProcessPoolExecutor(max_workers=QR_WORKERS)
+    return _executor
+
+def render_qr_png(target_url: str) -> bytes:
+    """Běží v pracovním procesu: vykreslí QR kód s vysokou korekcí chyb jako PNG."""
+    import qrcode
+    from qrcode.image.styledpil import StyledPilImage
+    from qrcode.image.styles.moduledrawers import RoundedModuleDrawer
+
+    qr = qrcode.QRCode(version=1, error_correction=qrcode.constants.ERROR_CORRECT_H, box_size=10, border=4)
+    qr.add_data(target_url)
+    qr.make(fit=True)
+    img = qr.make_image(image_factory=StyledPilImage, module_drawer=RoundedModuleDrawer())
+    buffer = io.BytesIO()
+    img.save(buffer, format="PNG")
+    return buffer.getvalue()
+
+def render_qr_sheet_pdf(items: List[Tuple[str, bytes]]) -> bytes:
+    """Běží v pracovním procesu: poskládá QR kódy s popisky na stránky A4 a uloží jako vícestránkové PDF."""
+    from PIL import Image, ImageDraw, ImageFont
+
+    try: font = ImageFont.truetype("DejaVuSans.ttf", 40)
+    except OSError: font = ImageFont.load_default()
+    bitmap = not isinstance(font, ImageFont.FreeTypeFont)
+
+    per_page = SHEET_COLS * SHEET_ROWS
+    cell_w = (SHEET_SIZE[0] - 2 * SHEET_MARGIN) // SHEET_COLS
+    cell_h = (SHEET_SIZE[1] - 2 * SHEET_MARGIN) // SHEET_ROWS
+    qr_size = min(cell_w, cell_h - 80) - 40
+
+    pages = []
+    for start in range(0, len(items), per_page):
+        page = Image.new("RGB", SHEET_SIZE, "white")
+        draw = ImageDraw.Draw(page)
+        for i, (label, png) in enumerate(items[start:start + per_page]):
+            col, row = i % SHEET_COLS, i // SHEET_COLS
+            x = SHEET_MARGIN + col * cell_w
+            y = SHEET_MARGIN + row * cell_h
+            with Image.open(io.BytesIO(png)) as qr_img:
+                page.paste(qr_img.convert("RGB").resize((qr_size, qr_size)), (x + (cell_w - qr_size) // 2, y))
+            # Středíme ručně - kotvu (anchor) výchozí bitmapový font nepodporuje; umí jen latin-1, proto bez diakritiky
+            text = label[:40]
+            if bitmap: text = unicodedata.normalize("NFKD", text).encode("latin-1", "ignore").decode("latin-1")
+            draw.text((x + (cell_w - draw.textlength(text, font=font)) // 2, y + qr_size + 20), text, fill="black", font=font)
+        pages.append(page)
+
+    buffer = io.BytesIO()
+    pages[0].save(buffer, format="PDF", save_all=True, append_images=pages[1:], resolution=300)
+    return buffer.getvalue()
+
+def _remember(key: str, png: bytes):
+    _memory_cache[key] = png
+    _memory_cache.move_to_end(key)
+    while len(_memory_cache) > QR_MEMORY_CACHE_SIZE: _memory_cache.popitem(last=False)
+
+def _read_disk(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f: return f.read()
+    except FileNotFoundError:
+        return None
+
+def _write_disk(path: str, png: bytes):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f: f.write(png)
+    os.replace(tmp, path)
+
+async def get_qr_png(target_url: str) -> bytes:
+    """PNG s QR kódem pro URL: paměť -> disk -> vykreslení v poolu (souběžné požadavky sdílí jeden job)."""
+    key = hashlib.sha256(target_url.encode("utf-8")).hexdigest()
+    png = _memory_cache.get(key)
+    if png is not None:
+        _memory_cache.move_to_end(key)
+        return png
+
+    path = os.path.join(QR_CACHE_DIR, key[:2], f"{key}.png")
+    png = await asyncio.to_thread(_read_disk, path)
+    if png is None:
+        if key in _in_flight: return await _in_flight[key]
+        future = asyncio.get_running_loop().run_in_executor(_get_executor(), render_qr_png, target_url)
+        _in_flight[key] = future
+        try:
+            png = await future
+        finally:
+            _in_flight.pop(key, None)
+        await asyncio.to_thread(_write_disk, path, png)
+    _remember(key, png)
+    return png
+
+async def build_qr_sheet_pdf(items: List[Tuple[str, bytes]]) -> bytes:
+    return await asyncio.get_running_loop().run_in_executor(_get_executor(), render_qr_sheet_pdf, items)
@@ -0,0 +1,124 @@
+"""
+Šablona HTML protokolu revize (ServiceReport).
+
+Šablona se zkompiluje jednou při importu modulu, render je jen dosazení hodnot.
+Modul nezávisí na FastAPI ani DB, takže ho může použít i pracovní proces pro PDF.
+"""
+from string import Template
+
+REPORT_TEMPLATE = Template("""
+    <!DOCTYPE html>
+    <html>
+    <head>
+        <meta charset="utf-8">
+        <style>
+            body { font-family: DejaVu Sans, sans-serif; padding: 40px; color: #333; }
+            .header { text-align: center; border-bottom: 2px solid #333; margin-bottom: 20px; padding-bottom: 10px; }
+            h1 { font-size: 24px; margin: 0; }
+            h2 { font-size: 16px; margin: 5px 0 0; color: #666; }
+            
+            .section { margin-bottom: 20px; }
+            .grid { display: grid; grid-template-columns: 1fr 1fr; gap: 20px; }
+            
+            .box { border: 1px solid #ddd; padding: 15px; border-radius: 5px; background: #f9f9f9; }
+            .box h3 { margin-top: 0; font-size: 14px; text-transform: uppercase; color: #555; }
+            
+            table { width: 100%; border-collapse: collapse; margin-top: 10px; font-size: 12px; }
+            th, td { border: 1px solid #ccc; padding: 8px; text-align: left; }
+            th { background: #eee; }
+            
+            .footer { margin-top: 50px; border-top: 1px solid #ccc; padding-top: 20px; font-size: 12px; }
+        </style>
+    </head>
+    <body>
+        <div class="header">
+            <h1>ZPRÁVA O REVIZI $type</h1>
+            <h2>Číslo protokolu: $reportNumber</h2>
+        </div>
+        
+        <div class="grid section">
+            <div class="box">
+                <h3>Objednatel</h3>
+                <p><strong>$customerName</strong></p>
+                <p>IČ: $customerIco</p>
+                <p>$customerStreet</p>
+            </div>
+            <div class="box">
+                <h3>Dodavatel (Servis)</h3>
+                <p><strong>$supplierName</strong></p>
+                <p>IČ: $supplierIco</p>
+                <p>$supplierStreet</p>
+            </div>
+        </div>
+
+        <div class="section">
+             <h3>Předmět revize</h3>
+             <p>$subject</p>
+        </div>
+
+        <div class="section">
+            <h3>Měření a zkoušky</h3>
+            <table>
+                <tr>
+                    <th style="width: 50%">Měření</th>
+                    <th>Hodnota</th>
+                    <th>Verdikt</th>
+                </tr>
+                $measurementRows
+            </table>
+        </div>
+        
+        <div class="section box" style="background: #fff; border-color: #333;">
+            <h3>Celkový posudek</h3>
+            <p style="font-size: 14px; font-weight: bold;">$conclusion</p>
+        </div>
+
+        <div class="footer grid">
+            <div>
+                Datum provedení: $dateExecution<br/>
+                Příští revize: <strong>$dateNext</strong>
+            </div>
+            <div style="text-align: right;">
+                Technik: $technicianName<br/>
+                Osvědčení: $technicianCertificate
+            </div>
+        </div>
+    </body>
+    </html>
+    """)
+
+MEASUREMENT_ROW_TEMPLATE = Template(
+    "<tr><td>$label</td><td><strong>$value</strong> $unit</td><td>$verdict</td></tr>"
+)
+
+def render_report_html(doc: dict) -> str:
+    """Vyrenderuje HTML protokolu ze záznamu revize (dict z kolekce reports)."""
+    customer = doc.get('customerInfo') or {}
+    supplier = doc.get('supplierInfo') or {}
+    rows = "".join(
+        MEASUREMENT_ROW_TEMPLATE.substitute(label=m['label'], value=m['value'], unit=m.get('unit', ''), verdict=m['verdict'])
+        for m in doc.get('measurements', [])
+    )
+    return REPORT_TEMPLATE.substitute(
+        type=doc.get('type'),
+        reportNumber=doc.get('reportNumber'),
+        customerName=customer.get('name'),
+        customerIco=customer.get('ico', '-'),
+        customerStreet=(customer.get('address') or {}).get('street'),
+        supplierName=supplier.get('name'),
+        supplierIco=supplier.get('ico'),
+        supplierStreet=(supplier.get('address') or {}).get('street'),
+        subject=doc.get('subject'),
+        measurementRows=rows,
+        conclusion=doc.get('conclusion'),
+        dateExecution=doc.get('dateExecution'),
+        dateNext=doc.get('dateNext'),
+        technicianName=doc.get('technicianName'),
+        technicianCertificate=doc.get('technicianCertificate') or '-',
+    )
+
+def render_report_pdf(doc: dict) -> bytes:
+    """Běží v pracovním procesu: HTML protokolu -> PDF přes WeasyPrint (import až tady, je to těžká závislost)."""
+    from weasyprint import HTML
+
+    return HTML(string=render_report_html(doc)).write_pdf()
@@ -0,0 +1,72 @@
+"""
+Periodické úlohy na pozadí (stárnutí stavů baterií, posun pravidelných událostí, upozornění).
+
+Smyčka běží v každém workeru API, úlohy ale spouští jen držitel zámku (lease) v Mongo.
+Každá úloha dostane dnešek a vrací počet zpracovaných položek. Úlohy dělají vždy celý průchod
+(ne přírůstek od posledního běhu) a musí být idempotentní - běh se po chybě opakuje.
+"""
+import calendar
+import logging
+import time
+from datetime import date, datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+# Hodnoty RegularEvent.interval z frontendu -> počet měsíců
+INTERVAL_MONTHS = {"Měsíčně": 1, "Čtvrtletně": 3, "Pololetně": 6, "Ročně": 12, "Každé 2 roky": 24, "Každé 4 roky": 48}
+
+Job = Callable[[str], Awaitable[int]]
+logger = logging.getLogger("batteryguard.scheduler")
+
+def add_months(day: date, months: int) -> date:
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+def advance_date(next_date: str, interval: str, today: str) -> Optional[str]:
+    """
+    Posune termín o celé intervaly na první den >= today. Počítá se vždy od původního data,
+    takže 31. 1. měsíčně dá 29. 2. a pak 31. 3. (žádný posun dne). None = neopakuje se.
+    """
+    step = INTERVAL_MONTHS.get(interval)
+    if not step: return None
+    try:
+        start, target = date.fromisoformat(next_date[:10]), date.fromisoformat(today)
+    except (TypeError, ValueError):
+        return None
+    k = max(1, ((target.year - start.year) * 12 + target.month - start.month) // step)
+    while add_months(start, k * step) < target: k += 1
+    return add_months(start, k * step).isoformat() + next_date[10:]
+
+class Scheduler:
+    def __init__(self):
+        self.jobs: Dict[str, Job] = {}
+        self.metrics: Dict[str, dict] = {}
+
+    def job(self, name: str):
+        """Dekorátor - registruje úlohu; pořadí registrace = pořadí spouštění."""
+        def register(fn: Job) -> Job:
+            self.jobs[name] = fn
+            self.metrics[name] = {"runs": 0, "failures": 0, "totalProcessed": 0, "lastRunAt": None,
+                                  "lastDurationMs": None, "lastProcessed": None, "lastError": None}
+            return fn
+        return register
+
+    async def run(self, name: str, today: str) -> dict:
+        """Spustí úlohu a zapíše metriky. Výjimka se nepropaguje - úloha se zkusí příště znovu."""
+        metrics = self.metrics[name]
+        started = time.perf_counter()
+        metrics["runs"] += 1
+        metrics["lastRunAt"] = datetime.utcnow().isoformat()
+        try:
+            processed = await self.jobs[name](today)
+            metrics.update(lastProcessed=processed, lastError=None)
+            metrics["totalProcessed"] += processed
+        except Exception as e:
+            logger.exception("Scheduled job %s failed", name)
+            metrics["failures"] += 1
+            metrics.update(lastProcessed=None, lastError=str(e))
+        metrics["lastDurationMs"] = round((time.perf_counter() - started) * 1000, 1)
+        return metrics
+
+    def stats(self) -> dict:
+        return {name: dict(m) for name, m in self.metrics.items()}
@@ -0,0 +1,136 @@
+"""
+Fulltextové hledání objektů (název, adresa, popis, kontakty, technologie, výrobní čísla baterií).
+
+Invertovaný index drží API proces v paměti. Texty se porovnávají bez diakritiky a velikosti
+písmen ("Plzeň" = "plzen") a každé slovo dotazu hledá prefix, takže stačí psát začátek slova.
+Telefonní a výrobní čísla se indexují i jako souvislá řada číslic (bez mezer a pomlček).
+"""
+import re
+import bisect
+import unicodedata
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Váha pole = kolik přispěje shoda ve slově k pořadí výsledku
+FIELD_WEIGHTS = {
+    "name": 10.0, "batteries.serialNumber": 8.0, "address": 5.0,
+    "contacts.name": 4.0, "contacts.phone": 4.0, "contacts.email": 3.0,
+    "technologies.name": 3.0, "technicalDescription": 1.0, "description": 1.0,
+}
+EXACT_BONUS = 1.5        # celé slovo má přednost před prefixem
+MIN_DIGITS = 6           # od kolika číslic se hodnota bere jako telefon / výrobní číslo
+MIN_DIGIT_SUFFIX = 4     # nejkratší koncovka čísla, podle které jde hledat
+MAX_HIGHLIGHTS = 3
+_WORD = re.compile(r"[0-9a-z]+")
+
+@lru_cache(maxsize=4096)
+def _fold_char(ch: str) -> str:
+    base = "".join(c for c in unicodedata.normalize("NFKD", ch) if not unicodedata.combining(c))
+    return ((base or ch).lower() or " ")[0]
+
+def fold(text: str) -> str:
+    """Malá písmena bez diakritiky; délka zůstává stejná, takže pozice sedí pro zvýraznění."""
+    return "".join(_fold_char(ch) for ch in text)
+
+def tokenize(value: str) -> Set[str]:
+    tokens = set(_WORD.findall(fold(value)))
+    digits = re.sub(r"\D", "", value)
+    if len(digits) >= MIN_DIGITS:
+        # "+420 777 123 456" najde i "777123456" nebo "123456"
+        tokens.update(digits[i:] for i in range(len(digits) - MIN_DIGIT_SUFFIX + 1))
+    return tokens
+
+def object_fields(obj: dict, serials: Iterable[str]) -> List[Tuple[str, str]]:
+    """Prohledávaná pole objektu jako (cesta, hodnota)."""
+    fields = [(f, obj.get(f)) for f in ("name", "address", "description", "technicalDescription")]
+    for contact in obj.get("contacts") or []:
+        fields += [(f"contacts.{f}", contact.get(f)) for f in ("name", "phone", "email")]
+    for tech in obj.get("technologies") or []:
+        fields.append(("technologies.name", tech.get("name")))
+        # Dosud nezmigrované baterie vnořené v objektu
+        fields += [("batteries.serialNumber", b.get("serialNumber")) for b in tech.get("batteries") or []]
+    fields += [("batteries.serialNumber", s) for s in serials]
+    return [(path, str(value)) for path, value in fields if value]
+
+class SearchIndex:
+    def __init__(self):
+        self._docs: Dict[str, dict] = {}
+        self._postings: Dict[str, Dict[str, float]] = {}
+        self._sorted: Optional[List[str]] = None
+
+    def __len__(self):
+        return len(self._docs)
+
+    def rebuild(self, items: Iterable[Tuple[dict, List[str]]]):
+        fresh = SearchIndex()
+        for obj, serials in items: fresh.replace(obj, serials)
+        self._docs, self._postings, self._sorted = fresh._docs, fresh._postings, None
+
+    def replace(self, obj: dict, serials: Iterable[str] = ()):
+        obj_id = obj["id"]
+        self.remove(obj_id)
+        fields = object_fields(obj, serials)
+        weights: Dict[str, float] = {}
+        for path, value in fields:
+            for token in tokenize(value):
+                weights[token] = max(weights.get(token, 0.0), FIELD_WEIGHTS.get(path, 1.0))
+        for token, weight in weights.items():
+            if token not in self._postings: self._sorted = None
+            self._postings.setdefault(token, {})[obj_id] = weight
+        self._docs[obj_id] = {
+            "meta": {"id": obj_id, "name": obj.get("name"), "address": obj.get("address"), "groupId": obj.get("groupId")},
+            "fields": fields, "tokens": list(weights),
+        }
+
+    def remove(self, obj_id: str):
+        doc = self._docs.pop(obj_id, None)
+        if not doc: return
+        for token in doc["tokens"]:
+            posting = self._postings.get(token)
+            if posting is None: continue
+            posting.pop(obj_id, None)
+            if not posting:
+                del self._postings[token]
+                self._sorted = None
+
+    def _with_prefix(self, term: str) -> List[str]:
+        if self._sorted is None: self._sorted = sorted(self._postings)
+        start = bisect.bisect_left(self._sorted, term)
+        end = bisect.bisect_left(self._sorted, term + "\uffff")
+        return self._sorted[start:end]
+
+    def search(self, query: str, limit: int = 20, group_id: Optional[str] = None) -> List[dict]:
+        """Objekty obsahující všechna slova dotazu (jako prefixy), seřazené podle skóre."""
+        terms = list(dict.fromkeys(_WORD.findall(fold(query))))
+        if not terms: return []
+        scores: Optional[Dict[str, float]] = None
+        for term in terms:
+            matched: Dict[str, float] = {}
+            for token in self._with_prefix(term):
+                bonus = EXACT_BONUS if token == term else 1.0
+                for obj_id, weight in self._postings[token].items():
+                    if scores is not None and obj_id not in scores: continue
+                    matched[obj_id] = max(matched.get(obj_id, 0.0), weight * bonus)
+            scores = matched if scores is None else {k: v + matched[k] for k, v in scores.items() if k in matched}
+            if not scores: return []
+
+        if group_id: scores = {k: v for k, v in scores.items() if self._docs[k]["meta"]["groupId"] == group_id}
+        ranked = sorted(scores.items(), key=lambda kv: (-kv[1], self._docs[kv[0]]["meta"]["name"] or ""))[:limit]
+        return [{**self._docs[obj_id]["meta"], "score": round(score, 2),
+                 "highlights": self._highlights(obj_id, terms)} for obj_id, score in ranked]
+
+    def _highlights(self, obj_id: str, terms: List[str]) -> List[dict]:
+        """Pole se shodou a rozsahy [začátek, konec) v původní hodnotě; nejvýznamnější pole první."""
+        found = []
+        for path, value in self._docs[obj_id]["fields"]:
+            folded = fold(value)
+            ranges = sorted({(m.start(), m.start() + len(term)) for term in terms
+                             for m in re.finditer(r"(?<![0-9a-z])" + re.escape(term), folded)})
+            digits = re.sub(r"\D", "", value)
+            if ranges or any(t.isdigit() and len(digits) >= MIN_DIGITS and t in digits for t in terms):
+                found.append({"field": path, "value": value, "ranges": [list(r) for r in ranges]})
+        found.sort(key=lambda h: -FIELD_WEIGHTS.get(h["field"], 1.0))
+        return found[:MAX_HIGHLIGHTS]
+
+    def stats(self) -> dict:
+        return {"objects": len(self._docs), "tokens": len(self._postings)}
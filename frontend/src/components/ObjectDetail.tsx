@@ -501,7 +501,9 @@ const ObjectDetail: React.FC<ObjectDetailProps> = ({ groups }) => {
 )}
         {activeTab === 'log' && (
           <LogTab
+            objectId={object.id}
             entries={object.logEntries}
+            nextBefore={object.logEntriesNextBefore}
             templates={templates}
           />
         )}
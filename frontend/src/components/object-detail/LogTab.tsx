@@ -1,13 +1,43 @@
-import React from 'react';
-import { BookOpen } from 'lucide-react';
+import React, { useEffect, useState } from 'react';
+import { BookOpen, Loader2 } from 'lucide-react';
 import { LogEntry, FormTemplate } from '../../types';
+import { getApiService } from '../../services/apiService';
 
 interface LogTabProps {
-  entries: LogEntry[];
+  objectId: string;
+  entries: LogEntry[];          // nejnovější stránka z GET /objects/{id}
+  nextBefore?: string | null;   // kurzor na starší záznamy
   templates: FormTemplate[];
 }
 
-export const LogTab: React.FC<LogTabProps> = ({ entries, templates }) => {
+export const LogTab: React.FC<LogTabProps> = ({ objectId, entries: latest, nextBefore, templates }) => {
+  const [older, setOlder] = useState<LogEntry[]>([]);
+  const [cursor, setCursor] = useState<string | null>(nextBefore ?? null);
+  const [loading, setLoading] = useState(false);
+
+  // Nový detail objektu = nová první stránka, dočtené starší záznamy zahodit
+  useEffect(() => {
+    setOlder([]);
+    setCursor(nextBefore ?? null);
+  }, [objectId, nextBefore]);
+
+  const loadOlder = async () => {
+    if (!cursor || loading) return;
+    setLoading(true);
+    try {
+      const page = await getApiService().getLogEntries(objectId, cursor);
+      setOlder(prev => [...prev, ...page.items]);
+      setCursor(page.nextBefore);
+    } catch (e) {
+      alert("Nepodařilo se načíst starší záznamy.");
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  const seen = new Set<string>();
+  const entries = [...(latest || []), ...older].filter(e => !seen.has(e.id) && seen.add(e.id));
+
   return (
     <div className="space-y-4">
       <h3 className="text-sm font-black uppercase tracking-widest text-slate-400 dark:text-slate-500 px-4">Historie záznamů</h3>
@@ -43,6 +73,16 @@ export const LogTab: React.FC<LogTabProps> = ({ entries, templates }) => {
           </div>
         ))
       )}
+      {cursor && (
+        <button
+          onClick={loadOlder}
+          disabled={loading}
+          className="w-full py-3 rounded-2xl text-sm font-bold text-blue-600 dark:text-blue-400 bg-blue-50 dark:bg-blue-500/10 hover:bg-blue-100 dark:hover:bg-blue-500/20 disabled:opacity-50 flex items-center justify-center gap-2"
+        >
+          {loading && <Loader2 className="w-4 h-4 animate-spin" />}
+          Načíst starší záznamy
+        </button>
+      )}
     </div>
   );
 };
\ No newline at end of file
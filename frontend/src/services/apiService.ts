@@ -1,6 +1,6 @@
 // FILE: frontend/src/services/apiService.ts
 
-import { BuildingObject, ObjectGroup, FormTemplate, AppUser, BatteryStatus, BatteryType,CompanySettings,ServiceReport } from '../types';
+import { BuildingObject, ObjectGroup, FormTemplate, AppUser, BatteryStatus, BatteryType,CompanySettings,ServiceReport, LogPage } from '../types';
 import { authService } from './authService'; 
 const TOKEN_KEY = 'bg_auth_token';
 const BASE_URL = '/api'; 
@@ -32,6 +32,7 @@ export interface IApiService {
 
   // Logs
   addLogEntry(objId: string, log: any): Promise<void>;
+  getLogEntries(objId: string, before?: string): Promise<LogPage>;
   
   // Tasks
   addTask(objId: string, task: any): Promise<void>;
@@ -139,6 +140,10 @@ async getCompanySettings(): Promise<CompanySettings> { return this.request('/set
   
   // Logs
   async addLogEntry(objId: string, log: any): Promise<void> { return this.request(`/objects/${objId}/logs`, 'POST', log); }
+  async getLogEntries(objId: string, before?: string): Promise<LogPage> {
+    const query = before ? `?before=${encodeURIComponent(before)}` : '';
+    return this.request(`/objects/${objId}/logs${query}`);
+  }
 
   // Tasks
   async addTask(objId: string, task: any): Promise<void> { return this.request(`/objects/${objId}/tasks`, 'POST', task); }
@@ -132,7 +132,8 @@ export interface BuildingObject {
   technicalDescription?: string; // Pro revize (např. "Ústředna umístěna v 1.PP...")
   contacts?: Contact[];
   technologies: Technology[];
-  logEntries: LogEntry[];
+  logEntries: LogEntry[]; // jen nejnovější záznamy, starší přes getLogEntries
+  logEntriesNextBefore?: string | null;
   scheduledEvents: RegularEvent[];
   pendingIssues?: PendingIssue[];
   groupId?: string;
@@ -174,6 +175,11 @@ export interface LogEntry {
   data: Record<string, string>;
   images?: string[]; // PŘIDÁNO
 }
+
+export interface LogPage {
+  items: LogEntry[];
+  nextBefore: string | null;
+}
 export type FileCategory = 
   | 'REVISION' 
   | 'PROJECT' 